@@ -42,6 +42,7 @@ from lucterios.framework.xferadvance import TITLE_MODIFY
 from lucterios.CORE.parameters import Params
 
 from diacamma.accounting.models import current_system_account, FiscalYear, EntryLineAccount, EntryAccount, get_amount_sum, Third, CostAccounting
+from diacamma.accounting.system import get_mask_filter
 from lucterios.framework import signal_and_lock
 from lucterios.contacts.models import CustomField
 
@@ -81,7 +82,7 @@ class AccountThirdEditor(LucteriosEditor):
     def edit(self, xfer):
         old_account = xfer.get_components("code")
         try:
-            chart_accouts = FiscalYear.get_current().chartsaccount_set.all().filter(code__regex=current_system_account().get_third_mask())
+            chart_accouts = FiscalYear.get_current().chartsaccount_set.all().filter(is_third=True)
             xfer.remove_component("code")
             sel_code = XferCompSelect("code")
             sel_code.set_location(old_account.col, old_account.row, old_account.colspan + 1, old_account.rowspan)
@@ -491,7 +492,7 @@ class BudgetEditor(EntryLineAccountEditor):
         xfer.remove_component("code")
         sel_code = XferCompSelect("code")
         sel_code.set_location(old_account.col, old_account.row, old_account.colspan + 1, old_account.rowspan)
-        for item in FiscalYear.get_current().chartsaccount_set.all().filter(code__regex=code_mask).order_by('code'):
+        for item in FiscalYear.get_current().chartsaccount_set.all().filter(get_mask_filter(code_mask)).order_by('code'):
             sel_code.select_list.append((item.code, six.text_type(item)))
         sel_code.set_value(self.item.code)
         xfer.add_component(sel_code)
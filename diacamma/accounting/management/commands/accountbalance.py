@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+'''
+Rebuild or check balances of accounts
+
+@author: Laurent GAY
+@organization: sd-libre.fr
+@contact: info@sd-libre.fr
+@copyright: 2020 sd-libre.fr
+@license: This file is part of Lucterios.
+
+Lucterios is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Lucterios is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from diacamma.accounting.models import ChartsAccountBalance, FiscalYear
+
+
+class Command(BaseCommand):
+    help = 'Rebuild or check balances of accounts from entry lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', dest='check', default=False, help='Only check balances, without rebuilding')
+        parser.add_argument('--year', type=int, dest='year', default=None, help='Id of fiscal year (all years by default)')
+
+    def handle(self, *args, **options):
+        year = None
+        if options['year'] is not None:
+            year = FiscalYear.objects.filter(id=options['year']).first()
+            if year is None:
+                raise CommandError('Fiscal year #%d unknown' % options['year'])
+        if options['check']:
+            errors = ChartsAccountBalance.check_balance(year)
+            for account_id, journal_id, close, expected_value, stored_value in errors:
+                self.stdout.write('account #%d - journal #%d - close=%s: expected %.4f / stored %.4f' % (account_id, journal_id, close, expected_value, stored_value))
+            if len(errors) > 0:
+                raise CommandError('%d balance(s) in error' % len(errors))
+            self.stdout.write('Balances checked')
+        else:
+            with transaction.atomic():
+                nb_balance = ChartsAccountBalance.rebuild(year)
+            self.stdout.write('%d balance(s) rebuilt' % nb_balance)
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+'''
+Rebuild or check balances of closed fiscal years
+
+@author: Laurent GAY
+@organization: sd-libre.fr
+@contact: info@sd-libre.fr
+@copyright: 2020 sd-libre.fr
+@license: This file is part of Lucterios.
+
+Lucterios is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Lucterios is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from diacamma.accounting.models import ClosedYearBalance, FiscalYear
+
+
+class Command(BaseCommand):
+    help = 'Rebuild or check balances of closed fiscal years from entry lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', dest='check', default=False, help='Only check balances, without rebuilding')
+        parser.add_argument('--year', type=int, dest='year', default=None, help='Id of fiscal year (all closed years by default)')
+
+    def handle(self, *args, **options):
+        if options['year'] is not None:
+            years = list(FiscalYear.objects.filter(id=options['year']))
+            if len(years) == 0:
+                raise CommandError('Fiscal year #%d unknown' % options['year'])
+        else:
+            years = list(FiscalYear.objects.filter(status=2).order_by('begin'))
+        if options['check']:
+            nb_errors = 0
+            for year in years:
+                errors = ClosedYearBalance.check_balance(year)
+                for account_id, journal_id, third_id, costaccounting_id, expected_value, stored_value in errors:
+                    self.stdout.write('year #%d - account #%d - journal #%d - third #%s - cost #%s: expected %.4f / stored %.4f' % (year.id, account_id, journal_id, third_id, costaccounting_id, expected_value, stored_value))
+                nb_errors += len(errors)
+            if nb_errors > 0:
+                raise CommandError('%d balance(s) in error' % nb_errors)
+            self.stdout.write('Balances checked')
+        else:
+            nb_balance = 0
+            with transaction.atomic():
+                for year in years:
+                    nb_balance += ClosedYearBalance.rebuild(year)
+            self.stdout.write('%d balance(s) rebuilt' % nb_balance)
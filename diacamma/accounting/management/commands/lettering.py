@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+'''
+Automatic lettering of third accounts
+
+@author: Laurent GAY
+@organization: sd-libre.fr
+@contact: info@sd-libre.fr
+@copyright: 2020 sd-libre.fr
+@license: This file is part of Lucterios.
+
+Lucterios is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Lucterios is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import six
+
+from diacamma.accounting.models import AccountLink, FiscalYear
+from diacamma.accounting.tools import ParamsSnapshot
+
+
+class Command(BaseCommand):
+    help = 'Letter unlinked entry lines of third accounts when their amounts balance'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', dest='dry_run', default=False, help='Only report links found, without creating them')
+        parser.add_argument('--year', type=int, dest='year', default=None, help='Id of fiscal year (current year by default)')
+        parser.add_argument('--third', type=int, dest='thirds', action='append', default=None, help='Id of third (all thirds by default)')
+
+    def handle(self, *args, **options):
+        if options['year'] is not None:
+            year = FiscalYear.objects.filter(id=options['year']).first()
+            if year is None:
+                raise CommandError('Fiscal year #%d unknown' % options['year'])
+        else:
+            year = FiscalYear.get_current()
+        with ParamsSnapshot():
+            proposals = AccountLink.auto_lettering(year, third_ids=options['thirds'], dry_run=options['dry_run'])
+        for report_line in AccountLink.get_lettering_report(proposals):
+            self.stdout.write(six.text_type(report_line))
+        nb_lines = sum([len(proposal[3]) for proposal in proposals])
+        if options['dry_run']:
+            self.stdout.write('%d link(s) found for %d line(s)' % (len(proposals), nb_lines))
+        else:
+            self.stdout.write('%d link(s) created for %d line(s)' % (len(proposals), nb_lines))
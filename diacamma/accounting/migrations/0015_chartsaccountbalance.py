@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models.aggregates import Sum
+import django.db.models.deletion
+
+
+def initial_balances(apps, schema_editor):
+    entrylineaccount_mdl = apps.get_model("accounting", "EntryLineAccount")
+    balance_mdl = apps.get_model("accounting", "ChartsAccountBalance")
+    new_balances = []
+    for line_sum in entrylineaccount_mdl.objects.order_by('account_id', 'entry__journal_id', 'entry__close').values('account_id', 'entry__journal_id', 'entry__close').annotate(Sum('amount')):
+        new_balances.append(balance_mdl(account_id=line_sum['account_id'], journal_id=line_sum['entry__journal_id'],
+                                        close=line_sum['entry__close'], amount=line_sum['amount__sum'] or 0.0))
+    balance_mdl.objects.bulk_create(new_balances)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0014_journal_is_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChartsAccountBalance',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('close', models.BooleanField(default=False, verbose_name='close')),
+                ('amount', models.FloatField(default=0.0, verbose_name='amount')),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='accounting.ChartsAccount', verbose_name='account')),
+                ('journal', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='accounting.Journal', verbose_name='journal')),
+            ],
+            options={
+                'verbose_name': 'balance of account',
+                'verbose_name_plural': 'balances of account',
+                'default_permissions': [],
+                'unique_together': {('account', 'journal', 'close')},
+            },
+        ),
+        migrations.RunPython(initial_balances),
+    ]
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+from diacamma.accounting.system import get_accounting_system, get_account_classification
+
+
+def initial_classification(apps, schema_editor):
+    parameter_mdl = apps.get_model("CORE", "Parameter")
+    chartsaccount_mdl = apps.get_model("accounting", "ChartsAccount")
+    system_param = parameter_mdl.objects.filter(name='accounting-system').first()
+    system = get_accounting_system(system_param.value if system_param is not None else '')
+    for chartsaccount in chartsaccount_mdl.objects.all():
+        for field_name, value in get_account_classification(system, chartsaccount.code).items():
+            setattr(chartsaccount, field_name, value)
+        chartsaccount.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('CORE', '0001_initial'),
+        ('accounting', '0015_chartsaccountbalance'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chartsaccount',
+            name='is_third',
+            field=models.BooleanField(db_index=True, default=False, verbose_name='third account'),
+        ),
+        migrations.AddField(
+            model_name='chartsaccount',
+            name='is_customer',
+            field=models.BooleanField(db_index=True, default=False, verbose_name='customer account'),
+        ),
+        migrations.AddField(
+            model_name='chartsaccount',
+            name='is_provider',
+            field=models.BooleanField(db_index=True, default=False, verbose_name='provider account'),
+        ),
+        migrations.AddField(
+            model_name='chartsaccount',
+            name='is_cash',
+            field=models.BooleanField(db_index=True, default=False, verbose_name='cash account'),
+        ),
+        migrations.AddField(
+            model_name='chartsaccount',
+            name='is_revenue',
+            field=models.BooleanField(db_index=True, default=False, verbose_name='revenue account'),
+        ),
+        migrations.AddField(
+            model_name='chartsaccount',
+            name='is_expense',
+            field=models.BooleanField(db_index=True, default=False, verbose_name='expense account'),
+        ),
+        migrations.AddField(
+            model_name='chartsaccount',
+            name='is_annexe',
+            field=models.BooleanField(db_index=True, default=False, verbose_name='annexe account'),
+        ),
+        migrations.RunPython(initial_classification),
+    ]
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0016_chartsaccount_classification'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('modelname', models.CharField(max_length=100, verbose_name='model')),
+                ('job_hash', models.CharField(db_index=True, max_length=64, verbose_name='hash')),
+                ('date', models.DateTimeField(verbose_name='date')),
+                ('status', models.IntegerField(choices=[(0, 'in progress'), (1, 'finished')], db_index=True, default=0, verbose_name='status')),
+                ('nb_rows', models.IntegerField(default=0, verbose_name='number of rows')),
+                ('offset', models.IntegerField(default=0, verbose_name='rows read')),
+                ('nb_imported', models.IntegerField(default=0, verbose_name='items imported')),
+                ('nb_skipped', models.IntegerField(default=0, verbose_name='rows skipped')),
+            ],
+            options={
+                'verbose_name': 'import job',
+                'verbose_name_plural': 'import jobs',
+                'ordering': ['-date'],
+                'default_permissions': [],
+            },
+        ),
+        migrations.CreateModel(
+            name='ImportedContent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('modelname', models.CharField(max_length=100, verbose_name='model')),
+                ('content_hash', models.CharField(max_length=64, verbose_name='hash')),
+            ],
+            options={
+                'verbose_name': 'imported content',
+                'verbose_name_plural': 'imported contents',
+                'default_permissions': [],
+                'index_together': {('modelname', 'content_hash')},
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models.aggregates import Count, Max
+
+
+def initial_link_num(apps, schema_editor):
+    accountlink_mdl = apps.get_model("accounting", "AccountLink")
+    entrylineaccount_mdl = apps.get_model("accounting", "EntryLineAccount")
+    nb_lines_by_year = {}
+    for link_info in entrylineaccount_mdl.objects.filter(link__isnull=False).order_by('link_id').values('link_id').annotate(year_id=Max('entry__year_id'), nb_lines=Count('id')):
+        nb_lines = nb_lines_by_year.get(link_info['year_id'], 0)
+        accountlink_mdl.objects.filter(id=link_info['link_id']).update(num=nb_lines)
+        nb_lines_by_year[link_info['year_id']] = nb_lines + link_info['nb_lines']
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0017_importjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='accountlink',
+            name='num',
+            field=models.IntegerField(default=None, null=True, verbose_name='numeros'),
+        ),
+        migrations.RunPython(initial_link_num),
+    ]
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+from unicodedata import normalize, combining
+
+from django.db import migrations, models
+
+
+def initial_sort_name(apps, schema_editor):
+    third_mdl = apps.get_model("accounting", "Third")
+    for third_id, contact_id, legalentity_name, lastname, firstname in third_mdl.objects.values_list('id', 'contact_id', 'contact__legalentity__name',
+                                                                                                    'contact__individual__lastname', 'contact__individual__firstname'):
+        if legalentity_name is not None:
+            third_name = legalentity_name
+        elif lastname is not None:
+            third_name = '%s %s' % (lastname, firstname)
+        else:
+            third_name = "contact#%d" % contact_id
+        third_name = normalize('NFKD', third_name)
+        third_name = ''.join([name_char for name_char in third_name if not combining(name_char)]).lower().strip()[:250]
+        third_mdl.objects.filter(id=third_id).update(sort_name=third_name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0018_accountlink_num'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='third',
+            name='sort_name',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=250, verbose_name='sort name'),
+        ),
+        migrations.RunPython(initial_sort_name),
+    ]
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Q, F, Value, Case, When
+from django.db.models.aggregates import Sum
+import django.db.models.deletion
+
+
+def initial_closed_balances(apps, schema_editor):
+    entrylineaccount_mdl = apps.get_model("accounting", "EntryLineAccount")
+    balance_mdl = apps.get_model("accounting", "ClosedYearBalance")
+    new_balances = []
+    for line_sum in entrylineaccount_mdl.objects.filter(Q(entry__year__status=2)).order_by('entry__year_id', 'account_id', 'entry__journal_id', 'third_id', 'costaccounting_id').values('entry__year_id', 'account_id', 'entry__journal_id', 'third_id', 'costaccounting_id').annotate(
+            Sum('amount'), amount_positive=Sum(Case(When(amount__gt=0, then=F('amount')), default=Value(0.0), output_field=models.FloatField())),
+            amount_negative=Sum(Case(When(amount__lt=0, then=F('amount')), default=Value(0.0), output_field=models.FloatField()))):
+        new_balances.append(balance_mdl(year_id=line_sum['entry__year_id'], account_id=line_sum['account_id'], journal_id=line_sum['entry__journal_id'],
+                                        third_id=line_sum['third_id'], costaccounting_id=line_sum['costaccounting_id'], amount=line_sum['amount__sum'] or 0.0,
+                                        amount_positive=line_sum['amount_positive'], amount_negative=line_sum['amount_negative']))
+    balance_mdl.objects.bulk_create(new_balances, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0019_third_sort_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClosedYearBalance',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.FloatField(default=0.0, verbose_name='amount')),
+                ('amount_positive', models.FloatField(default=0.0, verbose_name='positive amount')),
+                ('amount_negative', models.FloatField(default=0.0, verbose_name='negative amount')),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='accounting.ChartsAccount', verbose_name='account')),
+                ('costaccounting', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='accounting.CostAccounting', verbose_name='cost accounting')),
+                ('journal', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='accounting.Journal', verbose_name='journal')),
+                ('third', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='accounting.Third', verbose_name='third')),
+                ('year', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='accounting.FiscalYear', verbose_name='fiscal year')),
+            ],
+            options={
+                'verbose_name': 'balance of closed fiscal year',
+                'verbose_name_plural': 'balances of closed fiscal year',
+                'default_permissions': [],
+            },
+        ),
+        migrations.RunPython(initial_closed_balances),
+    ]
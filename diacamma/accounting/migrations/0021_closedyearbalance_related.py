@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0020_closedyearbalance'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='closedyearbalance',
+            name='account',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='accounting.ChartsAccount', verbose_name='account'),
+        ),
+        migrations.AlterField(
+            model_name='closedyearbalance',
+            name='costaccounting',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='accounting.CostAccounting', verbose_name='cost accounting'),
+        ),
+        migrations.AlterField(
+            model_name='closedyearbalance',
+            name='journal',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='accounting.Journal', verbose_name='journal'),
+        ),
+        migrations.AlterField(
+            model_name='closedyearbalance',
+            name='third',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='accounting.Third', verbose_name='third'),
+        ),
+        migrations.AlterField(
+            model_name='closedyearbalance',
+            name='year',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='accounting.FiscalYear', verbose_name='fiscal year'),
+        ),
+    ]
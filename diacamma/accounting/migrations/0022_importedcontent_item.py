@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0021_closedyearbalance_related'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importedcontent',
+            name='item_id',
+            field=models.IntegerField(default=None, null=True, verbose_name='item id'),
+        ),
+        migrations.AddField(
+            model_name='importedcontent',
+            name='item_model',
+            field=models.CharField(default='', max_length=100, verbose_name='item model'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0022_importedcontent_item'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fiscalyear',
+            name='result_version',
+            field=models.IntegerField(default=0, verbose_name='result version'),
+        ),
+    ]
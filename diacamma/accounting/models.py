@@ -23,33 +23,38 @@ along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
 
 from __future__ import unicode_literals
 
+import json
 from datetime import date, timedelta
+from functools import partial
 from os.path import join, isfile, dirname
 from logging import getLogger
-from re import match
 from csv import DictReader
+from unicodedata import normalize, combining
 from _csv import QUOTE_NONE
 
-from django.db import models
-from django.db.models.functions import Concat
-from django.db.models import Q, F, Value
+from django.apps import apps
+from django.db import models, transaction, connection, IntegrityError
+from django.db.models import Q, F, Value, Case, When, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.db.models.query import QuerySet
 from django.db.models.aggregates import Sum, Max, Count
 from django.template import engines
 from django.core.exceptions import ObjectDoesNotExist
 from django.utils.translation import ugettext_lazy as _
-from django.utils import six
-from django.db.models.signals import pre_save
+from django.utils.encoding import smart_text
+from django.utils import six, timezone
+from django.db.models.signals import pre_save, pre_delete, post_save, post_delete
 from django_fsm import FSMIntegerField, transition
 
 from lucterios.framework.models import LucteriosModel, get_value_if_choices,\
-    LucteriosVirtualField
+    LucteriosVirtualField, LucteriosLogEntry
 from lucterios.framework.tools import get_date_formating, get_format_value,\
     convert_date
 from lucterios.framework.error import LucteriosException, IMPORTANT, GRAVE
 from lucterios.framework.filetools import read_file, xml_validator, save_file, get_user_path
 from lucterios.framework.signal_and_lock import RecordLocker, Signal
-from lucterios.framework.auditlog import auditlog
+from lucterios.framework.auditlog import auditlog, LucteriosAuditlogModelRegistry
+from lucterios.framework.auditlog_tools import model_instance_diff
 from lucterios.framework.printgenerators import ActionGenerator
 from lucterios.CORE.models import Parameter, LucteriosUser
 from lucterios.CORE.parameters import Params
@@ -59,6 +64,7 @@ from lucterios.documents.models import FolderContainer, DocumentContainer
 
 from diacamma.accounting.tools import get_amount_sum, current_system_account, currency_round, correct_accounting_code,\
     get_currency_symbole, format_with_devise, get_amount_from_format_devise
+from diacamma.accounting.system import get_mask_filter, get_account_classification
 from lucterios.framework import signal_and_lock
 
 
@@ -101,11 +107,21 @@ class Third(LucteriosModel, CustomizeObject):
 
     contact = models.ForeignKey('contacts.AbstractContact', verbose_name=_('contact'), null=False, on_delete=models.CASCADE)
     status = FSMIntegerField(verbose_name=_('status'), choices=((0, _('Enable')), (1, _('Disable'))))
+    sort_name = models.CharField(_('sort name'), max_length=250, default='', db_index=True, editable=False)
     total = LucteriosVirtualField(verbose_name=_('total'), compute_from='get_total', format_string=lambda: format_with_devise(5))
 
     def __str__(self):
         return six.text_type(self.contact.get_final_child())
 
+    @classmethod
+    def normalize_name(cls, name):
+        name = normalize('NFKD', six.text_type(name))
+        return ''.join([name_char for name_char in name if not combining(name_char)]).lower().strip()[:250]
+
+    @classmethod
+    def refresh_sort_name(cls, contact):
+        cls.objects.filter(contact_id=contact.id).update(sort_name=cls.normalize_name(contact.get_final_child()))
+
     @classmethod
     def get_field_by_name(cls, fieldname):
         dep_field = CustomizeObject.get_virtualfield(fieldname)
@@ -150,17 +166,42 @@ class Third(LucteriosModel, CustomizeObject):
         result.extend(["status", "accountthird_set.code"])
         return result
 
+    @classmethod
+    def get_names(cls, third_ids):
+        thirds = cls.objects.filter(id__in=third_ids).select_related('contact', 'contact__legalentity', 'contact__individual')
+        return {third.id: six.text_type(third) for third in thirds}
+
+    @classmethod
+    def get_total_sum(cls):
+        return Sum(Case(When(account__type_of_account=0, then=-1 * F('amount')), default=F('amount'), output_field=models.FloatField()))
+
+    @classmethod
+    def get_total_subquery(cls):
+        total_lines = EntryLineAccount.objects.filter(third=OuterRef('pk')).order_by().values('third').annotate(total=cls.get_total_sum())
+        return Coalesce(Subquery(total_lines.values('total'), output_field=models.FloatField()), 0.0)
+
+    @classmethod
+    def annotate_total(cls, items, only_unbalanced=False):
+        items = items.annotate(total_amount=cls.get_total_subquery())
+        if only_unbalanced:
+            items = items.filter(Q(total_amount__gt=0.0001) | Q(total_amount__lt=-0.0001))
+        return items
+
     def get_total(self, current_date=None, strict=True):
+        if (current_date is None) and hasattr(self, 'total_amount'):
+            return self.total_amount
         current_filter = Q(third=self)
         if current_date is not None:
             if strict:
                 current_filter &= Q(entry__date_value__lte=current_date)
             else:
                 current_filter &= Q(entry__date_value__lt=current_date)
-        active_sum = get_amount_sum(EntryLineAccount.objects.filter(current_filter & Q(account__type_of_account=0)).aggregate(Sum('amount')))
-        passive_sum = get_amount_sum(EntryLineAccount.objects.filter(current_filter & Q(account__type_of_account=1)).aggregate(Sum('amount')))
-        other_sum = get_amount_sum(EntryLineAccount.objects.filter(current_filter & Q(account__type_of_account__gt=1)).aggregate(Sum('amount')))
-        return passive_sum - active_sum + other_sum
+        total = EntryLineAccount.objects.filter(current_filter).aggregate(total=self.get_total_sum())['total']
+        return total if total is not None else 0
+
+    def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+        self.sort_name = self.normalize_name(self)
+        return LucteriosModel.save(self, force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
 
     def merge_objects(self, alias_objects=[]):
         LucteriosModel.merge_objects(self, alias_objects=alias_objects)
@@ -184,7 +225,7 @@ class Third(LucteriosModel, CustomizeObject):
         pass
 
     def get_account(self, fiscal_year, mask):
-        accounts = self.accountthird_set.filter(code__regex=mask)
+        accounts = self.accountthird_set.filter(get_mask_filter(mask))
         if len(accounts) == 0:
             raise LucteriosException(IMPORTANT, _("third has not correct account"))
         third_account = ChartsAccount.get_account(accounts[0].code, fiscal_year)
@@ -271,6 +312,7 @@ class FiscalYear(LucteriosModel):
     last_fiscalyear = models.ForeignKey('FiscalYear', verbose_name=_('last fiscal year'), related_name='next_fiscalyear', null=True, on_delete=models.SET_NULL)
 
     folder = models.ForeignKey(FolderContainer, verbose_name=_('folder'), null=True, on_delete=models.PROTECT)
+    result_version = models.IntegerField(verbose_name=_('result version'), default=0)
 
     total_result_text = LucteriosVirtualField(verbose_name='', compute_from='get_total_result_text', format_string=lambda: get_total_result_text_format())
 
@@ -327,36 +369,75 @@ class FiscalYear(LucteriosModel):
     def get_edit_fields(cls):
         return ['status', 'begin', 'end', 'folder']
 
+    @classmethod
+    def clear_closed_years(cls):
+        FiscalYear.closed_years = None
+
+    @classmethod
+    def get_closed_years(cls):
+        closed_years = FiscalYear.closed_years
+        if closed_years is None:
+            closed_years = {year_id: (begin, end) for year_id, begin, end in cls.objects.filter(status=2).values_list('id', 'begin', 'end')}
+            FiscalYear.closed_years = closed_years
+        return closed_years
+
+    @classmethod
+    def get_changed_results(cls):
+        return set([func.args[0] for _savepoint_ids, func in connection.run_on_commit if isinstance(func, partial) and (func.func == cls.refresh_results)])
+
+    @classmethod
+    def change_results(cls, year_id):
+        if (year_id is not None) and (year_id not in cls.get_changed_results()):
+            cls.result_summaries.pop(year_id, None)
+            transaction.on_commit(partial(cls.refresh_results, year_id))
+
+    @classmethod
+    def refresh_results(cls, year_id):
+        cls.objects.filter(id=year_id).update(result_version=F('result_version') + 1)
+        cls.result_summaries.pop(year_id, None)
+
+    def get_result_summary(self):
+        if not hasattr(self, 'result_summary'):
+            result_summary = None
+            is_changed = self.id in FiscalYear.get_changed_results()
+            if not is_changed:
+                result_version, result_summary = FiscalYear.result_summaries.get(self.id, (None, None))
+                if result_version != self.result_version:
+                    result_summary = None
+            if result_summary is None:
+                totals = EntryLineAccount.objects.filter(account__year=self, entry__date_value__gte=self.begin, entry__date_value__lte=self.end).aggregate(
+                    revenue=Sum('amount', filter=Q(account__type_of_account=3)), expense=Sum('amount', filter=Q(account__type_of_account=4)),
+                    cash=Sum('amount', filter=Q(account__is_cash=True)), cash_close=Sum('amount', filter=Q(account__is_cash=True) & Q(entry__close=True)))
+                result_summary = {key: value if value is not None else 0 for key, value in totals.items()}
+                if not is_changed:
+                    FiscalYear.result_summaries[self.id] = (self.result_version, result_summary)
+            setattr(self, 'result_summary', result_summary)
+        return self.result_summary
+
     @property
     def total_revenue(self):
-        return get_amount_sum(EntryLineAccount.objects.filter(account__type_of_account=3, account__year=self,
-                                                              entry__date_value__gte=self.begin, entry__date_value__lte=self.end).aggregate(Sum('amount')))
+        return self.get_result_summary()['revenue']
 
     @property
     def total_expense(self):
-
-        return get_amount_sum(EntryLineAccount.objects.filter(account__type_of_account=4, account__year=self,
-                                                              entry__date_value__gte=self.begin, entry__date_value__lte=self.end).aggregate(Sum('amount')))
+        return self.get_result_summary()['expense']
 
     @property
     def total_cash(self):
-
-        return get_amount_sum(EntryLineAccount.objects.filter(account__code__regex=current_system_account().get_cash_mask(),
-                                                              account__year=self, entry__date_value__gte=self.begin, entry__date_value__lte=self.end).aggregate(Sum('amount')))
+        return self.get_result_summary()['cash']
 
     @property
     def total_cash_close(self):
-
-        return get_amount_sum(EntryLineAccount.objects.filter(entry__close=True, account__code__regex=current_system_account().get_cash_mask(),
-                                                              account__year=self, entry__date_value__gte=self.begin, entry__date_value__lte=self.end).aggregate(Sum('amount')))
+        return self.get_result_summary()['cash_close']
 
     def get_total_result_text(self):
+        result_summary = self.get_result_summary()
         value = []
-        value.append(self.total_revenue)
-        value.append(self.total_expense)
-        value.append(self.total_revenue - self.total_expense)
-        value.append(self.total_cash)
-        value.append(self.total_cash_close)
+        value.append(result_summary['revenue'])
+        value.append(result_summary['expense'])
+        value.append(result_summary['revenue'] - result_summary['expense'])
+        value.append(result_summary['cash'])
+        value.append(result_summary['cash_close'])
         return value
 
     @property
@@ -476,9 +557,21 @@ class FiscalYear(LucteriosModel):
     def set_context(self, xfer):
         setattr(self, 'last_user', xfer.request.user)
 
-    @property
-    def letter(self):
-        nb_year = FiscalYear.objects.filter(id__lt=self.id).count()
+    letter_indexes = {}
+    result_summaries = {}
+    closed_years = None
+
+    @classmethod
+    def clear_letters(cls):
+        FiscalYear.letter_indexes = {}
+
+    @classmethod
+    def get_year_letter(cls, year_id):
+        letter_indexes = FiscalYear.letter_indexes
+        if year_id not in letter_indexes:
+            letter_indexes = {current_id: nb_year for nb_year, current_id in enumerate(cls.objects.order_by('id').values_list('id', flat=True))}
+            FiscalYear.letter_indexes = letter_indexes
+        nb_year = letter_indexes.get(year_id, len(letter_indexes))
         letters = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
         res = ''
         while nb_year >= 26:
@@ -487,6 +580,10 @@ class FiscalYear(LucteriosModel):
             nb_year = int(div) - 1
         return letters[nb_year] + res
 
+    @property
+    def letter(self):
+        return FiscalYear.get_year_letter(self.id)
+
     def _check_annexe(self):
         total = 0
         for chart in self.chartsaccount_set.filter(type_of_account=5):
@@ -541,6 +638,7 @@ class FiscalYear(LucteriosModel):
         current_system_account().finalize_year(self)
         self.status = 2
         self.save()
+        ClosedYearBalance.rebuild(self)
         self.save_reports()
 
     def check_report(self):
@@ -652,6 +750,13 @@ class ChartsAccount(LucteriosModel):
     last_year_total = LucteriosVirtualField(verbose_name=_('total of last year'), compute_from='get_last_year_total', format_string=lambda: format_with_devise(2))
     current_total = LucteriosVirtualField(verbose_name=_('total current'), compute_from='get_current_total', format_string=lambda: format_with_devise(2))
     current_validated = LucteriosVirtualField(verbose_name=_('total validated'), compute_from='get_current_validated', format_string=lambda: format_with_devise(2))
+    is_third = models.BooleanField(verbose_name=_('third account'), default=False, db_index=True)
+    is_customer = models.BooleanField(verbose_name=_('customer account'), default=False, db_index=True)
+    is_provider = models.BooleanField(verbose_name=_('provider account'), default=False, db_index=True)
+    is_cash = models.BooleanField(verbose_name=_('cash account'), default=False, db_index=True)
+    is_revenue = models.BooleanField(verbose_name=_('revenue account'), default=False, db_index=True)
+    is_expense = models.BooleanField(verbose_name=_('expense account'), default=False, db_index=True)
+    is_annexe = models.BooleanField(verbose_name=_('annexe account'), default=False, db_index=True)
 
     @classmethod
     def get_default_fields(cls):
@@ -675,7 +780,7 @@ class ChartsAccount(LucteriosModel):
             year_filter = Q(year__is_actif=True)
         else:
             year_filter = Q(year=year)
-        account = ChartsAccount.objects.filter(Q(code__regex=code + '.*') & year_filter).first()
+        account = ChartsAccount.objects.filter(Q(code__startswith=code) & year_filter).first()
         if account is None:
             return None
         else:
@@ -687,23 +792,34 @@ class ChartsAccount(LucteriosModel):
     def get_name(self):
         return "[%s] %s" % (correct_accounting_code(self.code), self.name)
 
-    def get_last_year_total(self, with_correction=True):
+    @classmethod
+    def get_items_with_totals(cls, items):
+        balances = ChartsAccountBalance.objects.filter(account=OuterRef('pk')).order_by().values('account')
+
+        def total_of(query):
+            return Coalesce(Subquery(balances.filter(query).annotate(total=Sum('amount')).values('total'), output_field=models.FloatField()), Value(0.0))
+        return items.annotate(total_last_year_total=total_of(Q(journal_id=1)),
+                              total_current_total=total_of(Q()),
+                              total_current_validated=total_of(Q(close=True)))
+
+    def _get_total(self, total_name, query, with_correction):
+        if hasattr(self, 'total_' + total_name):
+            total = currency_round(getattr(self, 'total_' + total_name))
+        else:
+            total = ChartsAccountBalance.get_total(self, query)
         if with_correction:
-            return self.credit_debit_way() * get_amount_sum(self.entrylineaccount_set.filter(entry__journal__id=1).aggregate(Sum('amount')))
+            return self.credit_debit_way() * total
         else:
-            return get_amount_sum(self.entrylineaccount_set.filter(entry__journal__id=1).aggregate(Sum('amount')))
+            return total
+
+    def get_last_year_total(self, with_correction=True):
+        return self._get_total('last_year_total', Q(journal_id=1), with_correction)
 
     def get_current_total(self, with_correction=True):
-        if with_correction:
-            return self.credit_debit_way() * get_amount_sum(self.entrylineaccount_set.all().aggregate(Sum('amount')))
-        else:
-            return get_amount_sum(self.entrylineaccount_set.all().aggregate(Sum('amount')))
+        return self._get_total('current_total', Q(), with_correction)
 
     def get_current_validated(self, with_correction=True):
-        if with_correction:
-            return self.credit_debit_way() * get_amount_sum(self.entrylineaccount_set.filter(entry__close=True).aggregate(Sum('amount')))
-        else:
-            return get_amount_sum(self.entrylineaccount_set.filter(entry__close=True).aggregate(Sum('amount')))
+        return self._get_total('current_validated', Q(close=True), with_correction)
 
     def credit_debit_way(self):
         if self.type_of_account in [0, 4]:
@@ -711,13 +827,23 @@ class ChartsAccount(LucteriosModel):
         else:
             return 1
 
-    @property
-    def is_third(self):
-        return match(current_system_account().get_third_mask(), self.code) is not None
+    def set_classification(self):
+        for field_name, value in get_account_classification(current_system_account(), self.code).items():
+            setattr(self, field_name, value)
 
-    @property
-    def is_cash(self):
-        return match(current_system_account().get_cash_mask(), self.code) is not None
+    @classmethod
+    def update_classification(cls, accounts=None):
+        if accounts is None:
+            accounts = cls.objects.all()
+        system = current_system_account()
+        account_ids = {}
+        for account_id, account_code in accounts.values_list('id', 'code'):
+            classification = tuple(sorted(get_account_classification(system, account_code).items()))
+            if classification not in account_ids:
+                account_ids[classification] = []
+            account_ids[classification].append(account_id)
+        for classification, ids in account_ids.items():
+            cls.objects.filter(id__in=ids).update(**dict(classification))
 
     @classmethod
     def get_account(cls, code, year):
@@ -728,14 +854,26 @@ class ChartsAccount(LucteriosModel):
             return accounts[0]
 
     @classmethod
-    def get_chart_account(cls, code):
-        current_year = FiscalYear.get_current()
+    def get_chart_accounts_map(cls, year=None):
+        if year is None:
+            year = FiscalYear.get_current()
+        return {chart.code: chart for chart in year.chartsaccount_set.all()}
+
+    @classmethod
+    def get_chart_account(cls, code, chart_accounts=None):
         code = correct_accounting_code(code)
-        try:
-            chart = current_year.chartsaccount_set.get(code=code)
-        except ObjectDoesNotExist:
+        if chart_accounts is not None:
+            current_year = None
+            chart = chart_accounts.get(code)
+        else:
+            current_year = FiscalYear.get_current()
+            chart = current_year.chartsaccount_set.filter(code=code).first()
+        if chart is None:
+            if current_year is None:
+                current_year = FiscalYear.get_current()
             descript, typeaccount = current_system_account().new_charts_account(code)
             chart = ChartsAccount(year=current_year, code=code, name=descript, type_of_account=typeaccount)
+            chart.set_classification()
         return chart
 
     def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
@@ -748,6 +886,7 @@ class ChartsAccount(LucteriosModel):
                     IMPORTANT, _('Account already exists for this fiscal year!'))
         except ObjectDoesNotExist:
             pass
+        self.set_classification()
         return LucteriosModel.save(self, force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
 
     @classmethod
@@ -768,6 +907,231 @@ class ChartsAccount(LucteriosModel):
         ordering = ['year', 'code']
 
 
+class ChartsAccountBalance(LucteriosModel):
+    account = models.ForeignKey('ChartsAccount', verbose_name=_('account'), null=False, on_delete=models.CASCADE, related_name='+')
+    journal = models.ForeignKey('Journal', verbose_name=_('journal'), null=False, on_delete=models.CASCADE, related_name='+')
+    close = models.BooleanField(verbose_name=_('close'), default=False)
+    amount = models.FloatField(_('amount'), default=0.0)
+
+    def __str__(self):
+        return "%s [%s] %s" % (self.account, self.journal, self.amount)
+
+    @classmethod
+    def get_total(cls, account, query):
+        if account.id is None:
+            return 0
+        return currency_round(get_amount_sum(cls.objects.filter(Q(account=account) & query).aggregate(Sum('amount'))))
+
+    @classmethod
+    def add_amount(cls, account_id, journal_id, close, amount):
+        if abs(amount) < 1e-6:
+            return
+        balances = cls.objects.filter(account_id=account_id, journal_id=journal_id, close=close)
+        if balances.update(amount=F('amount') + amount) == 0:
+            try:
+                with transaction.atomic():
+                    cls.objects.create(account_id=account_id, journal_id=journal_id, close=close, amount=amount)
+            except IntegrityError:
+                balances.update(amount=F('amount') + amount)
+
+    @classmethod
+    def get_line_state(cls, entryline_id):
+        if entryline_id is None:
+            return None
+        return EntryLineAccount.objects.filter(id=entryline_id).values_list('account_id', 'entry__journal_id', 'entry__close', 'amount').first()
+
+    @classmethod
+    def change_line(cls, old_state, new_state):
+        if old_state == new_state:
+            return
+        if (old_state is not None) and (new_state is not None) and (old_state[:3] == new_state[:3]):
+            cls.add_amount(new_state[0], new_state[1], new_state[2], new_state[3] - old_state[3])
+        else:
+            if old_state is not None:
+                cls.add_amount(old_state[0], old_state[1], old_state[2], -1 * old_state[3])
+            if new_state is not None:
+                cls.add_amount(*new_state)
+
+    @classmethod
+    def change_entry(cls, entry_id, old_state, new_state):
+        if old_state == new_state:
+            return
+        for line_sum in EntryLineAccount.objects.filter(entry_id=entry_id).order_by('account_id').values('account_id').annotate(Sum('amount')):
+            cls.add_amount(line_sum['account_id'], old_state[0], old_state[1], -1 * get_amount_sum(line_sum))
+            cls.add_amount(line_sum['account_id'], new_state[0], new_state[1], get_amount_sum(line_sum))
+
+    @classmethod
+    def get_balance_from_lines(cls, year=None):
+        entrylines = EntryLineAccount.objects.all()
+        if year is not None:
+            entrylines = entrylines.filter(account__year=year)
+        balances = {}
+        for line_sum in entrylines.order_by('account_id', 'entry__journal_id', 'entry__close').values('account_id', 'entry__journal_id', 'entry__close').annotate(Sum('amount')):
+            balances[(line_sum['account_id'], line_sum['entry__journal_id'], line_sum['entry__close'])] = get_amount_sum(line_sum)
+        return balances
+
+    @classmethod
+    def rebuild(cls, year=None):
+        balances = cls.objects.all()
+        if year is not None:
+            balances = balances.filter(account__year=year)
+        balances.delete()
+        new_balances = [cls(account_id=account_id, journal_id=journal_id, close=close, amount=amount)
+                        for (account_id, journal_id, close), amount in cls.get_balance_from_lines(year).items()]
+        cls.objects.bulk_create(new_balances)
+        return len(new_balances)
+
+    @classmethod
+    def check_balance(cls, year=None):
+        balances = cls.objects.all()
+        if year is not None:
+            balances = balances.filter(account__year=year)
+        stored_values = {}
+        for balance in balances.values('account_id', 'journal_id', 'close', 'amount'):
+            stored_values[(balance['account_id'], balance['journal_id'], balance['close'])] = balance['amount']
+        expected_values = cls.get_balance_from_lines(year)
+        errors = []
+        for key in sorted(set(stored_values.keys()) | set(expected_values.keys())):
+            stored_value = currency_round(stored_values.get(key, 0.0))
+            expected_value = currency_round(expected_values.get(key, 0.0))
+            if abs(stored_value - expected_value) > 0.0001:
+                errors.append((key[0], key[1], key[2], expected_value, stored_value))
+        return errors
+
+    class Meta(object):
+        verbose_name = _('balance of account')
+        verbose_name_plural = _('balances of account')
+        default_permissions = []
+        unique_together = (('account', 'journal', 'close'),)
+
+
+class ClosedYearBalance(LucteriosModel):
+    year = models.ForeignKey('FiscalYear', verbose_name=_('fiscal year'), null=False, on_delete=models.CASCADE)
+    account = models.ForeignKey('ChartsAccount', verbose_name=_('account'), null=False, on_delete=models.CASCADE)
+    journal = models.ForeignKey('Journal', verbose_name=_('journal'), null=False, on_delete=models.CASCADE)
+    third = models.ForeignKey('Third', verbose_name=_('third'), null=True, on_delete=models.CASCADE)
+    costaccounting = models.ForeignKey('CostAccounting', verbose_name=_('cost accounting'), null=True, on_delete=models.CASCADE)
+    amount = models.FloatField(_('amount'), default=0.0)
+    amount_positive = models.FloatField(_('positive amount'), default=0.0)
+    amount_negative = models.FloatField(_('negative amount'), default=0.0)
+
+    LINE_FIELDS = ('account', 'third', 'costaccounting')
+
+    def __str__(self):
+        return "%s [%s] %s" % (self.account, self.journal, self.amount)
+
+    @classmethod
+    def get_balance_from_lines(cls, year):
+        balances = {}
+        for line_sum in EntryLineAccount.objects.filter(entry__year=year).order_by('account_id', 'entry__journal_id', 'third_id', 'costaccounting_id').values('account_id', 'entry__journal_id', 'third_id', 'costaccounting_id').annotate(
+                Sum('amount'), amount_positive=Sum(Case(When(amount__gt=0, then=F('amount')), default=Value(0.0), output_field=models.FloatField())),
+                amount_negative=Sum(Case(When(amount__lt=0, then=F('amount')), default=Value(0.0), output_field=models.FloatField()))):
+            balances[(line_sum['account_id'], line_sum['entry__journal_id'], line_sum['third_id'], line_sum['costaccounting_id'])] = (get_amount_sum(line_sum), line_sum['amount_positive'], line_sum['amount_negative'])
+        return balances
+
+    @classmethod
+    def rebuild(cls, year):
+        cls.objects.filter(year=year).delete()
+        if year.status != 2:
+            return 0
+        new_balances = [cls(year=year, account_id=account_id, journal_id=journal_id, third_id=third_id, costaccounting_id=costaccounting_id,
+                            amount=amount, amount_positive=amount_positive, amount_negative=amount_negative)
+                        for (account_id, journal_id, third_id, costaccounting_id), (amount, amount_positive, amount_negative) in cls.get_balance_from_lines(year).items()]
+        cls.objects.bulk_create(new_balances, batch_size=500)
+        return len(new_balances)
+
+    @classmethod
+    def check_balance(cls, year):
+        stored_values = {}
+        for balance in cls.objects.filter(year=year).values('account_id', 'journal_id', 'third_id', 'costaccounting_id', 'amount', 'amount_positive', 'amount_negative'):
+            balance_key = (balance['account_id'], balance['journal_id'], balance['third_id'], balance['costaccounting_id'])
+            stored_value = stored_values.get(balance_key, (0.0, 0.0, 0.0))
+            stored_values[balance_key] = (stored_value[0] + balance['amount'], stored_value[1] + balance['amount_positive'], stored_value[2] + balance['amount_negative'])
+        if year.status == 2:
+            expected_values = cls.get_balance_from_lines(year)
+        else:
+            expected_values = {}
+        errors = []
+        for key in sorted(set(stored_values.keys()) | set(expected_values.keys()), key=six.text_type):
+            stored_value = [currency_round(value) for value in stored_values.get(key, (0.0, 0.0, 0.0))]
+            expected_value = [currency_round(value) for value in expected_values.get(key, (0.0, 0.0, 0.0))]
+            if max([abs(stored_item - expected_item) for stored_item, expected_item in zip(stored_value, expected_value)]) > 0.0001:
+                errors.append((key[0], key[1], key[2], key[3], expected_value[0], stored_value[0]))
+        return errors
+
+    @classmethod
+    def _convert_query(cls, query, year_ids, date_checks):
+        new_query = Q()
+        new_query.connector = query.connector
+        new_query.negated = query.negated
+        for child in query.children:
+            if isinstance(child, Q):
+                new_child = cls._convert_query(child, year_ids, date_checks)
+                if new_child is None:
+                    return None
+            else:
+                lookup, value = child
+                field_name = lookup.split('__')[0]
+                if lookup in ('entry__year', 'entry__year_id', 'entry__year__id'):
+                    if isinstance(value, FiscalYear):
+                        value = value.id
+                    if not isinstance(value, six.integer_types):
+                        return None
+                    year_ids.append(value)
+                    new_child = ('year_id', value)
+                elif lookup.startswith('entry__journal'):
+                    new_child = ('journal' + lookup[len('entry__journal'):], value)
+                elif lookup in ('entry__date_value__gte', 'entry__date_value__lte') and (query.connector == Q.AND) and not query.negated:
+                    date_checks.append((lookup, convert_date(value)))
+                    continue
+                elif (field_name in cls.LINE_FIELDS) or (field_name[:-3] in cls.LINE_FIELDS and field_name.endswith('_id')):
+                    new_child = child
+                else:
+                    return None
+            new_query.children.append(new_child)
+        return new_query
+
+    @classmethod
+    def get_lines(cls, query):
+        year_ids = []
+        date_checks = []
+        if isinstance(query, Q):
+            balance_query = cls._convert_query(query, year_ids, date_checks)
+        else:
+            balance_query = None
+        if (balance_query is not None) and (len(year_ids) > 0):
+            closed_years = FiscalYear.get_closed_years()
+            if len(set(year_ids) - set(closed_years.keys())) == 0:
+                is_full_year = True
+                for lookup, date_value in date_checks:
+                    for year_id in set(year_ids):
+                        year_begin, year_end = closed_years[year_id]
+                        if lookup.endswith('__gte') and ((date_value is None) or (date_value > year_begin)):
+                            is_full_year = False
+                        if lookup.endswith('__lte') and ((date_value is None) or (date_value < year_end)):
+                            is_full_year = False
+                if is_full_year:
+                    return cls.objects.filter(balance_query)
+        return EntryLineAccount.objects.filter(query)
+
+    @classmethod
+    def get_lines_by_queries(cls, query_list, query_filter=None):
+        full_query = Q()
+        for query_item in query_list:
+            full_query |= query_item
+        if query_filter is not None:
+            full_query &= query_filter
+        lines = cls.get_lines(full_query)
+        if lines.model is cls:
+            query_list = [cls._convert_query(query_item, [], []) for query_item in query_list]
+        return lines, query_list
+
+    class Meta(object):
+        verbose_name = _('balance of closed fiscal year')
+        verbose_name_plural = _('balances of closed fiscal year')
+        default_permissions = []
+
+
 class Journal(LucteriosModel):
     name = models.CharField(_('name'), max_length=50, unique=True)
     is_default = models.BooleanField(verbose_name=_('default'), default=False, null=False)
@@ -809,18 +1173,22 @@ class Journal(LucteriosModel):
 
 
 class AccountLink(LucteriosModel):
+    num = models.IntegerField(verbose_name=_('numeros'), null=True, default=None)
 
     letter = LucteriosVirtualField(verbose_name=_('link'), compute_from='get_letter')
 
+    auto_subset_size = 6
+    auto_subset_states = 5000
+    auto_subset_lines = 30
+    auto_subset_work = 1000000
+
     def __str__(self):
         return self.letter
 
     def get_letter(self):
-        entrylines = self.entrylineaccount_set.all()
-        if len(entrylines) == 0:
+        if self.num is None:
             return ''
-        year = entrylines[0].entry.year
-        nb_link = AccountLink.objects.filter(entrylineaccount__entry__year=year, id__lt=self.id).count()
+        nb_link = self.num
         letters = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
         res = ''
         while nb_link >= 26:
@@ -850,14 +1218,12 @@ class AccountLink(LucteriosModel):
 
     @classmethod
     def create_link(cls, entrylines, check_year=True):
-        import re
-        regex_third = re.compile(current_system_account().get_third_mask())
         year = None
         third_info = None
         sum_amount = 0.0
         for entryline in entrylines:
             entryline = EntryLineAccount.objects.get(id=entryline.id)
-            if regex_third.match(entryline.account.code) is None:
+            if not entryline.account.is_third:
                 raise LucteriosException(IMPORTANT, _("An entry line is not third!"))
             # if check_year and (entryline.entry.year.status == 2):
             #    raise LucteriosException(IMPORTANT, _("Fiscal year finished!"))
@@ -876,10 +1242,146 @@ class AccountLink(LucteriosModel):
         for entryline in entrylines:
             entryline = EntryLineAccount.objects.get(id=entryline.id)
             entryline.unlink()
-        new_link = AccountLink.objects.create()
-        for entryline in entrylines:
-            entryline.link = new_link
-            entryline.save()
+        with transaction.atomic():
+            new_link = AccountLink.objects.create(num=cls.get_next_num(year))
+            for entryline in entrylines:
+                entryline.link = new_link
+                entryline.save()
+
+    @classmethod
+    def get_next_num(cls, year):
+        FiscalYear.objects.select_for_update().filter(id=year.id).first()
+        last_link = EntryLineAccount.objects.filter(entry__year=year, link__isnull=False).values('link__num').annotate(nb_line=Count('id')).order_by('-link__num').first()
+        if (last_link is None) or (last_link['link__num'] is None):
+            return 0
+        return last_link['link__num'] + last_link['nb_line']
+
+    @classmethod
+    def create_links(cls, year, link_sizes):
+        with transaction.atomic():
+            nb_link = cls.get_next_num(year)
+            new_links = []
+            for link_size in link_sizes:
+                new_links.append(cls(num=nb_link))
+                nb_link += link_size
+            if connection.features.can_return_ids_from_bulk_insert:
+                cls.objects.bulk_create(new_links)
+            else:
+                for new_link in new_links:
+                    new_link.save()
+            return [new_link.id for new_link in new_links]
+
+    @classmethod
+    def _search_subset(cls, target, candidates, work):
+        sums = {0: ()}
+        for line_id, amount in candidates:
+            work[0] -= len(sums)
+            for sum_value, subset in list(sums.items()):
+                new_sum = sum_value + amount
+                if (len(subset) < cls.auto_subset_size) and (new_sum not in sums) and (abs(new_sum) <= abs(target)):
+                    sums[new_sum] = subset + (line_id,)
+                    if new_sum == target:
+                        return list(sums[new_sum])
+            if (len(sums) > cls.auto_subset_states) or (work[0] <= 0):
+                break
+        return None
+
+    @classmethod
+    def _search_lettering(cls, lines, work):
+        groups = []
+        opened_by_amount = {}
+        for line_id, amount, _reference in lines:
+            if len(opened_by_amount.get(-amount, [])) > 0:
+                groups.append(('exact', [opened_by_amount[-amount].pop(0), line_id]))
+            else:
+                opened_by_amount.setdefault(amount, []).append(line_id)
+        used_ids = set([line_id for _method, line_ids in groups for line_id in line_ids])
+        lines_by_reference = {}
+        for line_id, amount, reference in lines:
+            if (line_id not in used_ids) and (reference is not None) and (reference.strip() != ''):
+                lines_by_reference.setdefault(reference.strip(), []).append((line_id, amount))
+        for reference in sorted(lines_by_reference.keys()):
+            ref_lines = lines_by_reference[reference]
+            if (len(ref_lines) > 1) and (sum([amount for _line_id, amount in ref_lines]) == 0):
+                groups.append(('reference', [line_id for line_id, _amount in ref_lines]))
+                used_ids.update([line_id for line_id, _amount in ref_lines])
+        if (len(lines) - len(used_ids)) <= cls.auto_subset_lines:
+            for line_id, amount, _reference in lines:
+                if work[0] <= 0:
+                    break
+                if (line_id not in used_ids) and (amount != 0):
+                    candidates = [(other_id, other_amount) for other_id, other_amount, _other_ref in lines
+                                  if (other_id not in used_ids) and ((other_amount * amount) < 0)]
+                    subset = cls._search_subset(-amount, candidates, work)
+                    if subset is not None:
+                        groups.append(('subset', [line_id] + subset))
+                        used_ids.update(groups[-1][1])
+        return groups
+
+    @classmethod
+    def auto_lettering(cls, year, third_ids=None, dry_run=False):
+        lines_query = Q(entry__year=year) & Q(account__is_third=True) & Q(third__isnull=False) & Q(link__isnull=True)
+        if third_ids is not None:
+            lines_query &= Q(third_id__in=third_ids)
+        lines_by_third = {}
+        for line_id, account_code, third_id, amount, reference in EntryLineAccount.objects.filter(lines_query).order_by('id').values_list('id', 'account__code', 'third_id', 'amount', 'reference'):
+            lines_by_third.setdefault((account_code, third_id), []).append((line_id, int(round(amount * 10000)), reference))
+        proposals = []
+        work = [cls.auto_subset_work]
+        for third_info in sorted(lines_by_third.keys()):
+            for method, line_ids in cls._search_lettering(lines_by_third[third_info], work):
+                proposals.append((third_info[0], third_info[1], method, line_ids))
+        if not dry_run:
+            cls.create_lettering(year, proposals)
+        return proposals
+
+    @classmethod
+    def get_lettering_param(cls, proposals):
+        return ';'.join(["%s:%s" % (proposal[2], ','.join([six.text_type(line_id) for line_id in proposal[3]])) for proposal in proposals])
+
+    @classmethod
+    def check_lettering(cls, year, lettering_param):
+        groups = []
+        for lettering_item in lettering_param.split(';'):
+            if ':' in lettering_item:
+                method, line_ids = lettering_item.split(':', 1)
+                groups.append((method, [int(line_id) for line_id in line_ids.split(',') if line_id.strip().isdigit()]))
+        lines = {}
+        all_ids = [line_id for _method, line_ids in groups for line_id in line_ids]
+        lines_query = Q(id__in=all_ids) & Q(entry__year=year) & Q(account__is_third=True) & Q(third__isnull=False) & Q(link__isnull=True)
+        for line_id, account_code, third_id, amount in EntryLineAccount.objects.filter(lines_query).values_list('id', 'account__code', 'third_id', 'amount'):
+            lines[line_id] = (account_code, third_id, int(round(amount * 10000)))
+        proposals = []
+        used_ids = set()
+        for method, line_ids in groups:
+            if (len(line_ids) < 2) or (len(set(line_ids)) != len(line_ids)) or (len(used_ids & set(line_ids)) > 0) or any([line_id not in lines for line_id in line_ids]):
+                continue
+            third_infos = set([lines[line_id][:2] for line_id in line_ids])
+            if (len(third_infos) == 1) and (sum([lines[line_id][2] for line_id in line_ids]) == 0):
+                third_info = third_infos.pop()
+                proposals.append((third_info[0], third_info[1], method, line_ids))
+                used_ids.update(line_ids)
+        return proposals
+
+    @classmethod
+    def create_lettering(cls, year, proposals):
+        if len(proposals) > 0:
+            with transaction.atomic():
+                link_ids = cls.create_links(year, [len(proposal[3]) for proposal in proposals])
+                line_links = []
+                for link_id, proposal in zip(link_ids, proposals):
+                    line_links.extend([(line_id, link_id) for line_id in proposal[3]])
+                EntryLineAccount.bulk_update_links(line_links)
+
+    @classmethod
+    def get_lettering_report(cls, proposals):
+        methods = {'exact': _('exact amount'), 'reference': _('same reference'), 'subset': _('sum of amounts')}
+        third_names = Third.get_names([proposal[1] for proposal in proposals])
+        report = []
+        for account_code, third_id, method, line_ids in proposals:
+            report.append(_("[%(code)s %(third)s] %(nb)d lines by %(method)s") % {'code': account_code, 'third': third_names.get(third_id, ''),
+                                                                                  'nb': len(line_ids), 'method': methods[method]})
+        return report
 
     class Meta(object):
 
@@ -961,7 +1463,7 @@ class EntryAccount(LucteriosModel):
         res = self.designation
         res += "{[br/]}"
         res += "{[table style='min-width:200px;']}"
-        for line in self.entrylineaccount_set.all():
+        for line in (self.entrylineaccount_set.select_related('account', 'costaccounting', 'link', 'third__contact__legalentity', 'third__contact__individual') if self.id is not None else []):
             res += "{[tr]}"
             res += "{[td]}%s{[/td]}" % line.entry_account
             res += "{[td]}%s{[/td]}" % get_amount_from_format_devise(line.debit, 6)
@@ -976,7 +1478,7 @@ class EntryAccount(LucteriosModel):
 
     @property
     def is_asset(self):
-        sum_customer = get_amount_sum(self.entrylineaccount_set.filter(account__code__regex=current_system_account().get_third_mask()).aggregate(Sum('amount')))
+        sum_customer = get_amount_sum(self.entrylineaccount_set.filter(account__is_third=True).aggregate(Sum('amount')))
         return ((sum_customer < 0) and not self.has_cash) or ((sum_customer > 0) and self.has_cash)
 
     def reverse_entry(self):
@@ -1019,21 +1521,13 @@ class EntryAccount(LucteriosModel):
     def get_serial(self, entrylines=None):
         if entrylines is None:
             entrylines = self.entrylineaccount_set.all()
-        serial_val = ''
-        for line in entrylines:
-            if serial_val != '':
-                serial_val += '\n'
-            serial_val += line.get_serial()
-        return serial_val
+        return EntryLineDraft.get_serial([EntryLineDraft.from_entryline(line) for line in entrylines])
 
     def get_entrylineaccounts(self, serial_vals):
         res = QuerySet(model=EntryLineAccount)
-        res._result_cache = []
-        for serial_val in serial_vals.split('\n'):
-            if serial_val != '':
-                new_line = EntryLineAccount.get_entrylineaccount(serial_val)
-                new_line.entry = self
-                res._result_cache.append(new_line)
+        res._result_cache = EntryLineDraft.get_entrylineaccounts(EntryLineDraft.from_serial(serial_vals))
+        for new_line in res._result_cache:
+            new_line.entry = self
         return res
 
     def save_entrylineaccounts(self, serial_vals):
@@ -1048,19 +1542,18 @@ class EntryAccount(LucteriosModel):
                     line.link.check_validity()
 
     def remove_entrylineaccounts(self, serial_vals, entrylineid):
-        lines = self.get_entrylineaccounts(serial_vals)
+        drafts = EntryLineDraft.from_serial(serial_vals)
         line_idx = -1
-        for idx in range(len(lines)):
-            if lines[idx].id == entrylineid:
+        for idx in range(len(drafts)):
+            if drafts[idx].id == entrylineid:
                 line_idx = idx
-        del lines._result_cache[line_idx]
-        return self.get_serial(lines)
+        del drafts[line_idx]
+        return EntryLineDraft.get_serial(drafts)
 
     def add_new_entryline(self, serial_entry, entrylineaccount, num_cpt, credit_val, debit_val, third, costaccounting, reference):
         if self.journal.id == 1:
             charts = ChartsAccount.objects.get(id=num_cpt)
-            if match(current_system_account().get_revenue_mask(), charts.code) or \
-                    match(current_system_account().get_expence_mask(), charts.code):
+            if charts.is_revenue or charts.is_expense:
                 raise LucteriosException(IMPORTANT, _('This kind of entry is not allowed for this journal!'))
         if entrylineaccount != 0:
             serial_entry = self.remove_entrylineaccounts(serial_entry, entrylineaccount)
@@ -1070,27 +1563,36 @@ class EntryAccount(LucteriosModel):
         return serial_entry
 
     def serial_control(self, serial_vals):
-        total_credit = 0
-        total_debit = 0
-        serial = self.get_entrylineaccounts(serial_vals)
-        current = self.entrylineaccount_set.all()
+        serial = EntryLineDraft.from_serial(serial_vals)
+        account_types = EntryLineDraft.get_account_types(serial)
+        for draft in serial:
+            if account_types[draft.account_id] not in (3, 4, 5):
+                draft.costaccounting_id = 0
         no_change = len(serial) > 0
-        if len(serial) == len(current):
+        if no_change:
+            current = [EntryLineDraft.from_entryline(line) for line in self.entrylineaccount_set.all()]
+            no_change = (len(serial) == len(current))
             for idx in range(len(serial)):
-                total_credit += serial[idx].get_credit()
-                total_debit += serial[idx].get_debit(with_correction=False)
                 no_change = no_change and current[idx].equals(serial[idx])
-        else:
-            no_change = False
-            for idx in range(len(serial)):
-                total_credit += serial[idx].get_credit()
-                total_debit += serial[idx].get_debit(with_correction=False)
-        return no_change, currency_round(max(0, total_credit - total_debit)), currency_round(max(0, total_debit - total_credit))
+        debit_rest, credit_rest = EntryLineDraft.get_rests(serial, account_types)
+        return no_change, debit_rest, credit_rest
+
+    @classmethod
+    def get_balance_controls(cls, entries):
+        credit_debit_way = Case(When(account__type_of_account__in=(0, 4), then=Value(-1.0)), default=Value(1.0), output_field=models.FloatField())
+        balance_controls = {}
+        for entry_balance in EntryLineAccount.objects.filter(entry__in=entries).order_by('entry_id').values('entry_id').annotate(balance=Sum(F('amount') * credit_debit_way, output_field=models.FloatField())):
+            balance = entry_balance['balance'] or 0.0
+            balance_controls[entry_balance['entry_id']] = (True, currency_round(max(0, balance)), currency_round(max(0, -1 * balance)))
+        return balance_controls
+
+    def balance_control(self):
+        return EntryAccount.get_balance_controls([self.id]).get(self.id, (False, 0.0, 0.0))
 
     def closed(self, check_balance=True):
         if (self.year.status != 2) and not self.close:
             if check_balance:
-                _no_change, debit_rest, credit_rest = self.serial_control(self.get_serial())
+                _no_change, debit_rest, credit_rest = self.balance_control()
                 if abs(debit_rest - credit_rest) >= 0.001:
                     raise LucteriosException(GRAVE, "Account entry not balanced: sum credit=%.3f / sum debit=%.3f" % (debit_rest, credit_rest))
             if Params.getvalue("accounting-needcost"):
@@ -1148,24 +1650,32 @@ class EntryAccount(LucteriosModel):
             return new_entry_line
 
     def get_thirds(self):
-        return self.entrylineaccount_set.filter(account__code__regex=current_system_account().get_third_mask()).distinct()
+        return self.entrylineaccount_set.filter(account__is_third=True).distinct()
 
     @property
     def has_third(self):
-        return self.entrylineaccount_set.filter(account__code__regex=current_system_account().get_third_mask()).count() > 0
+        return self.entrylineaccount_set.filter(account__is_third=True).count() > 0
 
     @property
     def has_customer(self):
-        return self.entrylineaccount_set.filter(account__code__regex=current_system_account().get_customer_mask()).count() > 0
+        return self.entrylineaccount_set.filter(account__is_customer=True).count() > 0
 
     @property
     def has_cash(self):
-        return self.entrylineaccount_set.filter(account__code__regex=current_system_account().get_cash_mask()).count() > 0
+        return self.entrylineaccount_set.filter(account__is_cash=True).count() > 0
 
     def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
         if (self.costaccounting is not None) and (self.costaccounting.year_id is not None) and (self.costaccounting.year_id != self.year_id):
             self.costaccounting_id = None
-        return LucteriosModel.save(self, force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
+        if self.id is not None:
+            old_state = EntryAccount.objects.filter(id=self.id).values_list('journal_id', 'close').first()
+        else:
+            old_state = None
+        res = LucteriosModel.save(self, force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
+        if old_state is not None:
+            ChartsAccountBalance.change_entry(self.id, old_state, (self.journal_id, self.close))
+        FiscalYear.change_results(self.year_id)
+        return res
 
     class Meta(object):
         verbose_name = _('entry of account')
@@ -1173,6 +1683,118 @@ class EntryAccount(LucteriosModel):
         ordering = ['date_value']
 
 
+class EntryLineDraft(object):
+    # serial information: "<id>|<accound id>|<third id> or 0|<amount>|<cost id> or 0|<link id> or 0|<reference> or None|"
+
+    __slots__ = ('id', 'account_id', 'third_id', 'amount', 'costaccounting_id', 'link_id', 'reference')
+
+    def __init__(self, entryline_id, account_id, third_id=0, amount=0.0, costaccounting_id=0, link_id=0, reference=None):
+        self.id = entryline_id
+        self.account_id = account_id
+        self.third_id = third_id
+        self.amount = amount
+        self.costaccounting_id = costaccounting_id
+        self.link_id = link_id
+        self.reference = reference
+
+    @classmethod
+    def from_serial(cls, serial_vals):
+        drafts = []
+        for serial_val in serial_vals.split('\n'):
+            if serial_val != '':
+                serial_items = serial_val.split('|')
+                reference = "".join(serial_items[6:-1])
+                if reference.startswith("None"):
+                    reference = None
+                drafts.append(cls(int(serial_items[0]), int(serial_items[1]), int(serial_items[2]), float(serial_items[3]),
+                                  int(serial_items[4]), int(serial_items[5]), reference))
+        return drafts
+
+    @classmethod
+    def from_entryline(cls, entryline):
+        return cls(entryline.id, entryline.account_id, entryline.third_id or 0, entryline.amount,
+                   entryline.costaccounting_id or 0, entryline.link_id or 0, entryline.reference)
+
+    def get_serial_line(self):
+        return "%d|%d|%d|%f|%d|%d|%s|" % (self.id, self.account_id, self.third_id, self.amount, self.costaccounting_id, self.link_id,
+                                          'None' if self.reference is None else self.reference)
+
+    @classmethod
+    def get_serial(cls, drafts):
+        return "\n".join([draft.get_serial_line() for draft in drafts])
+
+    def equals(self, other):
+        res = (self.id == other.id) and (self.account_id == other.account_id)
+        res = res and (abs(self.amount - other.amount) < 0.0001)
+        res = res and (self.reference == other.reference)
+        res = res and (self.third_id == other.third_id)
+        return res and (self.costaccounting_id == other.costaccounting_id)
+
+    @classmethod
+    def _get_in_bulk(cls, queryset, ids):
+        ids = set([item_id for item_id in ids if item_id != 0])
+        items = queryset.in_bulk(ids) if len(ids) > 0 else {}
+        for item_id in ids:
+            if item_id not in items:
+                raise queryset.model.DoesNotExist("%s matching query does not exist." % queryset.model._meta.object_name)
+        return items
+
+    @classmethod
+    def get_rests(cls, drafts, account_types):
+        balance = 0.0
+        for draft in drafts:
+            if account_types[draft.account_id] in (0, 4):
+                balance -= draft.amount
+            else:
+                balance += draft.amount
+        return currency_round(max(0, balance)), currency_round(max(0, -1 * balance))
+
+    @classmethod
+    def bulk_create(cls, entry_drafts, batch_size=None):
+        new_lines = []
+        account_amounts = {}
+        for entry, drafts in entry_drafts:
+            for draft in drafts:
+                new_lines.append(EntryLineAccount(entry=entry, account_id=draft.account_id, third_id=draft.third_id or None, amount=draft.amount,
+                                                  costaccounting_id=draft.costaccounting_id or None, link_id=draft.link_id or None, reference=draft.reference))
+                balance_key = (draft.account_id, entry.journal_id, entry.close)
+                account_amounts[balance_key] = account_amounts.get(balance_key, 0.0) + draft.amount
+        EntryLineAccount.objects.bulk_create(new_lines, batch_size=batch_size)
+        bulk_auditlog(EntryLineAccount, LucteriosLogEntry.Action.CREATE, new_lines)
+        for year_id in set([entry.year_id for entry, _drafts in entry_drafts]):
+            FiscalYear.change_results(year_id)
+        for (account_id, journal_id, close), amount in account_amounts.items():
+            ChartsAccountBalance.add_amount(account_id, journal_id, close, amount)
+
+    @classmethod
+    def get_account_types(cls, drafts):
+        ids = set([draft.account_id for draft in drafts])
+        account_types = dict(ChartsAccount.objects.filter(id__in=ids).values_list('id', 'type_of_account')) if len(ids) > 0 else {}
+        if len(account_types) != len(ids):
+            raise ChartsAccount.DoesNotExist("ChartsAccount matching query does not exist.")
+        return account_types
+
+    @classmethod
+    def get_entrylineaccounts(cls, drafts):
+        accounts = cls._get_in_bulk(ChartsAccount.objects.all(), [draft.account_id for draft in drafts])
+        thirds = cls._get_in_bulk(Third.objects.select_related('contact'), [draft.third_id for draft in drafts])
+        costaccountings = cls._get_in_bulk(CostAccounting.objects.all(), [draft.costaccounting_id for draft in drafts
+                                                                          if accounts[draft.account_id].type_of_account in (3, 4, 5)])
+        links = cls._get_in_bulk(AccountLink.objects.all(), [draft.link_id for draft in drafts])
+        entrylines = []
+        for draft in drafts:
+            new_entry_line = EntryLineAccount(id=draft.id, amount=draft.amount, reference=draft.reference)
+            new_entry_line.account = accounts[draft.account_id]
+            new_entry_line.third = thirds.get(draft.third_id)
+            if new_entry_line.account.type_of_account in (3, 4, 5):
+                new_entry_line.costaccounting = costaccountings.get(draft.costaccounting_id)
+            else:
+                new_entry_line.costaccounting = None
+            new_entry_line.link = links.get(draft.link_id)
+            entrylines.append(new_entry_line)
+        return entrylines
+
+
 class EntryLineAccount(LucteriosModel):
     account = models.ForeignKey('ChartsAccount', verbose_name=_('account'), null=False, on_delete=models.PROTECT)
     entry = models.ForeignKey('EntryAccount', verbose_name=_('entry'), null=False, on_delete=models.CASCADE)
@@ -1190,6 +1812,20 @@ class EntryLineAccount(LucteriosModel):
     def get_auditlog_object(self):
         return self.entry.get_final_child()
 
+    @classmethod
+    def bulk_update_links(cls, line_links):
+        if is_auditlog_active(cls):
+            old_lines = cls.objects.in_bulk([line_id for line_id, _link_id in line_links])
+            new_lines = []
+            for line_id, link_id in line_links:
+                new_line = cls(**{field.attname: getattr(old_lines[line_id], field.attname) for field in cls._meta.concrete_fields})
+                new_line.link_id = link_id
+                new_lines.append(new_line)
+            cls.objects.bulk_update(new_lines, ['link'], batch_size=500)
+            bulk_auditlog(cls, LucteriosLogEntry.Action.UPDATE, new_lines, [old_lines[line_id] for line_id, _link_id in line_links])
+        else:
+            cls.objects.bulk_update([cls(id=line_id, link_id=link_id) for line_id, link_id in line_links], ['link'], batch_size=500)
+
     @classmethod
     def get_other_fields(cls):
         return ['entry_account', 'debit', 'credit', 'reference', 'costaccounting', 'link']
@@ -1287,78 +1923,104 @@ class EntryLineAccount(LucteriosModel):
             res = res and (self.costaccounting.id == other.costaccounting.id)
         return res
 
+    import_batch_size = 200
+
     @classmethod
     def initialize_import(cls):
         if hasattr(cls, 'entry_imported'):
             del cls.entry_imported
-        if hasattr(cls, 'serial_entry_imported'):
-            del cls.serial_entry_imported
+        if hasattr(cls, 'drafts_imported'):
+            del cls.drafts_imported
+        cls.import_cache = None
+        cls.import_pending = []
+
+    @classmethod
+    def _flush_import(cls):
+        pending = getattr(cls, 'import_pending', [])
+        if len(pending) > 0:
+            with transaction.atomic(savepoint=False):
+                EntryLineDraft.bulk_create(pending, batch_size=cls.import_batch_size * 5)
+        cls.import_pending = []
+
+    @classmethod
+    def get_import_cache(cls, year_id):
+        if (getattr(cls, 'import_cache', None) is None) or (cls.import_cache['year'] != year_id):
+            import_cache = {'year': year_id, 'fiscalyear': FiscalYear.objects.get(id=year_id), 'accounts': {}, 'account_types': {}, 'thirds': {}, 'costaccountings': {}}
+            for account_id, code, type_of_account, is_revenue, is_expense in ChartsAccount.objects.filter(year_id=year_id).values_list('id', 'code', 'type_of_account', 'is_revenue', 'is_expense'):
+                import_cache['accounts'][code] = (account_id, type_of_account, is_revenue or is_expense)
+                import_cache['account_types'][account_id] = type_of_account
+            for third_id, legalentity_name, lastname, firstname in Third.objects.order_by('id').values_list('id', 'contact__legalentity__name', 'contact__individual__lastname', 'contact__individual__firstname'):
+                if legalentity_name is not None:
+                    import_cache['thirds'].setdefault(legalentity_name, third_id)
+                if lastname is not None:
+                    import_cache['thirds'].setdefault("%s %s" % (lastname, firstname), third_id)
+            for costaccounting_id, name in CostAccounting.objects.filter(status=0).values_list('id', 'name'):
+                import_cache['costaccountings'].setdefault(name, costaccounting_id)
+            cls.import_cache = import_cache
+        return cls.import_cache
 
     @classmethod
     def import_data(cls, rowdata, dateformat):
         new_item = None
         if hasattr(cls, 'entry_imported'):
             if (cls.entry_imported.date_value != rowdata['entry.date_value']) or (cls.entry_imported.designation != rowdata['entry.designation']):
-                new_item = cls.finalize_import()
+                new_item = cls.finalize_import_group()
+        import_cache = cls.get_import_cache(rowdata['entry.year'])
         if not hasattr(cls, 'entry_imported'):
-            cls.entry_imported = EntryAccount(year_id=rowdata['entry.year'], journal_id=rowdata['entry.journal'], date_value=rowdata['entry.date_value'], designation=rowdata['entry.designation'])
-        if not hasattr(cls, 'serial_entry_imported'):
-            cls.serial_entry_imported = ""
-        account = ChartsAccount.objects.filter(code=rowdata['account'], year_id=rowdata['entry.year']).first()
-        third = None
-        if 'third' in rowdata:
-            q_legalentity = Q(contact__legalentity__name=rowdata['third'])
-            q_individual = Q(completename=rowdata['third'])
-            third = Third.objects.annotate(completename=Concat('contact__individual__lastname',
-                                                               Value(' '),
-                                                               'contact__individual__firstname')).annotate(num_entryline=Count('entrylineaccount')).filter(q_legalentity | q_individual).first()
-
-        costaccounting = None
-        if 'costaccounting' in rowdata:
-            costaccounting = CostAccounting.objects.filter(name=rowdata['costaccounting'], status=0).first()
-        reference = rowdata['reference'] if 'reference' in rowdata else None
+            cls.entry_imported = EntryAccount(year=import_cache['fiscalyear'], journal_id=rowdata['entry.journal'], date_value=rowdata['entry.date_value'], designation=rowdata['entry.designation'])
+        if not hasattr(cls, 'drafts_imported'):
+            cls.drafts_imported = []
+        account = import_cache['accounts'].get(rowdata['account'])
         if account is not None:
-            cls.serial_entry_imported = cls.entry_imported.add_new_entryline(cls.serial_entry_imported, 0, account.id,
-                                                                             credit_val=rowdata['credit'], debit_val=rowdata['debit'],
-                                                                             third=third.id if third is not None else 0,
-                                                                             costaccounting=costaccounting.id if costaccounting is not None else 0,
-                                                                             reference=reference)
+            account_id, type_of_account, is_result = account
+            if (cls.entry_imported.journal_id == 1) and is_result:
+                raise LucteriosException(IMPORTANT, _('This kind of entry is not allowed for this journal!'))
+            third_id = import_cache['thirds'].get(rowdata['third'], 0) if 'third' in rowdata else 0
+            if ('costaccounting' in rowdata) and (type_of_account in (3, 4, 5)):
+                costaccounting_id = import_cache['costaccountings'].get(rowdata['costaccounting'], 0)
+            else:
+                costaccounting_id = 0
+            credit_debit_way = -1 if type_of_account in (0, 4) else 1
+            if rowdata['debit'] > 0:
+                amount = -1 * rowdata['debit'] * credit_debit_way
+            elif rowdata['credit'] > 0:
+                amount = rowdata['credit'] * credit_debit_way
+            else:
+                amount = 0
+            reference = rowdata['reference'] if 'reference' in rowdata else None
+            if reference == "None":
+                reference = None
+            cls.drafts_imported.append(EntryLineDraft(-1 * (len(cls.drafts_imported) + 1), account_id, third_id, amount, costaccounting_id, 0, reference))
         return new_item
 
     @classmethod
-    def finalize_import(cls):
+    def finalize_import_group(cls):
         new_item = None
         if hasattr(cls, 'entry_imported'):
-            if not hasattr(cls, 'serial_entry_imported'):
-                cls.serial_entry_imported = ""
-            _no_change, debit_rest, credit_rest = cls.entry_imported.serial_control(cls.serial_entry_imported)
-            if (debit_rest < 0.0001) and (credit_rest < 0.0001) and (len(cls.serial_entry_imported) > 0) and cls.entry_imported.check_date(checking=True):
-                new_item = cls.entry_imported
-                new_item.save()
-                new_item.save_entrylineaccounts(cls.serial_entry_imported)
-            del cls.serial_entry_imported
+            drafts = getattr(cls, 'drafts_imported', [])
+            if len(drafts) > 0:
+                debit_rest, credit_rest = EntryLineDraft.get_rests(drafts, cls.get_import_cache(cls.entry_imported.year_id)['account_types'])
+                if (debit_rest < 0.0001) and (credit_rest < 0.0001) and cls.entry_imported.check_date(checking=True):
+                    new_item = cls.entry_imported
+                    new_item.save()
+                    if not hasattr(cls, 'import_pending'):
+                        cls.import_pending = []
+                    cls.import_pending.append((new_item, drafts))
+                    if len(cls.import_pending) >= cls.import_batch_size:
+                        cls._flush_import()
+            if hasattr(cls, 'drafts_imported'):
+                del cls.drafts_imported
             del cls.entry_imported
         return new_item
 
+    @classmethod
+    def finalize_import(cls):
+        new_item = cls.finalize_import_group()
+        cls._flush_import()
+        return new_item
+
     def get_serial(self):
-        # return serial information: "<id>|<accound id>|<third id> or 0|<amount>|<cost id> or 0|<link id> or 0|<reference> or None"
-        if self.third is None:
-            third_id = 0
-        else:
-            third_id = self.third.id
-        if self.reference is None:
-            reference = 'None'
-        else:
-            reference = self.reference
-        if self.costaccounting is None:
-            costaccounting_id = 0
-        else:
-            costaccounting_id = self.costaccounting.id
-        if self.link is None:
-            link_id = 0
-        else:
-            link_id = self.link.id
-        return "%d|%d|%d|%f|%d|%d|%s|" % (self.id, self.account.id, third_id, self.amount, costaccounting_id, link_id, reference)
+        return EntryLineDraft.from_entryline(self).get_serial_line()
 
     @classmethod
     def add_serial(cls, num_cpt, debit_val, credit_val, thirdid=0, costaccountingid=0, reference=None):
@@ -1366,14 +2028,11 @@ class EntryLineAccount(LucteriosModel):
         new_entry_line = cls()
         new_entry_line.id = -1 * int(time.time() * 60)
         new_entry_line.account = ChartsAccount.objects.get(id=num_cpt)
-        if thirdid == 0:
-            new_entry_line.third = None
-        else:
-            new_entry_line.third = Third.objects.get(id=thirdid)
+        new_entry_line.third_id = thirdid if thirdid != 0 else None
         if (costaccountingid == 0) or (new_entry_line.account.type_of_account not in (3, 4, 5)):
-            new_entry_line.costaccounting = None
+            new_entry_line.costaccounting_id = None
         else:
-            new_entry_line.costaccounting = CostAccounting.objects.get(id=costaccountingid)
+            new_entry_line.costaccounting_id = costaccountingid
         new_entry_line.set_montant(debit_val, credit_val)
         if reference == "None":
             new_entry_line.reference = None
@@ -1383,27 +2042,7 @@ class EntryLineAccount(LucteriosModel):
 
     @classmethod
     def get_entrylineaccount(cls, serial_val):
-        serial_vals = serial_val.split('|')
-        new_entry_line = cls()
-        new_entry_line.id = int(serial_vals[0])
-        new_entry_line.account = ChartsAccount.objects.get(id=int(serial_vals[1]))
-        if int(serial_vals[2]) == 0:
-            new_entry_line.third = None
-        else:
-            new_entry_line.third = Third.objects.get(id=int(serial_vals[2]))
-        new_entry_line.amount = float(serial_vals[3])
-        if (int(serial_vals[4]) == 0) or (new_entry_line.account.type_of_account not in (3, 4, 5)):
-            new_entry_line.costaccounting = None
-        else:
-            new_entry_line.costaccounting = CostAccounting.objects.get(id=int(serial_vals[4]))
-        if int(serial_vals[5]) == 0:
-            new_entry_line.link = None
-        else:
-            new_entry_line.link = AccountLink.objects.get(id=int(serial_vals[5]))
-        new_entry_line.reference = "".join(serial_vals[6:-1])
-        if new_entry_line.reference.startswith("None"):
-            new_entry_line.reference = None
-        return new_entry_line
+        return EntryLineDraft.get_entrylineaccounts(EntryLineDraft.from_serial(serial_val))[0]
 
     def create_clone_inverse(self):
         import time
@@ -1447,7 +2086,11 @@ class EntryLineAccount(LucteriosModel):
     def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
         if (self.account.type_of_account not in (3, 4, 5)) and (self.costaccounting is not None):
             self.costaccounting = None
-        return LucteriosModel.save(self, force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
+        old_state = ChartsAccountBalance.get_line_state(self.id)
+        res = LucteriosModel.save(self, force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
+        ChartsAccountBalance.change_line(old_state, ChartsAccountBalance.get_line_state(self.id))
+        FiscalYear.change_results(self.account.year_id)
+        return res
 
     class Meta(object):
         verbose_name = _('entry line of account')
@@ -1594,9 +2237,22 @@ class Budget(LucteriosModel):
         return ['code']
 
     def get_budget(self):
-        chart = ChartsAccount.get_chart_account(self.code)
+        chart = ChartsAccount.get_chart_account(self.code, getattr(self, 'chart_accounts', None))
         return six.text_type(chart)
 
+    @classmethod
+    def bulk_create_budgets(cls, new_budgets):
+        if connection.features.can_return_ids_from_bulk_insert or not is_auditlog_active(cls):
+            cls.objects.bulk_create(new_budgets)
+            bulk_auditlog(cls, LucteriosLogEntry.Action.CREATE, new_budgets)
+        else:
+            for new_budget in new_budgets:
+                new_budget.save()
+
+    def set_context(self, xfer):
+        if (xfer is not None) and hasattr(xfer, 'chart_accounts'):
+            setattr(self, 'chart_accounts', xfer.chart_accounts)
+
     def credit_debit_way(self):
         chart_account = current_system_account().new_charts_account(self.code)
         if chart_account[0] == '':
@@ -1636,8 +2292,8 @@ class Budget(LucteriosModel):
             budget_filter &= Q(year_id=year)
         if cost is not None:
             budget_filter &= Q(cost_accounting_id=cost)
-        total_revenue = get_amount_sum(cls.objects.filter(budget_filter & Q(code__regex=current_system_account().get_revenue_mask())).aggregate(Sum('amount')))
-        total_expense = get_amount_sum(cls.objects.filter(budget_filter & Q(code__regex=current_system_account().get_expence_mask())).aggregate(Sum('amount')))
+        total_revenue = get_amount_sum(cls.objects.filter(budget_filter & get_mask_filter(current_system_account().get_revenue_mask())).aggregate(Sum('amount')))
+        total_expense = get_amount_sum(cls.objects.filter(budget_filter & get_mask_filter(current_system_account().get_expence_mask())).aggregate(Sum('amount')))
         return total_revenue - total_expense
 
     def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
@@ -1669,6 +2325,149 @@ class Budget(LucteriosModel):
         ordering = ['code']
 
 
+class ImportJob(LucteriosModel):
+    modelname = models.CharField(_('model'), max_length=100)
+    job_hash = models.CharField(_('hash'), max_length=64, db_index=True)
+    date = models.DateTimeField(_('date'), null=False)
+    status = models.IntegerField(verbose_name=_('status'), choices=((0, _('in progress')), (1, _('finished'))), null=False, default=0, db_index=True)
+    nb_rows = models.IntegerField(_('number of rows'), default=0)
+    offset = models.IntegerField(_('rows read'), default=0)
+    nb_imported = models.IntegerField(_('items imported'), default=0)
+    nb_skipped = models.IntegerField(_('rows skipped'), default=0)
+
+    progress = LucteriosVirtualField(verbose_name=_('progress'), compute_from='get_progress')
+
+    def __str__(self):
+        return "%s %s" % (self.modelname, self.progress)
+
+    @classmethod
+    def get_default_fields(cls):
+        return ['date', 'modelname', 'status', 'progress', 'nb_imported', 'nb_skipped']
+
+    def get_progress(self):
+        if self.nb_rows == 0:
+            return "%d/---" % self.offset
+        return "%d/%d (%.1f%%)" % (self.offset, self.nb_rows, 100.0 * self.offset / self.nb_rows)
+
+    @classmethod
+    def get_or_start(cls, modelname, job_hash):
+        job = cls.objects.filter(modelname=modelname, job_hash=job_hash, status=0).order_by('-id').first()
+        if job is None:
+            job = cls.objects.create(modelname=modelname, job_hash=job_hash, date=timezone.now())
+        return job
+
+    def checkpoint(self, offset, nb_imported, nb_skipped, finished=False):
+        self.offset = offset
+        self.nb_imported += nb_imported
+        self.nb_skipped += nb_skipped
+        if finished:
+            self.nb_rows = offset
+            self.status = 1
+        self.date = timezone.now()
+        self.save()
+
+    class Meta(object):
+        verbose_name = _('import job')
+        verbose_name_plural = _('import jobs')
+        ordering = ['-date']
+        default_permissions = []
+
+
+class ImportedContent(LucteriosModel):
+    modelname = models.CharField(_('model'), max_length=100)
+    content_hash = models.CharField(_('hash'), max_length=64)
+    item_model = models.CharField(_('item model'), max_length=100, default='')
+    item_id = models.IntegerField(_('item id'), null=True, default=None)
+
+    def __str__(self):
+        return "%s %s" % (self.modelname, self.content_hash)
+
+    @classmethod
+    def get_known_hashes(cls, modelname, content_hashes):
+        known_items = {}
+        content_hashes = list(content_hashes)
+        for idx in range(0, len(content_hashes), 500):
+            for content_id, content_hash, item_model, item_id in cls.objects.filter(modelname=modelname, content_hash__in=content_hashes[idx:idx + 500]).values_list('id', 'content_hash', 'item_model', 'item_id'):
+                known_items.setdefault((item_model, item_id), []).append((content_id, content_hash))
+        items_by_model = {}
+        for item_model, item_id in known_items.keys():
+            if (item_model != '') and (item_id is not None):
+                items_by_model.setdefault(item_model, set()).add(item_id)
+        for item_model, item_ids in items_by_model.items():
+            existing_ids = set(apps.get_model(item_model).objects.filter(id__in=item_ids).values_list('id', flat=True))
+            for item_id in item_ids - existing_ids:
+                cls.objects.filter(id__in=[content_id for content_id, _content_hash in known_items[(item_model, item_id)]]).delete()
+                del known_items[(item_model, item_id)]
+        return set([content_hash for contents in known_items.values() for _content_id, content_hash in contents])
+
+    @classmethod
+    def add_hashes(cls, modelname, content_items):
+        new_contents = []
+        for content_hash, items in content_items:
+            new_contents.extend([cls(modelname=modelname, content_hash=content_hash, item_model=item.get_long_name(), item_id=item.id) for item in items])
+        cls.objects.bulk_create(new_contents, batch_size=500)
+
+    class Meta(object):
+        verbose_name = _('imported content')
+        verbose_name_plural = _('imported contents')
+        default_permissions = []
+        index_together = (('modelname', 'content_hash'),)
+
+
+def is_auditlog_active(model):
+    return auditlog.contains(model) and LucteriosAuditlogModelRegistry.get_state(model._meta.app_label)
+
+
+def bulk_auditlog(model, action, instances, old_instances=None):
+    if (len(instances) == 0) or not is_auditlog_active(model):
+        return
+    for field in model._meta.concrete_fields:
+        if field.many_to_one:
+            related_ids = set([getattr(instance, field.attname) for instance in instances if not field.is_cached(instance)]) - set([None])
+            if len(related_ids) > 0:
+                related_items = field.related_model.objects.in_bulk(list(related_ids))
+                for instance in instances:
+                    if not field.is_cached(instance) and (getattr(instance, field.attname) in related_items):
+                        field.set_cached_value(instance, related_items[getattr(instance, field.attname)])
+    sub_action = {LucteriosLogEntry.Action.CREATE: LucteriosLogEntry.Action.ADD,
+                  LucteriosLogEntry.Action.UPDATE: LucteriosLogEntry.Action.UPDATE,
+                  LucteriosLogEntry.Action.DELETE: LucteriosLogEntry.Action.DELETE}[action]
+    new_logs = []
+    sub_changes = {}
+    for idx, instance in enumerate(instances):
+        if action == LucteriosLogEntry.Action.CREATE:
+            changes = model_instance_diff(None, instance)
+        elif action == LucteriosLogEntry.Action.UPDATE:
+            changes = model_instance_diff(old_instances[idx], instance)
+        else:
+            changes = model_instance_diff(instance, None)
+        if (action == LucteriosLogEntry.Action.UPDATE) and not changes:
+            continue
+        try:
+            sub_obj = instance.get_auditlog_object()
+        except ObjectDoesNotExist:
+            continue
+        if sub_obj is None:
+            new_logs.append(LucteriosLogEntry(modelname=model.get_long_name(), object_pk=six.text_type(instance.pk), object_id=instance.pk,
+                                              object_repr=smart_text(instance), action=action, changes=json.dumps(changes, default=six.text_type)))
+        else:
+            sub_key = (sub_obj.__class__, sub_obj.pk)
+            if sub_key not in sub_changes:
+                sub_changes[sub_key] = (sub_obj, [])
+            sub_changes[sub_key][1].append({'modelname': model.get_long_name(), 'changes': changes})
+    for sub_obj, changes_list in sub_changes.values():
+        if hasattr(sub_obj, '_last_log') and (sub_obj._last_log.id is not None):
+            sub_obj._last_log.change_additional_data(six.text_type(model._meta.verbose_name), sub_action, changes_list)
+        else:
+            additional_data = {six.text_type(model._meta.verbose_name): {sub_action: changes_list}}
+            new_logs.append(LucteriosLogEntry(modelname=sub_obj.__class__.get_long_name(), object_pk=six.text_type(sub_obj.pk), object_id=sub_obj.pk,
+                                              object_repr=smart_text(sub_obj), action=LucteriosLogEntry.Action.UPDATE, changes='{}',
+                                              additional_data=json.dumps(additional_data, default=six.text_type)))
+    for new_log in new_logs:
+        pre_save.send(sender=LucteriosLogEntry, instance=new_log, raw=False, using=new_log._state.db, update_fields=None)
+    LucteriosLogEntry.objects.bulk_create(new_logs, batch_size=500)
+
+
 def check_accountingcost():
     for entry in EntryAccount.objects.filter(costaccounting_id__gt=0, year__status__lt=2):
         try:
@@ -1728,6 +2527,32 @@ def pre_save_datadb(sender, **kwargs):
             kwargs['instance'].costaccounting_id = None
 
 
+def pre_delete_entrylineaccount(sender, instance, **kwargs):
+    ChartsAccountBalance.change_line(ChartsAccountBalance.get_line_state(instance.id), None)
+    FiscalYear.change_results(instance.account.year_id)
+
+
+def post_save_contact(sender, instance, created, **kwargs):
+    if isinstance(instance, AbstractContact) and not created:
+        Third.refresh_sort_name(instance)
+
+
+def post_save_fiscalyear(sender, instance, created, **kwargs):
+    if created:
+        FiscalYear.clear_letters()
+    FiscalYear.clear_closed_years()
+    FiscalYear.change_results(instance.id)
+
+
+def post_save_chartsaccount(sender, instance, **kwargs):
+    FiscalYear.change_results(instance.year_id)
+
+
+def post_delete_fiscalyear(sender, instance, **kwargs):
+    FiscalYear.clear_letters()
+    FiscalYear.clear_closed_years()
+
+
 def get_meta_currency_iso():
     currency_file = join(dirname(__file__), 'currency_iso.csv')
     if isfile(currency_file):
@@ -1772,7 +2597,7 @@ def accounting_convertdata():
     for entryline in EntryLineAccount.objects.exclude(Q(entry__year=F("account__year"))):  # check link between year of entry and year of account code
         entryline.account = entryline.entry.year.getorcreate_chartaccount(entryline.account.code, entryline.account.name)
         entryline.save()
-    for entryline in EntryLineAccount.objects.filter(Q(third__isnull=False) & ~Q(account__code__regex=current_system_account().get_third_mask())):
+    for entryline in EntryLineAccount.objects.filter(Q(third__isnull=False) & Q(account__is_third=False)):
         entryline.third = None
         entryline.save()
 
@@ -1794,3 +2619,8 @@ def accounting_auditlog_register():
 
 
 pre_save.connect(pre_save_datadb)
+pre_delete.connect(pre_delete_entrylineaccount, sender=EntryLineAccount)
+post_save.connect(post_save_fiscalyear, sender=FiscalYear)
+post_save.connect(post_save_contact)
+post_delete.connect(post_delete_fiscalyear, sender=FiscalYear)
+post_save.connect(post_save_chartsaccount, sender=ChartsAccount)
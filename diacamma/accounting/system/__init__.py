@@ -23,7 +23,9 @@ along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
 from __future__ import unicode_literals
+import re
 
+from django.db.models import Q
 from django.utils.translation import ugettext_lazy as _
 from django.utils.module_loading import import_module
 
@@ -66,3 +68,48 @@ def get_accounting_system(complete_name):
             pass
     from diacamma.accounting.system.default import DefaultSystemAccounting
     return DefaultSystemAccounting()
+
+
+ACCOUNT_CLASSIFICATION = (('is_third', 'get_third_mask'), ('is_customer', 'get_customer_mask'), ('is_provider', 'get_provider_mask'),
+                          ('is_cash', 'get_cash_mask'), ('is_revenue', 'get_revenue_mask'), ('is_expense', 'get_expence_mask'),
+                          ('is_annexe', 'get_annexe_mask'))
+
+MASK_TAIL_REGEX = re.compile(r'^(\[[^\]]*\](\{[0-9]+(,[0-9]*)?\}|[*+?])?|\.[*+?]?)*\$?$')
+
+
+def get_mask_prefixes(mask):
+    if ('(' in mask) or ('\\' in mask):
+        return None
+    prefixes = []
+    for alternative in mask.split('|'):
+        if alternative.startswith('^'):
+            alternative = alternative[1:]
+        prefix = ''
+        while (len(prefix) < len(alternative)) and alternative[len(prefix)].isalnum():
+            prefix += alternative[len(prefix)]
+        if MASK_TAIL_REGEX.match(alternative[len(prefix):]) is None:
+            return None
+        prefixes.append(prefix)
+    prefixes.sort()
+    res = []
+    for prefix in prefixes:
+        if (len(res) == 0) or not prefix.startswith(res[-1]):
+            res.append(prefix)
+    return res
+
+
+def get_mask_filter(mask, fieldname='code'):
+    prefixes = get_mask_prefixes(mask)
+    if prefixes is None:
+        return Q(**{fieldname + '__regex': mask})
+    mask_filter = Q()
+    for prefix in prefixes:
+        mask_filter |= Q(**{fieldname + '__startswith': prefix})
+    return mask_filter
+
+
+def get_account_classification(system, code):
+    res = {}
+    for field_name, mask_name in ACCOUNT_CLASSIFICATION:
+        res[field_name] = re.match(getattr(system, mask_name)(), code) is not None
+    return res
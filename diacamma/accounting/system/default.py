@@ -26,6 +26,7 @@ from __future__ import unicode_literals
 import re
 
 from django.utils import six
+from django.db import transaction
 from django.utils.translation import ugettext_lazy as _
 
 from lucterios.framework.tools import get_icon_path
@@ -173,44 +174,30 @@ class DefaultSystemAccounting(object):
             new_entry.closed(check_balance=False)
 
     def _create_thirds_ending_entry(self, year):
-        from diacamma.accounting.models import EntryAccount, EntryLineAccount
+        from diacamma.accounting.models import EntryAccount, EntryLineAccount, EntryLineDraft
         end_desig = _("Fiscal year closing - Third")
-
-        last_account_id = 0
-        sum_account = 0.0
-        new_entry = EntryAccount.objects.create(year=year, journal_id=5, designation=end_desig, date_value=year.end)
-        for entry_line in EntryLineAccount.objects.filter(account__code__regex=self.get_third_mask(), account__year=year, link__isnull=True, third__isnull=False).order_by('account'):
-            if (last_account_id != entry_line.account_id) and (abs(sum_account) > 0.0001):
-                new_line = EntryLineAccount()
-                new_line.entry = new_entry
-                new_line.account_id = last_account_id
-                new_line.amount = sum_account
-                new_line.third = None
-                new_line.save()
-                sum_account = 0
-            last_account_id = entry_line.account_id
-            new_line = EntryLineAccount()
-            new_line.entry = new_entry
-            new_line.amount = -1 * entry_line.amount
-            new_line.account_id = entry_line.account_id
-            new_line.third_id = entry_line.third_id
-            if (entry_line.reference is not None) and (entry_line.reference != ''):
-                new_line.reference = entry_line.reference
-            else:
-                new_line.reference = entry_line.entry.designation
-            new_line.save()
-            AccountLink.create_link([new_line, entry_line])
-            sum_account += float(entry_line.amount)
-        if last_account_id == 0:
-            new_entry.delete()
-        else:
+        entry_lines = list(EntryLineAccount.objects.filter(account__is_third=True, account__year=year, link__isnull=True, third__isnull=False).order_by('account', 'id').values_list('id', 'account_id', 'third_id', 'amount', 'reference', 'entry__designation'))
+        if len(entry_lines) == 0:
+            return
+        with transaction.atomic():
+            new_entry = EntryAccount.objects.create(year=year, journal_id=5, designation=end_desig, date_value=year.end)
+            link_ids = AccountLink.create_links(year, [2] * len(entry_lines))
+            drafts = []
+            last_account_id = 0
+            sum_account = 0.0
+            for (line_id, account_id, third_id, amount, reference, designation), link_id in zip(entry_lines, link_ids):
+                if (last_account_id != account_id) and (abs(sum_account) > 0.0001):
+                    drafts.append(EntryLineDraft(-1 * (len(drafts) + 1), last_account_id, 0, sum_account, 0, 0, None))
+                    sum_account = 0
+                last_account_id = account_id
+                if (reference is None) or (reference == ''):
+                    reference = designation
+                drafts.append(EntryLineDraft(-1 * (len(drafts) + 1), account_id, third_id, -1 * amount, 0, link_id, reference))
+                sum_account += float(amount)
             if abs(sum_account) > 0.0001:
-                new_line = EntryLineAccount()
-                new_line.entry = new_entry
-                new_line.account_id = last_account_id
-                new_line.amount = sum_account
-                new_line.third = None
-                new_line.save()
+                drafts.append(EntryLineDraft(-1 * (len(drafts) + 1), last_account_id, 0, sum_account, 0, 0, None))
+            EntryLineDraft.bulk_create([(new_entry, drafts)], batch_size=500)
+            EntryLineAccount.bulk_update_links([(entry_line[0], link_id) for entry_line, link_id in zip(entry_lines, link_ids)])
             new_entry.closed()
 
     def finalize_year(self, year):
@@ -231,7 +218,7 @@ class DefaultSystemAccounting(object):
     def _create_report_third(self, year):
         from diacamma.accounting.models import EntryAccount
         last_entry_account = year.last_fiscalyear.entryaccount_set.filter(journal__id=5).order_by('num').last()
-        _no_change, debit_rest, credit_rest = last_entry_account.serial_control(last_entry_account.get_serial())
+        _no_change, debit_rest, credit_rest = last_entry_account.balance_control()
         if (abs(debit_rest - credit_rest) < 0.0001) and (len(last_entry_account.get_thirds()) > 0):
             end_desig = _("Retained earnings - Third party debt")
             new_entry = EntryAccount.objects.create(year=year, journal_id=1, designation=end_desig, date_value=year.begin)
@@ -246,14 +233,16 @@ class DefaultSystemAccounting(object):
         return
 
     def fill_fiscalyear_balancesheet(self, grid, currentfilter, lastfilter):
-        from django.db.models import Q
-        from diacamma.accounting.tools_reports import convert_query_to_account, add_cell_in_grid, add_item_in_grid, fill_grid, get_spaces
-        cash_filter = Q(account__code__regex=self.get_cash_mask())
-        third_filter = Q(account__code__regex=self.get_third_mask())
+        from diacamma.accounting.tools_reports import convert_sections_to_account, add_cell_in_grid, add_item_in_grid, fill_grid, get_spaces
+        actif1 = {'account__type_of_account': 0, 'account__is_cash': False, 'account__is_third': False}
+        actif2 = {'account__is_third': True}
+        actif3 = {'account__type_of_account': 0, 'account__is_cash': True}
+        passif1 = {'account__type_of_account': 2}
+        passif2 = {'account__is_third': True}
+        sections = convert_sections_to_account(currentfilter, lastfilter, [(actif1, None), (actif2, -1), (actif3, None), (passif1, None), (passif2, 1)])
 
         left_line_idx = 0
-        actif1 = Q(account__type_of_account=0) & ~cash_filter & ~third_filter
-        data_line_left, total1_lefta, total2_lefta, _b_left = convert_query_to_account(currentfilter & actif1, lastfilter & actif1 if lastfilter is not None else None, None)
+        data_line_left, total1_lefta, total2_lefta, _b_left = sections[0]
         if len(data_line_left) > 0:
             add_cell_in_grid(grid, left_line_idx, 'left', get_spaces(5) + "{[i]}%s{[/i]}" % _('immobilizations & stock'))
             left_line_idx += 1
@@ -263,8 +252,7 @@ class DefaultSystemAccounting(object):
             add_cell_in_grid(grid, left_line_idx, 'left', '')
             left_line_idx += 1
 
-        actif2 = third_filter
-        data_line_left, total1_leftb, total2_leftb, _b_left = convert_query_to_account(currentfilter & actif2, lastfilter & actif2 if lastfilter is not None else None, None, sign_value=-1)
+        data_line_left, total1_leftb, total2_leftb, _b_left = sections[1]
         if len(data_line_left) > 0:
             add_cell_in_grid(grid, left_line_idx, 'left', get_spaces(5) + "{[i]}%s{[/i]}" % _('receivables'))
             left_line_idx += 1
@@ -274,8 +262,7 @@ class DefaultSystemAccounting(object):
             add_cell_in_grid(grid, left_line_idx, 'left', '')
             left_line_idx += 1
 
-        actif3 = Q(account__type_of_account=0) & cash_filter
-        data_line_left, total1_leftc, total2_leftc, _b_left = convert_query_to_account(currentfilter & actif3, lastfilter & actif3 if lastfilter is not None else None, None)
+        data_line_left, total1_leftc, total2_leftc, _b_left = sections[2]
         if len(data_line_left) > 0:
             add_cell_in_grid(grid, left_line_idx, 'left', get_spaces(5) + "{[i]}%s{[/i]}" % _('values & availabilities'))
             left_line_idx += 1
@@ -286,8 +273,7 @@ class DefaultSystemAccounting(object):
             left_line_idx += 1
 
         right_line_idx = 0
-        passif1 = Q(account__type_of_account=2)
-        data_line_right, total1_righta, total2_righta, _b_right = convert_query_to_account(currentfilter & passif1, lastfilter & passif1 if lastfilter is not None else None, None)
+        data_line_right, total1_righta, total2_righta, _b_right = sections[3]
         if len(data_line_right) > 0:
             add_cell_in_grid(grid, right_line_idx, 'right', get_spaces(5) + "{[i]}%s{[/i]}" % _('capital'))
             right_line_idx += 1
@@ -297,8 +283,7 @@ class DefaultSystemAccounting(object):
             add_cell_in_grid(grid, right_line_idx, 'right', '')
             right_line_idx += 1
 
-        passif2 = third_filter
-        data_line_right, total1_rightb, total2_rightb, _b_right = convert_query_to_account(currentfilter & passif2, lastfilter & passif2 if lastfilter is not None else None, None, sign_value=1)
+        data_line_right, total1_rightb, total2_rightb, _b_right = sections[4]
         if len(data_line_right) > 0:
             add_cell_in_grid(grid, right_line_idx, 'right', get_spaces(5) + "{[i]}%s{[/i]}" % _('liabilities'))
             right_line_idx += 1
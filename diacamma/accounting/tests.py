@@ -23,30 +23,45 @@ along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
 from __future__ import unicode_literals
+import json
+from re import match
 from shutil import rmtree
 from datetime import date, timedelta
 from base64 import b64decode
+from timeit import repeat
+from _io import StringIO
 from django.utils import six
+from django.core.management import call_command
+from django.db import connection
+from django.core.signals import request_started, request_finished
+from django.test.utils import CaptureQueriesContext
 
 from lucterios.framework.test import LucteriosTest
+from lucterios.framework.auditlog import LucteriosAuditlogModelRegistry
+from lucterios.framework.models import LucteriosLogEntry
 from lucterios.framework.filetools import get_user_dir
+from lucterios.framework import signal_and_lock
 from lucterios.CORE.views import StatusMenu, ParamEdit, ObjectMerge
 from lucterios.contacts.views import CustomFieldAddModify
 
-from diacamma.accounting.views import ThirdList, ThirdAdd, ThirdSave, ThirdShow, AccountThirdAddModify, AccountThirdDel, ThirdListing, ThirdDisable, ThirdEdit, ThirdSearch
+from diacamma.accounting.views import ThirdList, ThirdAdd, ThirdSave, ThirdShow, AccountThirdAddModify, AccountThirdDel, ThirdListing, ThirdDisable, ThirdEdit, ThirdSearch,\
+    ThirdAutoLettering
 from diacamma.accounting.views_admin import Configuration, ConfigurationAccountingSystem, JournalAddModify, JournalDel, FiscalYearAddModify, FiscalYearActive, FiscalYearDel,\
     JournalDefault
 from diacamma.accounting.views_other import ModelEntryList, ModelEntryAddModify, ModelLineEntryAddModify,\
     ModelEntryShow
-from diacamma.accounting.test_tools import initial_contacts, fill_entries_fr, initial_thirds_fr, create_third, fill_accounts_fr, fill_thirds_fr, default_compta_fr, set_accounting_system, add_models
-from diacamma.accounting.models import FiscalYear, Third
-from diacamma.accounting.system import get_accounting_system, accounting_system_ident
+from diacamma.accounting.test_tools import initial_contacts, fill_entries_fr, initial_thirds_fr, create_third, fill_accounts_fr, fill_thirds_fr, default_compta_fr, set_accounting_system, add_models,\
+    add_entry
+from diacamma.accounting.models import FiscalYear, Third, EntryLineAccount, AccountLink
+from diacamma.accounting.system import get_accounting_system, accounting_system_ident, get_mask_prefixes, get_mask_filter
 from diacamma.accounting.tools import current_system_account, clear_system_account,\
-    format_with_devise
+    format_with_devise, correct_accounting_code, clear_accounting_cache, currency_round, ParamsSnapshot
 from diacamma.accounting.views_entries import EntryAccountModelSelector
 from lucterios.CORE.parameters import Params
+from lucterios.CORE.models import Parameter
 from lucterios.contacts.models import CustomField
 from lucterios.contacts.views_contacts import IndividualList
+from lucterios.contacts.models import Individual
 
 
 class ThirdTest(LucteriosTest):
@@ -456,6 +471,150 @@ class ThirdTest(LucteriosTest):
         self.assert_json_equal('', 'third/@2/accountthird_set', ['411', '401'])
         self.assert_json_equal('', 'third/@2/total', -34.01)
 
+    def test_list_total_query(self):
+        fill_thirds_fr()
+        default_compta_fr()
+        fill_entries_fr(1)
+        totals = {third.id: third.total_amount for third in Third.annotate_total(Third.objects.all())}
+        for third in Third.objects.all():
+            self.assertAlmostEqual(totals[third.id], third.get_total(), delta=0.0001)
+        self.assertEqual(sorted([third.id for third in Third.annotate_total(Third.objects.all(), True)]), [2, 4, 5])
+        self.assertAlmostEqual(Third.objects.get(id=5).get_total('2015-02-20'), 0.0, delta=0.0001)
+        self.assertAlmostEqual(Third.objects.get(id=5).get_total('2015-02-21'), -125.97, delta=0.0001)
+
+        self.factory.xfer = ThirdList()
+        self.calljson('/diacamma.accounting/thirdList', {'show_filter': '2'}, False)
+        with CaptureQueriesContext(connection) as queries:
+            self.factory.xfer = ThirdList()
+            self.calljson('/diacamma.accounting/thirdList', {'show_filter': '2'}, False)
+        self.assert_observer('core.custom', 'diacamma.accounting', 'thirdList')
+        self.assert_count_equal('third', 3)
+        nb_queries = len(queries)
+        add_entry(1, 3, '2015-02-25', 'vente 4', '-1|10|0|18.000000|0|0|None|\n-2|1|6|18.000000|0|0|None|', True)
+        with CaptureQueriesContext(connection) as queries:
+            self.factory.xfer = ThirdList()
+            self.calljson('/diacamma.accounting/thirdList', {'show_filter': '2'}, False)
+        self.assert_count_equal('third', 4)
+        self.assertEqual(len(queries), nb_queries)
+
+    def test_list_sort_name(self):
+        fill_thirds_fr()
+        self.assertEqual(Third.objects.get(id=5).sort_name, 'dalton william')
+        individual = Individual.objects.get(id=Third.objects.get(id=5).contact_id)
+        individual.lastname = 'Élan'
+        individual.save()
+        self.assertEqual(Third.objects.get(id=5).sort_name, 'elan william')
+
+        self.factory.xfer = ThirdList()
+        self.calljson('/diacamma.accounting/thirdList', {'filter': 'ELAN'}, False)
+        self.assert_observer('core.custom', 'diacamma.accounting', 'thirdList')
+        self.assert_count_equal('third', 1)
+        self.assert_json_equal('', 'third/@0/contact', 'Élan William')
+
+        self.factory.xfer = ThirdList()
+        self.calljson('/diacamma.accounting/thirdList', {}, False)
+        self.assert_observer('core.custom', 'diacamma.accounting', 'thirdList')
+        self.assert_count_equal('third', 7)
+        contacts = [self.response_json['data']['third'][idx]['contact'] for idx in range(7)]
+        self.assertEqual(contacts, ['Dalton Avrel', 'Dalton Jack', 'Dalton Joe', 'Élan William', 'Luke Lucky', 'Maximum', 'Minimum'])
+
+        self.factory.xfer = ThirdList()
+        self.calljson('/diacamma.accounting/thirdList', {'GRID_ORDER%third': 'contact', 'GRID_ORDER%third+': ''}, False)
+        self.assert_observer('core.custom', 'diacamma.accounting', 'thirdList')
+        self.assertEqual([self.response_json['data']['third'][idx]['contact'] for idx in range(7)], list(reversed(contacts)))
+
+    def test_auto_lettering(self):
+        fill_thirds_fr()
+        default_compta_fr()
+        fill_entries_fr(1)
+        add_entry(1, 4, '2015-02-25', 'reglement vente 2', '-1|2|0|125.970000|0|0|None|\n-2|1|5|-125.970000|0|0|None|', True)
+        add_entry(1, 4, '2015-02-26', 'reglement vente 3', '-1|2|0|20.000000|0|0|None|\n-2|1|4|-20.000000|0|0|None|\n-3|3|0|14.010000|0|0|None|\n-4|1|4|-14.010000|0|0|None|', True)
+        add_entry(1, 3, '2015-02-27', 'vente 4', '-1|10|0|40.000000|0|0|None|\n-2|1|2|40.000000|0|0|fact 7|', True)
+        add_entry(1, 4, '2015-02-28', 'reglement vente 4', '-1|2|0|40.000000|0|0|None|\n-2|1|2|-25.000000|0|0|fact 7|\n-3|1|2|-15.000000|0|0|fact 7|', True)
+        self.assertEqual(EntryLineAccount.objects.filter(link__isnull=False).count(), 6)
+
+        self.factory.xfer = ThirdList()
+        self.calljson('/diacamma.accounting/thirdList', {'show_filter': '3'}, False)
+        self.assert_observer('core.custom', 'diacamma.accounting', 'thirdList')
+        self.assert_count_equal('third', 3)
+        self.assertEqual(len(self.json_actions), 5)
+
+        proposals = AccountLink.auto_lettering(FiscalYear.get_current(), dry_run=True)
+        self.assertEqual([(proposal[0], proposal[1], proposal[2], len(proposal[3])) for proposal in proposals],
+                         [('411', 2, 'reference', 3), ('411', 4, 'subset', 3), ('411', 5, 'exact', 2)])
+        self.assertEqual(EntryLineAccount.objects.filter(link__isnull=False).count(), 6)
+        out = StringIO()
+        call_command('lettering', '--dry-run', stdout=out)
+        self.assertEqual(out.getvalue().split('\n')[-2], '3 link(s) found for 8 line(s)')
+        self.assertEqual(EntryLineAccount.objects.filter(link__isnull=False).count(), 6)
+
+        subset_lines = AccountLink.auto_subset_lines
+        try:
+            AccountLink.auto_subset_lines = 2
+            limited_proposals = AccountLink.auto_lettering(FiscalYear.get_current(), dry_run=True)
+        finally:
+            AccountLink.auto_subset_lines = subset_lines
+        self.assertEqual([(proposal[0], proposal[1], proposal[2], len(proposal[3])) for proposal in limited_proposals],
+                         [('411', 2, 'reference', 3), ('411', 5, 'exact', 2)])
+
+        self.factory.xfer = ThirdAutoLettering()
+        self.calljson('/diacamma.accounting/thirdAutoLettering', {'show_filter': '3', 'thirdtype': '4'}, False)
+        self.assert_observer('core.exception', 'diacamma.accounting', 'thirdAutoLettering')
+
+        self.factory.xfer = ThirdAutoLettering()
+        self.calljson('/diacamma.accounting/thirdAutoLettering', {'show_filter': '3', 'filter': 'Minimum'}, False)
+        self.assert_observer('core.acknowledge', 'diacamma.accounting', 'thirdAutoLettering')
+        self.assertEqual(self.response_json['action']['action'], 'thirdAutoLettering')
+        self.assertEqual(self.response_json['action']['params']['lettering'], AccountLink.get_lettering_param(proposals[1:2]))
+
+        self.factory.xfer = ThirdAutoLettering()
+        self.calljson('/diacamma.accounting/thirdAutoLettering', {'show_filter': '3'}, False)
+        self.assert_observer('core.acknowledge', 'diacamma.accounting', 'thirdAutoLettering')
+        lettering = self.response_json['action']['params']['lettering']
+        self.assertEqual(lettering, AccountLink.get_lettering_param(proposals))
+
+        self.factory.xfer = ThirdAutoLettering()
+        self.calljson('/diacamma.accounting/thirdAutoLettering', {'show_filter': '3', 'lettering': lettering}, False)
+        self.assert_observer('core.dialogbox', 'diacamma.accounting', 'thirdAutoLettering')
+        self.assertEqual(EntryLineAccount.objects.filter(link__isnull=False).count(), 6)
+
+        add_entry(1, 5, '2015-03-01', 'correction', '-1|1|5|10.000000|0|0|None|\n-2|1|5|-10.000000|0|0|None|', True)
+        self.factory.xfer = ThirdAutoLettering()
+        self.calljson('/diacamma.accounting/thirdAutoLettering', {'show_filter': '3', 'lettering': lettering, 'CONFIRME': 'YES'}, False)
+        self.assert_observer('core.acknowledge', 'diacamma.accounting', 'thirdAutoLettering')
+        self.assertEqual(EntryLineAccount.objects.filter(link__isnull=False).count(), 14)
+        for proposal in proposals:
+            link_ids = set(EntryLineAccount.objects.filter(id__in=proposal[3]).values_list('link_id', flat=True))
+            self.assertEqual(len(link_ids), 1)
+            self.assertTrue(AccountLink.objects.get(id=link_ids.pop()).is_validity())
+        self.assertEqual(sorted(AccountLink.objects.values_list('num', flat=True)), [0, 2, 4, 6, 9, 12])
+
+        self.factory.xfer = ThirdAutoLettering()
+        self.calljson('/diacamma.accounting/thirdAutoLettering', {'show_filter': '3', 'lettering': lettering, 'CONFIRME': 'YES'}, False)
+        self.assert_observer('core.exception', 'diacamma.accounting', 'thirdAutoLettering')
+        self.assertEqual(EntryLineAccount.objects.filter(link__isnull=False).count(), 14)
+
+    def test_auto_lettering_auditlog(self):
+        fill_thirds_fr()
+        default_compta_fr()
+        fill_entries_fr(1)
+        add_entry(1, 4, '2015-02-25', 'reglement vente 2', '-1|2|0|125.970000|0|0|None|\n-2|1|5|-125.970000|0|0|None|', True)
+        proposals = AccountLink.auto_lettering(FiscalYear.get_current(), dry_run=True)
+        self.assertEqual([(proposal[0], proposal[1], proposal[2], len(proposal[3])) for proposal in proposals], [('411', 5, 'exact', 2)])
+        LucteriosAuditlogModelRegistry.set_state_packages(['accounting'])
+        LucteriosAuditlogModelRegistry.main_enabled()
+        try:
+            AccountLink.create_lettering(FiscalYear.get_current(), proposals)
+        finally:
+            LucteriosAuditlogModelRegistry.main_disabled()
+        letter = EntryLineAccount.objects.get(id=proposals[0][3][0]).link.letter
+        entry_ids = sorted(EntryLineAccount.objects.filter(id__in=proposals[0][3]).values_list('entry_id', flat=True))
+        self.assertEqual(sorted([int(object_pk) for object_pk in LucteriosLogEntry.objects.filter(modelname='accounting.EntryAccount').values_list('object_pk', flat=True)]), entry_ids)
+        for log_entry in LucteriosLogEntry.objects.filter(modelname='accounting.EntryAccount'):
+            self.assertEqual(log_entry.action, LucteriosLogEntry.Action.UPDATE)
+            self.assertEqual(list(json.loads(log_entry.additional_data).values()),
+                             [{'1': [{'modelname': 'accounting.EntryLineAccount', 'changes': {'link': ['None', letter]}}]}])
+
     def test_listing(self):
         fill_thirds_fr()
         default_compta_fr()
@@ -671,6 +830,22 @@ class AdminTest(LucteriosTest):
         self.assertEqual(format_with_devise(5), "C2EUR;{[p align='right']}%s{[/p]}")
         self.assertEqual(format_with_devise(6), "C2EUR;{[p align='right']}{[font color=\"green\"]}%s{[/font]}{[/p]};{[p align='right']}{[font color=\"blue\"]}%s{[/font]}{[/p]};")
         self.assertEqual(format_with_devise(7), "C2EUR")
+        Parameter.change_value('accounting-devise-prec', 3)
+        Params.clear()
+        self.assertEqual(format_with_devise(7), "C3EUR")
+        self.assertEqual(format_with_devise(3), "N3;%s")
+
+    def test_correct_code(self):
+        set_accounting_system()
+        clear_accounting_cache()
+        self.assertEqual(correct_accounting_code('4110'), '411')
+        self.assertEqual(correct_accounting_code('41'), '410')
+        self.assertEqual(correct_accounting_code('4110'), '411')
+        self.assertEqual(correct_accounting_code('411001'), '411001')
+        Parameter.change_value('accounting-sizecode', 6)
+        Params.clear()
+        self.assertEqual(correct_accounting_code('4110'), '411000')
+        self.assertEqual(correct_accounting_code('41'), '410000')
 
     def test_summary(self):
         self.factory.xfer = StatusMenu()
@@ -954,6 +1129,72 @@ class AdminTest(LucteriosTest):
         set_accounting_system()
         self.assertEqual(current_system_account().__class__.__name__, "FrenchSystemAcounting")
 
+    def test_params_snapshot(self):
+        self.assertEqual(currency_round(12.3456), 12.35)
+        with ParamsSnapshot():
+            self.assertEqual(currency_round(12.3456), 12.35)
+            Parameter.change_value('accounting-devise-prec', 3)
+            Params.clear()
+            self.assertEqual(currency_round(12.3456), 12.35)
+            with ParamsSnapshot():
+                self.assertEqual(ParamsSnapshot.getvalue("accounting-devise-prec"), 2)
+            self.assertEqual(ParamsSnapshot.getvalue("accounting-devise-prec"), 2)
+            signal_and_lock.Signal.call_signal("param_change", ['accounting-devise-prec'])
+            self.assertEqual(currency_round(12.3456), 12.346)
+        Parameter.change_value('accounting-devise-prec', 2)
+        Params.clear()
+        self.assertEqual(currency_round(12.3456), 12.35)
+
+        request_started.send(sender=self.__class__)
+        self.assertEqual(currency_round(12.3456), 12.35)
+        Parameter.change_value('accounting-devise-prec', 3)
+        Params.clear()
+        self.assertEqual(currency_round(12.3456), 12.35)
+        request_finished.send(sender=self.__class__)
+        self.assertEqual(currency_round(12.3456), 12.346)
+        Parameter.change_value('accounting-devise-prec', 2)
+        Params.clear()
+
+    def test_params_snapshot_benchmark(self):
+        def helpers_call():
+            currency_round(12.3456)
+            format_with_devise(5)
+            correct_accounting_code('411')
+        direct_time = min(repeat(helpers_call, number=20000, repeat=3))
+        with ParamsSnapshot():
+            snapshot_time = min(repeat(helpers_call, number=20000, repeat=3))
+        self.assertLess(snapshot_time, direct_time)
+
+    def test_system_mask_prefixes(self):
+        codes = ['106000', '401000', '410100', '411000', '421000', '441000', '455000', '471000', '512000', '531000', '607000', '706000', '860000']
+        self.assertEqual(get_mask_prefixes(''), [''])
+        self.assertEqual(get_mask_prefixes('^4(0|1)'), None)
+        self.assertEqual(get_mask_filter('^4(0|1)').children, [('code__regex', '^4(0|1)')])
+        for system_name in ('diacamma.accounting.system.french.FrenchSystemAcounting', 'diacamma.accounting.system.belgium.BelgiumSystemAcounting'):
+            system = get_accounting_system(system_name)
+            for mask in (system.get_third_mask(), system.get_cash_mask(), system.get_provider_mask(), system.get_customer_mask(), system.get_employed_mask(),
+                         system.get_societary_mask(), system.get_revenue_mask(), system.get_expence_mask(), system.get_annexe_mask()):
+                prefixes = get_mask_prefixes(mask)
+                self.assertIsNotNone(prefixes, mask)
+                for code in codes:
+                    self.assertEqual(match(mask, code) is not None, any(code.startswith(prefix) for prefix in prefixes), "%s - %s" % (mask, code))
+        self.assertEqual(get_mask_prefixes(get_accounting_system('diacamma.accounting.system.belgium.BelgiumSystemAcounting').get_third_mask()), ['40', '410', '44', '455', '47'])
+
+    def test_fiscalyear_letter(self):
+        year1 = FiscalYear.objects.create(begin='2014-07-01', end='2015-06-30', status=2, is_actif=False, last_fiscalyear=None)
+        year2 = FiscalYear.objects.create(begin='2015-07-01', end='2016-06-30', status=1, is_actif=False, last_fiscalyear=year1)
+        year3 = FiscalYear.objects.create(begin='2016-07-01', end='2017-06-30', status=0, is_actif=True, last_fiscalyear=year2)
+        self.assertEqual(year3.letter, 'C')
+        with self.assertNumQueries(0):
+            self.assertEqual([year1.letter, year2.letter, year3.letter], ['A', 'B', 'C'])
+            self.assertEqual(FiscalYear.get_year_letter(year2.id), 'B')
+        year4 = FiscalYear.objects.create(begin='2017-07-01', end='2018-06-30', status=0, is_actif=False, last_fiscalyear=year3)
+        self.assertEqual(year4.letter, 'D')
+        year4.delete()
+        year3.delete()
+        year5 = FiscalYear.objects.create(begin='2016-07-01', end='2017-06-30', status=0, is_actif=True, last_fiscalyear=year2)
+        self.assertEqual(year5.letter, 'C')
+
     def test_configuration_customfield(self):
         self.factory.xfer = Configuration()
         self.calljson('/diacamma.accounting/configuration', {}, False)
@@ -21,8 +21,14 @@ from __future__ import unicode_literals
 from shutil import rmtree
 from importlib import import_module
 from base64 import b64decode
+from _io import StringIO
 
 from django.utils import six
+from django.db import transaction, connection
+from django.db.models import Q
+from django.db.models.aggregates import Sum
+from django.core.management import call_command
+from django.test.utils import CaptureQueriesContext
 
 from lucterios.framework.test import LucteriosTest
 from lucterios.framework.filetools import get_user_dir
@@ -33,9 +39,11 @@ from diacamma.accounting.test_tools import initial_thirds_fr, default_compta_fr,
 from diacamma.accounting.views_accounts import ChartsAccountList, ChartsAccountDel, ChartsAccountShow, ChartsAccountAddModify, ChartsAccountListing, ChartsAccountImportFiscalYear
 from diacamma.accounting.views_accounts import FiscalYearBegin, FiscalYearClose, FiscalYearReportLastYear
 from diacamma.accounting.views_entries import EntryAccountEdit, EntryAccountList
-from diacamma.accounting.models import FiscalYear
+from diacamma.accounting.models import FiscalYear, ChartsAccount, EntryAccount, EntryLineAccount, AccountLink, ChartsAccountBalance, ClosedYearBalance, Third
+from diacamma.accounting.tools import current_system_account
 from diacamma.accounting.views import ThirdList
 from diacamma.accounting.views_budget import BudgetList, BudgetAddModify, BudgetDel
+from diacamma.accounting.views_reports import FiscalYearBalanceSheet, FiscalYearIncomeStatement, FiscalYearTrialBalance
 from diacamma.payoff.test_tools import PaymentTest
 
 
@@ -150,6 +158,38 @@ class ChartsAccountTest(LucteriosTest):
         self.assert_count_equal('', 8)
         self.assert_count_equal('chartsaccount', 0)
 
+    def test_totals_by_account(self):
+        items = ChartsAccount.objects.filter(year_id=1)
+        with self.assertNumQueries(1):
+            items_with_totals = list(ChartsAccount.get_items_with_totals(items))
+        self.assertEqual(len(items_with_totals), 17)
+        for item_with_totals in items_with_totals:
+            item = ChartsAccount.objects.get(id=item_with_totals.id)
+            self.assertAlmostEqual(item_with_totals.last_year_total, item.last_year_total, delta=0.0001)
+            self.assertAlmostEqual(item_with_totals.current_total, item.current_total, delta=0.0001)
+            self.assertAlmostEqual(item_with_totals.current_validated, item.current_validated, delta=0.0001)
+            self.assertAlmostEqual(item_with_totals.get_current_total(False), item.get_current_total(False), delta=0.0001)
+
+    def test_classification(self):
+        self.assertEqual(list(ChartsAccount.objects.filter(year_id=1, is_third=True).values_list('code', flat=True)), ['401', '411'])
+        self.assertEqual(list(ChartsAccount.objects.filter(year_id=1, is_customer=True).values_list('code', flat=True)), ['411'])
+        self.assertEqual(list(ChartsAccount.objects.filter(year_id=1, is_provider=True).values_list('code', flat=True)), ['401'])
+        self.assertEqual(list(ChartsAccount.objects.filter(year_id=1, is_cash=True).values_list('code', flat=True)), ['512', '531'])
+        self.assertEqual(ChartsAccount.objects.filter(year_id=1, is_revenue=True).count(), 3)
+        self.assertEqual(ChartsAccount.objects.filter(year_id=1, is_expense=True).count(), 5)
+        self.assertEqual(ChartsAccount.objects.filter(year_id=1, is_annexe=True).count(), 0)
+        new_account = ChartsAccount.objects.create(year_id=1, code='421', name='salaires', type_of_account=1)
+        self.assertEqual(new_account.is_third, True)
+        self.assertEqual(new_account.is_customer, False)
+        self.assertEqual(ChartsAccount.objects.get(id=new_account.id).is_third, True)
+
+        set_accounting_system('BE')
+        self.assertEqual(list(ChartsAccount.objects.filter(year_id=1, is_third=True).values_list('code', flat=True)), ['401'])
+        self.assertEqual(list(ChartsAccount.objects.filter(year_id=1, is_customer=True).values_list('code', flat=True)), ['401'])
+        self.assertEqual(ChartsAccount.objects.filter(year_id=1, is_provider=True).count(), 0)
+        set_accounting_system('FR')
+        self.assertEqual(list(ChartsAccount.objects.filter(year_id=1, is_third=True).values_list('code', flat=True)), ['401', '411', '421'])
+
     def test_show(self):
         self.factory.xfer = ChartsAccountShow()
         self.calljson('/diacamma.accounting/chartsAccountShow', {'year': '1', 'type_of_account': '-1', 'chartsaccount': '10'}, False)
@@ -695,6 +735,119 @@ class FiscalYearWorkflowTest(PaymentTest):
         self.assert_observer('core.custom', 'lucterios.documents', 'documentSearch')
         self.assert_count_equal('document', 4)
 
+    def _legacy_thirds_ending_entry(self, year):
+        last_account_id = 0
+        sum_account = 0.0
+        new_entry = EntryAccount.objects.create(year=year, journal_id=5, designation="Cloture d'exercice - Tiers", date_value=year.end)
+        for entry_line in EntryLineAccount.objects.filter(account__is_third=True, account__year=year, link__isnull=True, third__isnull=False).order_by('account', 'id'):
+            if (last_account_id != entry_line.account_id) and (abs(sum_account) > 0.0001):
+                EntryLineAccount.objects.create(entry=new_entry, account_id=last_account_id, amount=sum_account, third=None)
+                sum_account = 0
+            last_account_id = entry_line.account_id
+            reference = entry_line.reference if (entry_line.reference is not None) and (entry_line.reference != '') else entry_line.entry.designation
+            new_line = EntryLineAccount.objects.create(entry=new_entry, account_id=entry_line.account_id, amount=-1 * entry_line.amount,
+                                                       third_id=entry_line.third_id, reference=reference)
+            AccountLink.create_link([new_line, entry_line])
+            sum_account += float(entry_line.amount)
+        if abs(sum_account) > 0.0001:
+            EntryLineAccount.objects.create(entry=new_entry, account_id=last_account_id, amount=sum_account, third=None)
+        new_entry.closed()
+
+    def _get_thirds_ending_state(self, year):
+        new_entry = EntryAccount.objects.filter(year=year, journal_id=5).order_by('id').last()
+        lines = []
+        for entry_line in new_entry.entrylineaccount_set.order_by('id'):
+            linked_ids = []
+            if entry_line.link_id is not None:
+                linked_ids = list(entry_line.link.entrylineaccount_set.exclude(entry=new_entry).values_list('id', flat=True))
+                self.assertEqual(entry_line.link.entrylineaccount_set.count(), 2)
+            lines.append((entry_line.account_id, entry_line.third_id, round(entry_line.amount, 4), entry_line.reference, linked_ids,
+                          entry_line.link.letter if entry_line.link_id is not None else None))
+        return (new_entry.num, new_entry.close, new_entry.date_value, lines, ChartsAccountBalance.check_balance(year),
+                sorted(EntryLineAccount.objects.filter(account__year=year, link__isnull=False).values_list('id', flat=True)))
+
+    def test_thirds_ending_entry(self):
+        year = FiscalYear.objects.get(id=1)
+        add_entry(1, 3, '2015-03-12', 'vente 4', '-1|10|0|50.000000|0|0|None|\n-2|1|2|50.000000|0|0|ref 4|', True)
+        add_entry(1, 4, '2015-03-14', 'reglement 4', '-1|2|0|30.000000|0|0|None|\n-2|1|2|-30.000000|0|0|None|', False)
+        self.assertGreater(EntryLineAccount.objects.filter(account__is_third=True, link__isnull=True, third__isnull=False).count(), 4)
+        with transaction.atomic():
+            self._legacy_thirds_ending_entry(year)
+            legacy_state = self._get_thirds_ending_state(year)
+            transaction.set_rollback(True)
+        with CaptureQueriesContext(connection) as queries:
+            current_system_account()._create_thirds_ending_entry(year)
+        self.assertEqual(self._get_thirds_ending_state(year), legacy_state)
+        self.assertEqual(legacy_state[4], [])
+        self.assertLess(len(queries), 25)
+
+    def test_closed_year_balance(self):
+        self._add_subvention()
+        year = FiscalYear.objects.get(id=1)
+        year.status = 1
+        year.save()
+        FiscalYear.objects.create(begin='2016-01-01', end='2016-12-31', status=0, last_fiscalyear=year)
+        self.assertEqual(ClosedYearBalance.get_lines(Q(entry__year=year)).model, EntryLineAccount)
+        self.factory.xfer = FiscalYearClose()
+        self.calljson('/diacamma.accounting/fiscalYearClose', {'CONFIRME': 'YES', 'year': '1', 'type_of_account': '-1'}, False)
+        self.assert_observer('core.acknowledge', 'diacamma.accounting', 'fiscalYearClose')
+        year = FiscalYear.objects.get(id=1)
+        self.assertEqual(year.status, 2)
+        self.assertGreater(ClosedYearBalance.objects.filter(year=year).count(), 0)
+        self.assertEqual(ClosedYearBalance.check_balance(year), [])
+
+        for query in (Q(entry__year=year), Q(entry__year=year) & Q(account__type_of_account=4), Q(entry__year=year) & Q(account__is_third=True) & ~Q(account__is_cash=True),
+                      Q(entry__year=year) & Q(entry__date_value__gte=year.begin) & Q(entry__date_value__lte=year.end), Q(entry__year_id=1) & Q(costaccounting_id=2)):
+            balance_lines = ClosedYearBalance.get_lines(query)
+            self.assertEqual(balance_lines.model, ClosedYearBalance)
+            self.assertEqual({(line['account'], line['third'], line['costaccounting']): round(line['amount__sum'], 4) for line in balance_lines.order_by('account', 'third', 'costaccounting').values('account', 'third', 'costaccounting').annotate(Sum('amount'))},
+                             {(line['account'], line['third'], line['costaccounting']): round(line['amount__sum'], 4) for line in EntryLineAccount.objects.filter(query).order_by('account', 'third', 'costaccounting').values('account', 'third', 'costaccounting').annotate(Sum('amount'))})
+        self.assertEqual(ClosedYearBalance.get_lines(Q(entry__year=year) & Q(entry__date_value__gte='2015-03-01')).model, EntryLineAccount)
+        self.assertEqual(ClosedYearBalance.get_lines(Q(entry__year=year) & Q(link__isnull=True)).model, EntryLineAccount)
+        self.assertEqual(ClosedYearBalance.get_lines(Q(entry__year_id=2)).model, EntryLineAccount)
+
+        for report_class, report_url, report_params in ((FiscalYearBalanceSheet, 'fiscalYearBalanceSheet', {}), (FiscalYearIncomeStatement, 'fiscalYearIncomeStatement', {}),
+                                                        (FiscalYearTrialBalance, 'fiscalYearTrialBalance', {'filtercode': '', 'with_third': True})):
+            report_params['year'] = 1
+            report_values = []
+            for year_status in (1, 2):
+                FiscalYear.objects.filter(id=1).update(status=year_status)
+                FiscalYear.clear_closed_years()
+                self.assertEqual(ClosedYearBalance.get_lines(Q(entry__year_id=1)).model, ClosedYearBalance if year_status == 2 else EntryLineAccount)
+                self.factory.xfer = report_class()
+                self.calljson('/diacamma.accounting/' + report_url, report_params, False)
+                self.assert_observer('core.custom', 'diacamma.accounting', report_url)
+                report_values.append(self.json_data['report_1'])
+            self.assertEqual(report_values[0], report_values[1], report_url)
+
+        ClosedYearBalance.objects.filter(year=year).update(amount=0.0)
+        self.assertNotEqual(ClosedYearBalance.check_balance(year), [])
+        out = StringIO()
+        call_command('closedyearbalance', stdout=out)
+        self.assertEqual(ClosedYearBalance.check_balance(year), [])
+        out = StringIO()
+        call_command('closedyearbalance', '--check', stdout=out)
+        self.assertEqual(out.getvalue(), 'Balances checked\n')
+
+    def test_closed_year_balance_merge(self):
+        self._add_subvention()
+        year = FiscalYear.objects.get(id=1)
+        year.status = 1
+        year.save()
+        FiscalYear.objects.create(begin='2016-01-01', end='2016-12-31', status=0, last_fiscalyear=year)
+        self.factory.xfer = FiscalYearClose()
+        self.calljson('/diacamma.accounting/fiscalYearClose', {'CONFIRME': 'YES', 'year': '1', 'type_of_account': '-1'}, False)
+        self.assert_observer('core.acknowledge', 'diacamma.accounting', 'fiscalYearClose')
+        year = FiscalYear.objects.get(id=1)
+        self.assertEqual(ClosedYearBalance.check_balance(year), [])
+        nb_balances = ClosedYearBalance.objects.filter(year=year).count()
+        self.assertGreater(ClosedYearBalance.objects.filter(year=year, third_id=7).count(), 0)
+
+        Third.objects.get(id=5).merge_objects(Third.objects.get(id=7))
+        self.assertEqual(ClosedYearBalance.objects.filter(year=year).count(), nb_balances)
+        self.assertEqual(ClosedYearBalance.objects.filter(year=year, third_id=7).count(), 0)
+        self.assertEqual(ClosedYearBalance.check_balance(year), [])
+
     def test_import_lastyear(self):
         self._add_subvention()
 
@@ -29,9 +29,12 @@ from base64 import b64decode
 from datetime import date
 
 from django.utils import six, formats
+from django.db import connection
 from django.db.models import Q
+from django.test.utils import CaptureQueriesContext
 
 from lucterios.framework.test import LucteriosTest
+from lucterios.framework.xfercomponents import XferCompGrid
 from lucterios.framework.filetools import get_user_dir, get_user_path
 from lucterios.CORE.models import Parameter
 from lucterios.CORE.parameters import Params
@@ -46,8 +49,10 @@ from diacamma.accounting.views_reports import FiscalYearBalanceSheet, FiscalYear
     CostAccountingTrialBalance, CostAccountingLedger, CostAccountingIncomeStatement,\
     FiscalYearReportPrint
 from diacamma.accounting.views_admin import FiscalYearExport
-from diacamma.accounting.models import FiscalYear, Third
-from diacamma.accounting.tools_reports import get_totalaccount_for_query, get_totalbudget_for_query
+from diacamma.accounting.models import FiscalYear, Third, AccountLink, Budget
+from diacamma.accounting.tools_reports import get_totalaccount_for_query, get_totalbudget_for_query, convert_query_to_account, convert_sections_to_account
+from diacamma.accounting.system.french import FrenchSystemAcounting
+from diacamma.accounting.system.belgium import BelgiumSystemAcounting
 from diacamma.accounting.views_budget import BudgetList, BudgetAddModify, BudgetDel, BudgetImport
 
 
@@ -158,6 +163,24 @@ class CompletedEntryTest(LucteriosTest):
         self.assert_json_equal('', 'entryline/@0/credit', 12.34)
         self.assert_json_equal('', 'entryline/@1/entry_account', '[627] 627')
 
+    def test_link_letter(self):
+        links = list(AccountLink.objects.order_by('id'))
+        self.assertEqual([link.num for link in links], [0, 2, 4])
+        with self.assertNumQueries(0):
+            self.assertEqual([six.text_type(link) for link in links], ['A', 'C', 'E'])
+        self.assertEqual(AccountLink(num=None).get_letter(), '')
+        self.assertEqual(AccountLink(num=25).get_letter(), 'Z')
+        self.assertEqual(AccountLink(num=26).get_letter(), 'AA')
+        self.assertEqual(AccountLink(num=27 * 26).get_letter(), 'AAA')
+
+        first_lines = list(links[0].entrylineaccount_set.all())
+        first_lines[0].unlink()
+        AccountLink.create_link(first_lines)
+        letters = [six.text_type(link) for link in AccountLink.objects.order_by('id')]
+        self.assertEqual(letters, ['C', 'E', 'G'])
+        link_ids = AccountLink.create_links(FiscalYear.objects.get(id=1), [2, 3])
+        self.assertEqual([AccountLink.objects.get(id=link_id).num for link_id in link_ids], [8, 10])
+
     def _check_result(self):
         return self.assert_json_equal('LABELFORM', 'result', [230.62, 348.60, -117.98, 1050.66, 1244.74])
 
@@ -283,7 +306,8 @@ class CompletedEntryTest(LucteriosTest):
         self.assertAlmostEqual(78.24, values['401#2'][0], delta=0.0001)
         self.assertEqual('[401 Maximum]', values['401#2'][1])
 
-        values, total = get_totalaccount_for_query(Q(account__code__regex=r'^4[0-9][0-9][0-9a-zA-Z]*$') & Q(entry__year_id=1), -1, True)
+        with self.assertNumQueries(2):
+            values, total = get_totalaccount_for_query(Q(account__code__regex=r'^4[0-9][0-9][0-9a-zA-Z]*$') & Q(entry__year_id=1), -1, True)
         self.assertAlmostEqual(159.98, total, delta=0.0001)
         self.assertEqual(2, len(values), values)
         self.assertAlmostEqual(34.01, values['411#4'][0], delta=0.0001)
@@ -841,6 +865,16 @@ class CompletedEntryTest(LucteriosTest):
         self.assertFalse('__tab_1' in self.json_data.keys(), self.json_data.keys())
         self.assert_grid_equal('report_2', {"left": "Charges", "left_n": "Valeur", "space": "", "right": "Produits", "right_n": "Valeur"}, 6)
 
+    def test_costaccounting_incomestatement_query(self):
+        nb_queries = []
+        for costaccounting in ('1', '2', '1;2'):
+            self.factory.xfer = CostAccountingIncomeStatement()
+            with CaptureQueriesContext(connection) as queries:
+                self.calljson('/diacamma.accounting/costAccountingIncomeStatement', {'costaccounting': costaccounting}, False)
+            self.assert_observer('core.custom', 'diacamma.accounting', 'costAccountingIncomeStatement')
+            nb_queries.append(len(queries))
+        self.assertEqual([3, 3], nb_queries[1:])
+
     def test_costaccounting_importbudget(self):
         FiscalYear.objects.create(begin='2016-01-01', end='2016-12-31', status=0, last_fiscalyear_id=1)
         self.factory.xfer = CostAccountingAddModify()
@@ -934,6 +968,33 @@ class CompletedEntryTest(LucteriosTest):
         self.assert_json_equal('', 'report_1/@5/right_n', 78.24)
         self.assert_json_equal('', 'report_1/@5/right_n_1', '')
 
+    def test_fiscalyear_balancesheet_query(self):
+        year = FiscalYear.get_current()
+        FiscalYear.get_closed_years()
+        currentfilter = Q(entry__year=year)
+        records = []
+        for system_accounting in (FrenchSystemAcounting(), BelgiumSystemAcounting()):
+            grid = XferCompGrid('report')
+            with self.assertNumQueries(1):
+                system_accounting.fill_fiscalyear_balancesheet(grid, currentfilter, None)
+            records.append(grid.records)
+        self.assertEqual(records[0], records[1])
+        self.assertEqual(11, len(records[0]))
+        self.assertEqual('[411] 411', records[0]['L0001']['left'])
+        self.assertAlmostEqual(159.98, records[0]['L0001']['left_n'], delta=0.0001)
+        self.assertEqual('[531] 531', records[0]['L0006']['left'])
+        self.assertAlmostEqual(-79.63, records[0]['L0006']['left_n'], delta=0.0001)
+        self.assertEqual('[401] 401', records[0]['L0005']['right'])
+        self.assertAlmostEqual(78.24, records[0]['L0005']['right_n'], delta=0.0001)
+
+        third_filter = Q(account__is_third=True)
+        data_lines, total1, total2, _total3 = convert_query_to_account(currentfilter & third_filter, None, None, sign_value=-1)
+        sections = convert_sections_to_account(currentfilter, None, [({'account__is_third': True}, -1), ({'account__is_third': True}, 1)])
+        self.assertEqual((data_lines, total1, total2, 0), sections[0])
+        data_lines, total1, total2, _total3 = convert_query_to_account(currentfilter & third_filter, currentfilter & third_filter, None, sign_value=1)
+        sections = convert_sections_to_account(currentfilter, currentfilter, [({'account__is_third': True}, 1)])
+        self.assertEqual((data_lines, total1, total2, 0), sections[0])
+
     def test_fiscalyear_balancesheet_filter(self):
         self.factory.xfer = FiscalYearBalanceSheet()
         self.calljson('/diacamma.accounting/fiscalYearBalanceSheet', {'begin': '2015-02-22', 'end': '2015-02-28'}, False)
@@ -1029,6 +1090,36 @@ class CompletedEntryTest(LucteriosTest):
         self.assert_count_equal('budget_expense', 4)
         self.assert_json_equal('LABELFORM', 'result', -117.98)
 
+    def test_fiscalyear_import_budget_query(self):
+        FiscalYear.objects.create(begin='2016-01-01', end='2016-12-31', status=0, last_fiscalyear_id=1)
+        self.factory.xfer = BudgetImport()
+        with CaptureQueriesContext(connection) as queries:
+            self.calljson('/diacamma.accounting/budgetImport', {'year': '3', 'currentyear': '1', 'CONFIRME': 'YES'}, False)
+        self.assert_observer('core.acknowledge', 'diacamma.accounting', 'budgetImport')
+        self.assertEqual(6, len(queries))
+        self.assertEqual(5, Budget.objects.filter(year_id=3).count())
+
+        self.factory.xfer = BudgetList()
+        with CaptureQueriesContext(connection) as queries:
+            self.calljson('/diacamma.accounting/budgetList', {'year': '3'}, False)
+        self.assert_observer('core.custom', 'diacamma.accounting', 'budgetList')
+        self.assertEqual(9, len(queries))
+        self.assert_count_equal('budget_revenue', 1)
+        self.assert_count_equal('budget_expense', 4)
+        self.assert_json_equal('LABELFORM', 'result', -117.98)
+
+        for code, amount in (('601', 10.0), ('602', 20.0), ('604', 30.0), ('607', 40.0)):
+            Budget.objects.create(code=code, amount=amount, year_id=1, cost_accounting_id=2)
+        self.factory.xfer = BudgetList()
+        with CaptureQueriesContext(connection) as queries:
+            self.calljson('/diacamma.accounting/budgetList', {'cost_accounting': '2', 'GRID_SIZE%budget_expense': 3, 'GRID_PAGE%budget_expense': 1, 'GRID_ORDER%budget_expense': '-code'}, False)
+        self.assert_observer('core.custom', 'diacamma.accounting', 'budgetList')
+        self.assertEqual(10, len(queries))
+        self.assert_count_equal('budget_expense', 1)
+        self.assert_json_equal('', 'budget_expense/@0/budget', '[601] 601')
+        self.assert_json_equal('', 'budget_expense/@0/montant', -10.0)
+        self.assert_count_equal('budget_revenue', 0)
+
     def test_fiscalyear_incomestatement_filter(self):
         self.factory.xfer = FiscalYearIncomeStatement()
         self.calljson('/diacamma.accounting/fiscalYearIncomeStatement', {'begin': '2015-02-22', 'end': '2015-02-28'}, False)
@@ -1046,6 +1137,47 @@ class CompletedEntryTest(LucteriosTest):
         self.calljson('/diacamma.accounting/fiscalYearLedger', {}, False)
         self.assert_observer('core.custom', 'diacamma.accounting', 'fiscalYearLedger')
         self._check_result()
+        self.assert_count_equal('report_1', 79)
+        self.assert_json_equal('', 'report_1/@1/entry.designation', 'Report à nouveau')
+        self.assert_json_equal('', 'report_1/@1/debit', 0)
+        self.assert_json_equal('', 'report_1/@1/credit', 1250.38)
+        self.assert_json_equal('', 'report_1/@6/entry.designation', '&#160;' * 8 + '{[b]}[401 Dalton Avrel]{[/b]}')
+        self.assert_json_equal('', 'report_1/@7/entry.designation', 'depense 2')
+        self.assert_json_equal('', 'report_1/@7/link', 'C')
+        self.assert_json_equal('', 'report_1/@7/credit', 194.08)
+
+        ledger = FiscalYearLedger()
+        ledger.item = FiscalYear.objects.get(id=1)
+        ledger.filter = Q(entry__year_id=1)
+        ledger.chunk_size = 5
+        ledger.define_gridheader()
+        self.assertEqual(79, len(list(ledger.get_ledger_rows())))
+
+    def test_fiscalyear_ledger_page(self):
+        self.factory.xfer = FiscalYearLedger()
+        self.factory.xfer.accounts_by_page = 5
+        self.calljson('/diacamma.accounting/fiscalYearLedger', {}, False)
+        self.assert_observer('core.custom', 'diacamma.accounting', 'fiscalYearLedger')
+        self.assert_json_equal('SELECT', 'ledger_page_1', 0)
+        self.assert_select_equal('ledger_page_1', {0: '106 - 531', 1: '601 - 707', 2: '860 - 870'})
+        self.assert_count_equal('report_1', 42)
+
+        self.factory.xfer = FiscalYearLedger()
+        self.factory.xfer.accounts_by_page = 5
+        self.calljson('/diacamma.accounting/fiscalYearLedger', {'ledger_page_1': 2}, False)
+        self.assert_observer('core.custom', 'diacamma.accounting', 'fiscalYearLedger')
+        self.assert_json_equal('SELECT', 'ledger_page_1', 2)
+        self.assert_count_equal('report_1', 10)
+        self.assert_json_equal('', 'report_1/@0/entry.designation', '&#160;' * 15 + '{[u]}{[b]}[860] 860{[/b]}{[/u]}')
+        self.assert_json_equal('', 'report_1/@1/entry.designation', 'Bénévolat')
+
+        self.factory.xfer = FiscalYearLedger()
+        self.calljson('/diacamma.accounting/fiscalYearLedger', {'begin': '2015-02-22', 'end': '2015-02-28'}, False)
+        self.assert_observer('core.custom', 'diacamma.accounting', 'fiscalYearLedger')
+        self.assertFalse('ledger_page_1' in self.json_comp.keys())
+        self.assert_count_equal('report_1', 21)
+        self.assert_json_equal('', 'report_1/@10/debit/value', 1059.65)
+        self.assert_json_equal('', 'report_1/@13/debit/value', 1130.29)
 
     def test_fiscalyear_ledger_filter(self):
         self.factory.xfer = FiscalYearLedger()
@@ -1059,6 +1191,19 @@ class CompletedEntryTest(LucteriosTest):
         self.assert_observer('core.print', 'diacamma.accounting', 'fiscalYearReportPrint')
         self.save_pdf()
 
+        ledger = FiscalYearLedger()
+        ledger.params['PRINTING'] = True
+        ledger.item = FiscalYear.objects.get(id=1)
+        ledger.filter = Q(entry__year_id=1)
+        ledger.define_gridheader()
+        ledger.calcul_table()
+        self.assertEqual(ledger.grid.records, {})
+        self.assertEqual(ledger.grid.get_json_value(), [])
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(79, len(list(ledger.grid.record_ids)))
+        self.assertEqual(3, len(queries))
+        self.assertEqual(ledger.grid.records, {})
+
     def test_fiscalyear_trialbalance(self):
         self.factory.xfer = FiscalYearTrialBalance()
         self.calljson('/diacamma.accounting/fiscalYearTrialBalance', {}, False)
@@ -1154,6 +1299,15 @@ class CompletedEntryTest(LucteriosTest):
         self.assert_observer('core.custom', 'diacamma.accounting', 'fiscalYearTrialBalance')
         self.assert_count_equal('report_1', 3)
 
+        trial_balance = FiscalYearTrialBalance()
+        trial_balance.filter = Q(entry__year_id=1)
+        trial_balance.with_third = True
+        with self.assertNumQueries(2):
+            balance_values = trial_balance._get_balance_values()
+        self.assertEqual(['[401 Dalton Avrel]', 194.08, 194.08], balance_values['401#1'])
+        self.assertEqual(['[411 Dalton William]', 125.97, 0], balance_values['411#5'])
+        self.assertEqual(['[512] 512', 1206.57, 76.28], [balance_values['512'][0], round(balance_values['512'][1], 2), round(balance_values['512'][2], 2)])
+
     def test_fiscalyear_trialbalance_print(self):
         self.factory.xfer = FiscalYearReportPrint()
         self.calljson('/diacamma.accounting/fiscalYearReportPrint', {'classname': 'FiscalYearTrialBalance', "PRINT_MODE": 3}, False)
@@ -23,12 +23,18 @@ along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
 from __future__ import unicode_literals
+import json
 from shutil import rmtree
 from datetime import date
 
 from django.utils import formats
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
 
 from lucterios.framework.test import LucteriosTest
+from lucterios.framework.auditlog import LucteriosAuditlogModelRegistry
+from lucterios.framework.models import LucteriosLogEntry
 from lucterios.framework.filetools import get_user_dir
 
 from diacamma.accounting.views_entries import EntryAccountList, \
@@ -38,8 +44,9 @@ from diacamma.accounting.views_entries import EntryAccountList, \
     EntryAccountDel, EntryAccountOpenFromLine, EntryAccountShow, \
     EntryLineAccountDel, EntryAccountUnlock, EntryAccountImport
 from diacamma.accounting.test_tools import default_compta_fr, initial_thirds_fr,\
-    fill_entries_fr, default_costaccounting, fill_thirds_fr
-from diacamma.accounting.models import EntryAccount, CostAccounting
+    fill_entries_fr, default_costaccounting, fill_thirds_fr, add_entry
+from diacamma.accounting.models import EntryAccount, CostAccounting, ChartsAccount,\
+    ChartsAccountBalance, EntryLineAccount, ImportJob, ImportedContent, FiscalYear
 from diacamma.accounting.views_other import CostAccountingAddModify
 from _io import StringIO
 
@@ -988,6 +995,161 @@ class EntryTest(LucteriosTest):
         self.assert_observer('core.exception', 'diacamma.accounting', 'entryAccountDel')
         self.assert_json_equal('', 'message', 'écriture validée !')
 
+    def test_account_balance(self):
+        fill_entries_fr(1)
+        self.assertEqual(ChartsAccountBalance.check_balance(), [])
+        bank = ChartsAccount.objects.get(year_id=1, code='512')
+        self.assertAlmostEqual(bank.current_total, -1130.29, delta=0.0001)
+        self.assertAlmostEqual(bank.current_validated, -1130.29, delta=0.0001)
+        self.assertAlmostEqual(bank.last_year_total, -1135.93, delta=0.0001)
+
+        entry = EntryAccount.objects.get(id=7)
+        entry.closed()
+        entry = EntryAccount.objects.get(id=6)
+        entry.journal_id = 5
+        entry.save()
+        line = EntryLineAccount.objects.filter(entry_id=6).first()
+        line.amount = 10.0
+        line.save()
+        EntryAccount.objects.get(id=5).delete()
+        EntryLineAccount.objects.filter(entry_id=4).delete()
+        self.assertEqual(ChartsAccountBalance.check_balance(), [])
+
+        ChartsAccountBalance.objects.filter(account=bank).update(amount=0.0)
+        self.assertNotEqual(ChartsAccountBalance.check_balance(), [])
+        out = StringIO()
+        call_command('accountbalance', stdout=out)
+        self.assertEqual(ChartsAccountBalance.check_balance(), [])
+        out = StringIO()
+        call_command('accountbalance', '--check', stdout=out)
+        self.assertEqual(out.getvalue(), 'Balances checked\n')
+
+    def test_account_balance_concurrent_create(self):
+        fill_entries_fr(1)
+        account = ChartsAccount.objects.filter(year_id=1, entrylineaccount__isnull=True).order_by('code').first()
+        self.assertEqual(ChartsAccountBalance.objects.filter(account=account).count(), 0)
+        other_transactions = [ChartsAccountBalance(account=account, journal_id=2, close=False, amount=5.0)]
+
+        def other_transaction_commit(execute, sql, params, many, context):
+            result = execute(sql, params, many, context)
+            if sql.startswith('UPDATE "accounting_chartsaccountbalance"') and (len(other_transactions) > 0):
+                ChartsAccountBalance.objects.bulk_create([other_transactions.pop()])
+            return result
+        with transaction.atomic():
+            with connection.execute_wrapper(other_transaction_commit):
+                ChartsAccountBalance.add_amount(account.id, 2, False, 10.0)
+            self.assertEqual(len(other_transactions), 0)
+        self.assertEqual(ChartsAccountBalance.objects.filter(account=account).count(), 1)
+        self.assertAlmostEqual(ChartsAccountBalance.objects.get(account=account, journal_id=2, close=False).amount, 15.0, delta=0.0001)
+
+    def commit_changes(self):
+        callbacks = connection.run_on_commit
+        connection.run_on_commit = []
+        for _savepoint_ids, func in callbacks:
+            func()
+
+    def test_fiscalyear_result(self):
+        fill_entries_fr(1)
+        year = FiscalYear.objects.get(id=1)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual([round(value, 2) for value in year.get_total_result_text()], [230.62, 348.6, -117.98, 1050.66, 1244.74])
+            self.assertEqual((round(year.total_revenue, 2), round(year.total_expense, 2), round(year.total_cash, 2), round(year.total_cash_close, 2)), (230.62, 348.6, 1050.66, 1244.74))
+        self.assertEqual(len(queries), 1)
+
+        self.commit_changes()
+        self.assertEqual([round(value, 2) for value in FiscalYear.objects.get(id=1).get_total_result_text()], [230.62, 348.6, -117.98, 1050.66, 1244.74])
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual([round(value, 2) for value in FiscalYear.objects.get(id=1).get_total_result_text()], [230.62, 348.6, -117.98, 1050.66, 1244.74])
+        self.assertEqual(len(queries), 1)
+
+        new_entry = add_entry(1, 3, '2015-02-26', 'vente 4', '-1|10|0|10.000000|0|0|None|\n-2|2|0|10.000000|0|0|None|')
+        self.assertEqual([round(value, 2) for value in FiscalYear.objects.get(id=1).get_total_result_text()], [240.62, 348.6, -107.98, 1060.66, 1244.74])
+        self.commit_changes()
+        self.assertEqual([round(value, 2) for value in FiscalYear.objects.get(id=1).get_total_result_text()], [240.62, 348.6, -107.98, 1060.66, 1244.74])
+        new_entry.closed()
+        self.assertEqual([round(value, 2) for value in FiscalYear.objects.get(id=1).get_total_result_text()], [240.62, 348.6, -107.98, 1060.66, 1254.74])
+        self.commit_changes()
+        self.assertEqual([round(value, 2) for value in FiscalYear.objects.get(id=1).get_total_result_text()], [240.62, 348.6, -107.98, 1060.66, 1254.74])
+        EntryAccount.objects.filter(id=new_entry.id).update(date_value='2016-02-26')
+        EntryAccount.objects.get(id=new_entry.id).save()
+        self.assertEqual([round(value, 2) for value in FiscalYear.objects.get(id=1).get_total_result_text()], [230.62, 348.6, -117.98, 1050.66, 1244.74])
+        self.commit_changes()
+        self.assertEqual([round(value, 2) for value in FiscalYear.objects.get(id=1).get_total_result_text()], [230.62, 348.6, -117.98, 1050.66, 1244.74])
+
+    def test_entry_draft(self):
+        fill_entries_fr(1)
+        entry = EntryAccount.objects.get(id=1)
+        serial_entry = entry.get_serial()
+        self.assertEqual(serial_entry, EntryAccount.objects.get(id=1).get_serial())
+        self.assertEqual(entry.serial_control(serial_entry), (True, 0.0, 0.0))
+        serial_lines = []
+        for idx in range(100):
+            serial_lines.append("-%d|4|%d|%f|0|0|ref %d|" % (2 * idx + 1, (idx % 4) + 1, -12.5, idx))
+            serial_lines.append("-%d|10|0|%f|2|0|None|" % (2 * idx + 2, 12.5))
+        serial_entry = "\n".join(serial_lines)
+        with self.assertNumQueries(3):
+            lines = entry.get_entrylineaccounts(serial_entry)
+        self.assertEqual(len(lines), 200)
+        self.assertEqual(lines[0].account.code, '401')
+        self.assertEqual(lines[0].third_id, 1)
+        self.assertEqual(lines[0].reference, 'ref 0')
+        self.assertEqual(lines[1].costaccounting_id, 2)
+        self.assertEqual(entry.get_serial(lines), serial_entry)
+        with self.assertNumQueries(2):
+            self.assertEqual(entry.serial_control(serial_entry), (False, 0.0, 0.0))
+        with self.assertNumQueries(0):
+            serial_entry = entry.remove_entrylineaccounts(serial_entry, -2)
+        self.assertEqual(len(serial_entry.split('\n')), 199)
+        self.assertEqual(entry.serial_control(serial_entry), (False, 0.0, 12.5))
+
+    def test_entry_balance_control(self):
+        fill_entries_fr(1)
+        entry = EntryAccount.objects.create(year_id=1, journal_id=2, designation='unbalanced', date_value='2015-02-20')
+        self.assertEqual(entry.balance_control(), (False, 0.0, 0.0))
+        EntryLineAccount.objects.create(entry=entry, account_id=4, amount=50.0)
+        EntryLineAccount.objects.create(entry=entry, account_id=10, amount=-42.5)
+        self.assertEqual(entry.balance_control(), (True, 7.5, 0.0))
+        entries = EntryAccount.objects.filter(year_id=1)
+        with self.assertNumQueries(1):
+            balance_controls = EntryAccount.get_balance_controls(entries)
+        for entry in entries:
+            self.assertEqual(balance_controls.get(entry.id, (False, 0.0, 0.0)), entry.serial_control(entry.get_serial()), entry)
+
+    def test_import_entries_bulk(self):
+        default_costaccounting()
+        fill_thirds_fr()
+        rows = []
+        for idx in range(500):
+            date_value = '2015-%02d-%02d' % ((idx % 12) + 1, (idx % 28) + 1)
+            designation = 'import %d' % idx
+            rows.append({'account': '411', 'debit': 10.0 + idx, 'credit': 0.0, 'third': 'Dalton Joe' if (idx % 2) == 0 else 'Minimum'})
+            rows.append({'account': '701', 'debit': 0.0, 'credit': 10.0 + idx, 'costaccounting': 'open', 'reference': 'ref %d' % idx})
+            for rowdata in rows[-2:]:
+                rowdata.update({'entry.year': 1, 'entry.journal': 3, 'entry.date_value': date_value, 'entry.designation': designation})
+        rows.append({'entry.year': 1, 'entry.journal': 3, 'entry.date_value': '2015-12-31', 'entry.designation': 'bad sum', 'account': '512', 'debit': 12.0, 'credit': 0.0})
+        rows.append({'entry.year': 1, 'entry.journal': 3, 'entry.date_value': '2015-12-31', 'entry.designation': 'bad sum', 'account': '531', 'debit': 0.0, 'credit': 13.0})
+        rows.append({'entry.year': 1, 'entry.journal': 3, 'entry.date_value': '2015-12-31', 'entry.designation': 'bad code', 'account': '515', 'debit': 20.0, 'credit': 0.0})
+        rows.append({'entry.year': 1, 'entry.journal': 3, 'entry.date_value': '2015-12-31', 'entry.designation': 'bad code', 'account': '531', 'debit': 0.0, 'credit': 20.0})
+        items_imported = {}
+        with CaptureQueriesContext(connection) as queries:
+            EntryLineAccount.initialize_import()
+            for rowdata in rows:
+                new_item = EntryLineAccount.import_data(rowdata, '%Y-%m-%d')
+                if new_item is not None:
+                    items_imported[new_item.id] = new_item
+            new_item = EntryLineAccount.finalize_import()
+            if new_item is not None:
+                items_imported[new_item.id] = new_item
+        self.assertEqual(len(items_imported), 500)
+        self.assertLess(len(queries), 500 * 2)
+        lines = EntryLineAccount.objects.filter(entry_id__in=list(items_imported.keys()))
+        self.assertEqual(len(lines), 1000)
+        self.assertEqual(lines.filter(third__isnull=False).count(), 500)
+        self.assertEqual(lines.filter(costaccounting__name='open').count(), 500)
+        self.assertEqual(lines.filter(reference='ref 12').count(), 1)
+        self.assertEqual(ChartsAccountBalance.check_balance(), [])
+        self.assertAlmostEqual(ChartsAccount.objects.get(year_id=1, code='701').current_total, 500 * 10.0 + 499 * 250, delta=0.0001)
+
     def test_buyingselling_in_report(self):
         self.factory.xfer = EntryAccountEdit()
         self.calljson('/diacamma.accounting/entryAccountEdit', {'SAVE': 'YES', 'year': '1', 'journal': '1',
@@ -1118,3 +1280,150 @@ class EntryTest(LucteriosTest):
         self.assert_json_equal('', 'entryline/@9/entry_account', '[602] 602')
         self.assert_json_equal('', 'entryline/@9/costaccounting', None)
         self.assert_json_equal('', 'entryline/@9/debit', -37.01)
+
+    def test_import_entries_resume(self):
+        csv_content = """date;code;description;debit;credit
+04/09/2015;512;Retrait;1 000,00;
+04/09/2015;531;Retrait;;1 000,00
+05/09/2015;512;Apport;300,00;
+05/09/2015;106;Apport;;300,00
+06/09/2015;512;Sell;250,00;
+06/09/2015;706;Sell;;250,00
+07/09/2015;512;Retrait;40,00;
+07/09/2015;531;Retrait;;40,00
+"""
+        import_params = {'step': 3, 'year': 1, 'journal': 1, 'quotechar': "'", 'delimiter': ';', 'encoding': 'utf-8', 'dateformat': '%d/%m/%Y', 'csvcontent0': csv_content,
+                         "fld_entry.date_value": "date", "fld_entry.designation": "description", "fld_account": "code", 'fld_debit': 'debit', 'fld_credit': 'credit'}
+
+        self.factory.xfer = EntryAccountImport()
+        self.factory.xfer.import_batch_size = 4
+        self.calljson('/diacamma.accounting/entryAccountImport', import_params, False)
+        self.assert_observer('core.exception', 'diacamma.accounting', 'entryAccountImport')
+        self.assertEqual(EntryAccount.objects.count(), 2)
+        self.assertEqual(ImportJob.objects.count(), 1)
+        job = ImportJob.objects.get()
+        self.assertEqual((job.status, job.nb_rows, job.offset, job.nb_imported, job.nb_skipped), (0, 0, 4, 2, 0))
+        self.assertEqual(job.progress, "4/---")
+        self.assertEqual(ImportedContent.objects.count(), 2)
+
+        self.factory.xfer = EntryAccountImport()
+        self.factory.xfer.import_batch_size = 4
+        self.calljson('/diacamma.accounting/entryAccountImport', import_params, False)
+        self.assert_observer('core.exception', 'diacamma.accounting', 'entryAccountImport')
+        self.assertEqual(EntryAccount.objects.count(), 2)
+        self.assertEqual(ImportJob.objects.count(), 1)
+
+        import_params['journal'] = 5
+        self.factory.xfer = EntryAccountImport()
+        self.factory.xfer.import_batch_size = 4
+        self.calljson('/diacamma.accounting/entryAccountImport', import_params, False)
+        self.assert_observer('core.custom', 'diacamma.accounting', 'entryAccountImport')
+        self.assert_count_equal('', 3)
+        self.assert_count_equal('entryline', 8)
+        self.assertEqual(EntryAccount.objects.count(), 6)
+        self.assertEqual(ImportJob.objects.filter(status=1).count(), 1)
+        self.assertEqual(ImportedContent.objects.count(), 6)
+
+        self.factory.xfer = EntryAccountImport()
+        self.calljson('/diacamma.accounting/entryAccountImport', import_params, False)
+        self.assert_observer('core.custom', 'diacamma.accounting', 'entryAccountImport')
+        self.assert_count_equal('', 4)
+        self.assert_count_equal('entryline', 0)
+        self.assertEqual(EntryAccount.objects.count(), 6)
+        job = ImportJob.objects.order_by('-id').first()
+        self.assertEqual((job.status, job.nb_rows, job.offset, job.nb_imported, job.nb_skipped), (1, 8, 8, 0, 8))
+
+        EntryAccount.objects.filter(designation='Sell', journal_id=5).delete()
+        self.assertEqual(EntryAccount.objects.count(), 5)
+        self.factory.xfer = EntryAccountImport()
+        self.calljson('/diacamma.accounting/entryAccountImport', import_params, False)
+        self.assert_observer('core.custom', 'diacamma.accounting', 'entryAccountImport')
+        self.assert_count_equal('entryline', 2)
+        self.assertEqual(EntryAccount.objects.count(), 6)
+        job = ImportJob.objects.order_by('-id').first()
+        self.assertEqual((job.status, job.nb_rows, job.offset, job.nb_imported, job.nb_skipped), (1, 8, 8, 1, 6))
+        self.assertEqual(ImportedContent.objects.count(), 6)
+
+    def test_import_entries_other_file(self):
+        csv_content = """date;code;description;debit;credit
+04/09/2015;512;Retrait;1 000,00;
+04/09/2015;531;Retrait;;1 000,00
+05/09/2015;512;Apport;300,00;
+05/09/2015;106;Apport;;300,00
+"""
+        import_params = {'step': 3, 'year': 1, 'journal': 5, 'quotechar': "'", 'delimiter': ';', 'encoding': 'utf-8', 'dateformat': '%d/%m/%Y', 'csvcontent0': csv_content,
+                         "fld_entry.date_value": "date", "fld_entry.designation": "description", "fld_account": "code", 'fld_debit': 'debit', 'fld_credit': 'credit'}
+        self.factory.xfer = EntryAccountImport()
+        self.calljson('/diacamma.accounting/entryAccountImport', import_params, False)
+        self.assert_observer('core.custom', 'diacamma.accounting', 'entryAccountImport')
+        self.assertEqual(EntryAccount.objects.count(), 2)
+
+        import_params['csvcontent0'] = """date;code;description;debit;credit
+05/09/2015;512;Apport;300,00;
+05/09/2015;106;Apport;;300,00
+06/09/2015;512;Sell;250,00;
+06/09/2015;706;Sell;;250,00
+"""
+        self.factory.xfer = EntryAccountImport()
+        self.calljson('/diacamma.accounting/entryAccountImport', import_params, False)
+        self.assert_observer('core.custom', 'diacamma.accounting', 'entryAccountImport')
+        self.assert_count_equal('', 3)
+        self.assertEqual(EntryAccount.objects.count(), 4)
+        self.assertEqual(EntryAccount.objects.filter(designation='Apport').count(), 2)
+        job = ImportJob.objects.order_by('-id').first()
+        self.assertEqual((job.status, job.nb_rows, job.offset, job.nb_imported, job.nb_skipped), (1, 4, 4, 2, 0))
+
+        self.factory.xfer = EntryAccountImport()
+        self.calljson('/diacamma.accounting/entryAccountImport', import_params, False)
+        self.assert_observer('core.custom', 'diacamma.accounting', 'entryAccountImport')
+        self.assertEqual(EntryAccount.objects.count(), 4)
+        job = ImportJob.objects.order_by('-id').first()
+        self.assertEqual((job.status, job.nb_rows, job.offset, job.nb_imported, job.nb_skipped), (1, 4, 4, 0, 4))
+
+    def test_import_entries_auditlog(self):
+        csv_content = """date;code;description;debit;credit
+04/09/2015;512;Retrait;1 000,00;
+04/09/2015;531;Retrait;;1 000,00
+05/09/2015;512;Apport;300,00;
+05/09/2015;106;Apport;;300,00
+"""
+        import_params = {'step': 3, 'year': 1, 'journal': 5, 'quotechar': "'", 'delimiter': ';', 'encoding': 'utf-8', 'dateformat': '%d/%m/%Y', 'csvcontent0': csv_content,
+                         "fld_entry.date_value": "date", "fld_entry.designation": "description", "fld_account": "code", 'fld_debit': 'debit', 'fld_credit': 'credit'}
+        LucteriosAuditlogModelRegistry.set_state_packages(['accounting'])
+        LucteriosAuditlogModelRegistry.main_enabled()
+        try:
+            self.factory.xfer = EntryAccountImport()
+            self.calljson('/diacamma.accounting/entryAccountImport', import_params, False)
+            self.assert_observer('core.custom', 'diacamma.accounting', 'entryAccountImport')
+        finally:
+            LucteriosAuditlogModelRegistry.main_disabled()
+        self.assertEqual(EntryAccount.objects.count(), 2)
+        log_entries = LucteriosLogEntry.objects.filter(modelname='accounting.EntryAccount', action=LucteriosLogEntry.Action.CREATE).order_by('object_id')
+        self.assertEqual([log_entry.object_id for log_entry in log_entries], list(EntryAccount.objects.order_by('id').values_list('id', flat=True)))
+        line_changes = [list(json.loads(log_entry.additional_data).values())[0]['4'] for log_entry in log_entries]
+        self.assertEqual([[line_change['changes']['entry_account'][1] for line_change in line_change_list] for line_change_list in line_changes],
+                         [['[512] 512', '[531] 531'], ['[512] 512', '[106] 106']])
+
+    def test_import_entries_unbalanced(self):
+        csv_content = """date;code;description;debit;credit
+04/09/2015;512;Retrait;1 000,00;
+04/09/2015;531;Retrait;;1 000,00
+05/09/2015;512;Apport;300,00;
+05/09/2015;106;Apport;;200,00
+"""
+        import_params = {'step': 3, 'year': 1, 'journal': 5, 'quotechar': "'", 'delimiter': ';', 'encoding': 'utf-8', 'dateformat': '%d/%m/%Y', 'csvcontent0': csv_content,
+                         "fld_entry.date_value": "date", "fld_entry.designation": "description", "fld_account": "code", 'fld_debit': 'debit', 'fld_credit': 'credit'}
+
+        self.factory.xfer = EntryAccountImport()
+        self.calljson('/diacamma.accounting/entryAccountImport', import_params, False)
+        self.assert_observer('core.custom', 'diacamma.accounting', 'entryAccountImport')
+        self.assertEqual(EntryAccount.objects.count(), 1)
+        self.assertEqual(list(ImportedContent.objects.values_list('item_model', 'item_id')), [('accounting.EntryAccount', EntryAccount.objects.get().id)])
+
+        self.factory.xfer = EntryAccountImport()
+        self.calljson('/diacamma.accounting/entryAccountImport', import_params, False)
+        self.assert_observer('core.custom', 'diacamma.accounting', 'entryAccountImport')
+        self.assertEqual(EntryAccount.objects.count(), 1)
+        job = ImportJob.objects.order_by('-id').first()
+        self.assertEqual((job.status, job.nb_rows, job.offset, job.nb_imported, job.nb_skipped), (1, 4, 4, 0, 2))
+        self.assertEqual(ImportedContent.objects.count(), 1)
@@ -23,8 +23,11 @@ along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
 from __future__ import unicode_literals
+from functools import lru_cache
+import threading
 
-from django.utils.translation import ugettext_lazy as _
+from django.core.signals import request_started, request_finished
+from django.utils.translation import ugettext_lazy as _, get_language
 
 from lucterios.CORE.parameters import Params
 
@@ -47,6 +50,60 @@ def clear_system_account():
 
     if hasattr(current_module, 'SYSTEM_ACCOUNT_CACHE'):
         del current_module.SYSTEM_ACCOUNT_CACHE
+    clear_accounting_cache()
+
+
+def clear_accounting_cache():
+    ParamsSnapshot.clear()
+    _get_accounting_code.cache_clear()
+    _get_format_with_devise.cache_clear()
+
+
+class ParamsSnapshot(object):
+
+    _local = threading.local()
+
+    _generation = 0
+
+    def __enter__(self):
+        self.owner = getattr(self._local, 'snapshot', None) is None
+        if self.owner:
+            self.begin()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.owner:
+            self.end()
+
+    @classmethod
+    def begin(cls, *args, **kwargs):
+        cls._local.snapshot = [cls._generation, {}]
+
+    @classmethod
+    def end(cls, *args, **kwargs):
+        cls._local.snapshot = None
+
+    @classmethod
+    def clear(cls):
+        with Params._paramlock:
+            cls._generation += 1
+
+    @classmethod
+    def getvalue(cls, name):
+        snapshot = getattr(cls._local, 'snapshot', None)
+        if snapshot is None:
+            return Params.getvalue(name)
+        if snapshot[0] != cls._generation:
+            snapshot[1].clear()
+        if name not in snapshot[1]:
+            with Params._paramlock:
+                snapshot[0] = cls._generation
+                snapshot[1][name] = Params.getvalue(name)
+        return snapshot[1][name]
+
+
+request_started.connect(ParamsSnapshot.begin, dispatch_uid="diacamma.accounting.params_snapshot")
+request_finished.connect(ParamsSnapshot.end, dispatch_uid="diacamma.accounting.params_snapshot")
 
 
 def get_amount_sum(val):
@@ -57,20 +114,25 @@ def get_amount_sum(val):
 
 
 def currency_round(amount):
-    currency_decimal = Params.getvalue("accounting-devise-prec")
+    currency_decimal = ParamsSnapshot.getvalue("accounting-devise-prec")
     try:
         return round(float(amount), currency_decimal)
     except Exception:
         return round(0.0, currency_decimal)
 
 
+@lru_cache(maxsize=4096)
+def _get_accounting_code(code, code_size):
+    while len(code) > code_size and code[-1] == '0':
+        code = code[:-1]
+    while len(code) < code_size:
+        code += '0'
+    return code
+
+
 def correct_accounting_code(code):
     if current_system_account().has_minium_code_size():
-        code_size = Params.getvalue("accounting-sizecode")
-        while len(code) > code_size and code[-1] == '0':
-            code = code[:-1]
-        while len(code) < code_size:
-            code += '0'
+        code = _get_accounting_code(code, ParamsSnapshot.getvalue("accounting-sizecode"))
     return code
 
 
@@ -83,9 +145,12 @@ def get_currency_symbole(iso_ident):
 
 
 def format_with_devise(mode):
+    return _get_format_with_devise(mode, ParamsSnapshot.getvalue("accounting-devise-iso"), ParamsSnapshot.getvalue("accounting-devise-prec"), get_language())
+
+
+@lru_cache(maxsize=256)
+def _get_format_with_devise(mode, currency_iso, currency_decimal, language):
     result = []
-    currency_iso = Params.getvalue("accounting-devise-iso")
-    currency_decimal = Params.getvalue("accounting-devise-prec")
     result.append('C%d%s' % (currency_decimal, currency_iso))
     if mode == 0:  # 25.45 => 25,45€ / -25.45 => / 0 =>
         result.append('%s')
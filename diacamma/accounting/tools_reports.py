@@ -23,11 +23,15 @@ along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
 from __future__ import unicode_literals
+import re
 
+from django.db.models import Q
 from django.db.models.aggregates import Sum
 from django.utils import six
 
-from diacamma.accounting.models import EntryLineAccount, ChartsAccount, Budget, Third
+from lucterios.framework.xfercomponents import XferCompGrid
+
+from diacamma.accounting.models import ChartsAccount, Budget, Third, ClosedYearBalance
 from diacamma.accounting.tools import correct_accounting_code
 
 
@@ -35,46 +39,77 @@ def get_spaces(size):
     return ''.ljust(size, '-').replace('-', '&#160;')
 
 
-def credit_debit_way(data_line):
-    if 'account' in data_line.keys():
-        account = ChartsAccount.objects.get(id=data_line['account'])
-        return account.credit_debit_way()
-    elif 'code' in data_line.keys():
-        account_code = correct_accounting_code(data_line['code'])
-        account = ChartsAccount.get_chart_account(account_code)
-        return account.credit_debit_way()
-    return 0
+def get_signed_amount(data_sum, type_of_account, sign_value):
+    way = -1 if type_of_account in (0, 4) else 1
+    amount = None
+    if sign_value is None:
+        amount = data_sum
+    elif isinstance(sign_value, bool):
+        if sign_value:
+            amount = way * data_sum
+        else:
+            amount = -1 * way * data_sum
+    else:
+        amount = sign_value * way * data_sum
+        if (amount < 0):
+            amount = None
+    return amount
+
+
+def match_query(query, data_line):
+    results = []
+    for child in query.children:
+        if isinstance(child, Q):
+            results.append(match_query(child, data_line))
+        else:
+            lookup, value = child
+            lookup_items = lookup.split('__')
+            if lookup_items[-1] in ('exact', 'in', 'startswith', 'regex'):
+                lookup_type = lookup_items.pop()
+            else:
+                lookup_type = 'exact'
+            line_value = data_line['__'.join(lookup_items)]
+            if lookup_type == 'in':
+                results.append(line_value in [getattr(item, 'pk', item) for item in value])
+            elif lookup_type == 'startswith':
+                results.append(six.text_type(line_value).startswith(value))
+            elif lookup_type == 'regex':
+                results.append(re.search(value, six.text_type(line_value)) is not None)
+            else:
+                results.append(line_value == getattr(value, 'pk', value))
+    if query.connector == Q.OR:
+        res = any(results)
+    else:
+        res = all(results)
+    return not res if query.negated else res
 
 
 def get_totalaccount_for_query(query, sign_value=None, with_third=False):
-    total = 0
-    values = {}
     if with_third:
         fields = ['account', 'third']
     else:
         fields = ['account']
-    for data_line in EntryLineAccount.objects.filter(query).order_by(*fields).values(*fields).annotate(data_sum=Sum('amount')):
+    entrylines = ClosedYearBalance.get_lines(query)
+    if with_third:
+        third_names = Third.get_names(entrylines.values('third'))
+    else:
+        third_names = {}
+    data_lines = entrylines.order_by(*fields).values(*fields, 'account__code', 'account__name', 'account__type_of_account').annotate(data_sum=Sum('amount'))
+    return get_totalaccount_for_lines(data_lines, sign_value, third_names)
+
+
+def get_totalaccount_for_lines(data_lines, sign_value=None, third_names=None):
+    total = 0
+    values = {}
+    for data_line in data_lines:
         if abs(data_line['data_sum']) > 0.001:
-            account = ChartsAccount.objects.get(id=data_line['account'])
-            account_code = correct_accounting_code(account.code)
+            account_code = correct_accounting_code(data_line['account__code'])
             if ('third' in data_line.keys()) and (data_line['third'] is not None):
                 account_code = "%s#%s" % (account_code, data_line['third'])
-                third = Third.objects.get(id=data_line['third'])
-                account_title = "[%s %s]" % (account.code, six.text_type(third))
-            else:
-                account_title = account.get_name()
-            amount = None
-            if sign_value is None:
-                amount = data_line['data_sum']
-            elif isinstance(sign_value, bool):
-                if sign_value:
-                    amount = credit_debit_way(data_line) * data_line['data_sum']
-                else:
-                    amount = -1 * credit_debit_way(data_line) * data_line['data_sum']
+                account_title = "[%s %s]" % (data_line['account__code'], third_names[data_line['third']])
             else:
-                amount = sign_value * credit_debit_way(data_line) * data_line['data_sum']
-                if (amount < 0):
-                    amount = None
+                account_title = "[%s] %s" % (correct_accounting_code(data_line['account__code']), data_line['account__name'])
+            amount = get_signed_amount(data_line['data_sum'], data_line['account__type_of_account'], sign_value)
             if amount is not None:
                 if account_code not in values.keys():
                     values[account_code] = [0, account_title]
@@ -84,11 +119,17 @@ def get_totalaccount_for_query(query, sign_value=None, with_third=False):
 
 
 def get_totalbudget_for_query(query):
+    return get_totalbudget_for_lines(Budget.objects.filter(query).order_by('code').values('code').annotate(data_sum=Sum('amount')))
+
+
+def get_totalbudget_for_lines(data_lines, chart_accounts=None):
     total = 0
     values = {}
-    for data_line in Budget.objects.filter(query).order_by('code').values('code').annotate(data_sum=Sum('amount')):
+    for data_line in data_lines:
         if abs(data_line['data_sum']) > 0.001:
-            account = ChartsAccount.get_chart_account(data_line['code'])
+            if chart_accounts is None:
+                chart_accounts = ChartsAccount.get_chart_accounts_map()
+            account = ChartsAccount.get_chart_account(data_line['code'], chart_accounts)
             account_code = account.code
             account_title = account.get_name()
             amount = data_line['data_sum']
@@ -100,41 +141,55 @@ def get_totalbudget_for_query(query):
 
 
 def convert_query_to_account(query1, query2=None, query_budget=None, sign_value=None, with_third=False):
+    account_values1 = get_totalaccount_for_query(query1, sign_value, with_third)
+    if query2 is not None:
+        account_values2 = get_totalaccount_for_query(query2, sign_value, with_third)
+    else:
+        account_values2 = None
+    if isinstance(query_budget, list):
+        budget_values = [get_totalbudget_for_query(query_budget_item) for query_budget_item in query_budget]
+    elif query_budget is not None:
+        budget_values = get_totalbudget_for_query(query_budget)
+    else:
+        budget_values = None
+    return convert_values_to_account(account_values1, account_values2, budget_values)
+
+
+def convert_values_to_account(account_values1, account_values2=None, budget_values=None):
     def check_account(account_code, account_title):
         if account_code not in dict_account.keys():
             dict_account[account_code] = [account_title, None, None]
-            if isinstance(query_budget, list):
-                for _item in query_budget:
+            if isinstance(budget_values, list):
+                for _item in budget_values:
                     dict_account[account_code].append(None)
             else:
                 dict_account[account_code].append(None)
     dict_account = {}
-    values1, total1 = get_totalaccount_for_query(query1, sign_value, with_third)
+    values1, total1 = account_values1
     for account_code in values1.keys():
         check_account(account_code, values1[account_code][1])
         dict_account[account_code][1] = values1[account_code][0]
-    if query2 is not None:
-        values2, total2 = get_totalaccount_for_query(query2, sign_value, with_third)
+    if account_values2 is not None:
+        values2, total2 = account_values2
         for account_code in values2.keys():
             check_account(account_code, values2[account_code][1])
             dict_account[account_code][2] = values2[account_code][0]
     else:
         total2 = 0
-    if query_budget is not None:
-        if isinstance(query_budget, list):
-            query_budget_list = query_budget
+    if budget_values is not None:
+        if isinstance(budget_values, list):
+            budget_values_list = budget_values
         else:
-            query_budget_list = [query_budget]
+            budget_values_list = [budget_values]
         total_b = []
         id_dict = 3
-        for query_budget_item in query_budget_list:
-            valuesb, total3 = get_totalbudget_for_query(query_budget_item)
+        for valuesb, total3 in budget_values_list:
             for account_code in valuesb.keys():
                 check_account(account_code, valuesb[account_code][1])
                 dict_account[account_code][id_dict] = valuesb[account_code][0]
             id_dict += 1
             total_b.append(total3)
-        if isinstance(query_budget, list):
+        if isinstance(budget_values, list):
             total3 = total_b
         else:
             total3 = total_b[0]
@@ -147,6 +202,41 @@ def convert_query_to_account(query1, query2=None, query_budget=None, sign_value=
     return res, total1, total2, total3
 
 
+def convert_sections_to_account(query1, query2, sections):
+    query_list = [query1]
+    if query2 is not None:
+        query_list.append(query2)
+    sections_filter = Q()
+    for section_filter, _sign_value in sections:
+        sections_filter |= Q(**section_filter)
+    entrylines, query_list = ClosedYearBalance.get_lines_by_queries(query_list, sections_filter)
+    sums = {'data_sum%d' % query_idx: Sum('amount', filter=query_item) for query_idx, query_item in enumerate(query_list)}
+    fields = ['account', 'account__code', 'account__name', 'account__type_of_account', 'account__is_cash', 'account__is_third']
+    data_lines = list(entrylines.order_by('account').values(*fields).annotate(**sums))
+    res = []
+    for section_filter, sign_value in sections:
+        dict_account = {}
+        totals = [0, 0]
+        for query_idx in range(len(query_list)):
+            for data_line in data_lines:
+                data_sum = data_line['data_sum%d' % query_idx]
+                if (data_sum is None) or (abs(data_sum) <= 0.001):
+                    continue
+                if not all([data_line[field_name] == field_value for field_name, field_value in section_filter.items()]):
+                    continue
+                amount = get_signed_amount(data_sum, data_line['account__type_of_account'], sign_value)
+                if amount is not None:
+                    account_code = correct_accounting_code(data_line['account__code'])
+                    if account_code not in dict_account.keys():
+                        dict_account[account_code] = ["[%s] %s" % (account_code, data_line['account__name']), None, None, None]
+                    if dict_account[account_code][query_idx + 1] is None:
+                        dict_account[account_code][query_idx + 1] = 0
+                    dict_account[account_code][query_idx + 1] += amount
+                    totals[query_idx] += amount
+        res.append(([dict_account[key] for key in sorted(dict_account.keys())], totals[0], totals[1], 0))
+    return res
+
+
 def add_cell_in_grid(grid, line_idx, colname, value, formttext='%s'):
     if value is None:
         return
@@ -156,6 +246,34 @@ def add_cell_in_grid(grid, line_idx, colname, value, formttext='%s'):
         grid.set_value("L%04d" % line_idx, colname, value)
 
 
+class StreamedGrid(XferCompGrid):
+
+    def __init__(self, name):
+        XferCompGrid.__init__(self, name)
+        self.rows_source = None
+
+    def _get_record_ids(self):
+        if self.rows_source is None:
+            return
+        for line_idx, row in enumerate(self.rows_source()):
+            row_grid = XferCompGrid(self.name)
+            row_grid.headers = self.headers
+            for colname, value, formttext in row:
+                add_cell_in_grid(row_grid, line_idx, colname, value, formttext)
+            self.records = row_grid.records
+            for record_id in row_grid.record_ids:
+                yield record_id
+        self.records = {}
+
+    def _set_record_ids(self, record_ids):
+        pass
+
+    record_ids = property(_get_record_ids, _set_record_ids)
+
+    def get_json_value(self):
+        return []
+
+
 def add_item_in_grid(grid, line_idx, side, data_item, formttext='%s'):
     add_cell_in_grid(grid, line_idx, side, data_item[0], formttext)
     add_cell_in_grid(grid, line_idx, side + '_n', data_item[1], formttext)
@@ -26,9 +26,7 @@ from __future__ import unicode_literals
 from datetime import timedelta, date
 
 from django.utils.translation import ugettext_lazy as _
-from django.db.models.query import QuerySet
-from django.db.models.functions import Concat
-from django.db.models import Q, Value
+from django.db.models import Q
 from django.utils import six, formats
 
 from lucterios.framework import signal_and_lock
@@ -38,21 +36,37 @@ from lucterios.framework.xferadvance import XferListEditor, XferAddEditor, XferS
 from lucterios.framework.xfergraphic import XferContainerAcknowledge
 from lucterios.framework.xfercomponents import XferCompLabelForm, XferCompEdit, XferCompButton, XferCompSelect, XferCompImage, XferCompDate, XferCompGrid
 from lucterios.framework.tools import FORMTYPE_NOMODAL, ActionsManage, MenuManage, FORMTYPE_REFRESH, CLOSE_NO, WrapAction, FORMTYPE_MODAL, SELECT_SINGLE, SELECT_MULTI, SELECT_NONE, CLOSE_YES
-from lucterios.framework.error import LucteriosException
+from lucterios.framework.error import LucteriosException, IMPORTANT
 from lucterios.CORE.xferprint import XferPrintListing
 from lucterios.CORE.editors import XferSavedCriteriaSearchEditor
 from lucterios.contacts.tools import ContactSelection
 from lucterios.contacts.models import AbstractContact
 
-from diacamma.accounting.models import Third, AccountThird, FiscalYear, EntryLineAccount, ModelLineEntry, ChartsAccount
+from diacamma.accounting.models import Third, AccountThird, FiscalYear, EntryLineAccount, ModelLineEntry, ChartsAccount, AccountLink
 from diacamma.accounting.views_admin import Configuration, add_year_info
 from diacamma.accounting.tools import correct_accounting_code, current_system_account
+from diacamma.accounting.system import get_mask_filter
 from django.db.models.aggregates import Count
 from diacamma.accounting.views_entries import add_fiscalyear_result
 
 MenuManage.add_sub("financial", None, "diacamma.accounting/images/financial.png", _("Financial"), _("Financial tools"), 50)
 
 
+def get_third_filter(contact_filter, thirdtype):
+    third_filter = Q(status=0)
+    if contact_filter != "":
+        third_filter &= Q(sort_name__contains=Third.normalize_name(contact_filter))
+    if thirdtype == 1:
+        third_filter &= get_mask_filter(current_system_account().get_customer_mask(), 'accountthird__code')
+    elif thirdtype == 2:
+        third_filter &= get_mask_filter(current_system_account().get_provider_mask(), 'accountthird__code')
+    elif thirdtype == 3:
+        third_filter &= get_mask_filter(current_system_account().get_societary_mask(), 'accountthird__code')
+    elif thirdtype == 4:
+        third_filter &= get_mask_filter(current_system_account().get_employed_mask(), 'accountthird__code')
+    return third_filter
+
+
 @MenuManage.describ('accounting.change_third', FORMTYPE_NOMODAL, 'financial', _('Management of third account'))
 class ThirdList(XferListEditor):
     icon = "thirds.png"
@@ -61,7 +75,10 @@ class ThirdList(XferListEditor):
     caption = _("Thirds")
 
     def get_items_from_filter(self):
-        items = self.model.objects.annotate(completename=Concat('contact__individual__lastname', Value(' '), 'contact__individual__firstname')).annotate(num_entryline=Count('entrylineaccount')).filter(self.filter).distinct()
+        items = self.model.objects.annotate(num_entryline=Count('entrylineaccount')).filter(self.filter).distinct()
+        items = items.select_related('contact', 'contact__legalentity', 'contact__individual').prefetch_related('accountthird_set')
+        if self.getparam('show_filter', 0) != 0:
+            items = Third.annotate_total(items, self.getparam('show_filter', 0) == 2)
         sort_third = self.getparam('GRID_ORDER%third', '')
         sort_thirdbis = self.getparam('GRID_ORDER%third+', '')
         self.params['GRID_ORDER%third'] = ""
@@ -71,12 +88,7 @@ class ThirdList(XferListEditor):
             else:
                 sort_thirdbis = "-"
             self.params['GRID_ORDER%third+'] = sort_thirdbis
-        items = sorted(items, key=lambda t: six.text_type(t).lower(), reverse=sort_thirdbis.startswith('-'))
-        if self.getparam('show_filter', 0) == 2:
-            items = [item for item in items if abs(item.get_total()) > 0.0001]
-        res = QuerySet(model=Third)
-        res._result_cache = items
-        return res
+        return items.order_by('-sort_name' if sort_thirdbis.startswith('-') else 'sort_name')
 
     def fillresponse_header(self):
         contact_filter = self.getparam('filter', '')
@@ -109,19 +121,7 @@ class ThirdList(XferListEditor):
         if show_filter != 0:
             self.fieldnames = Third.get_other_fields()
 
-        self.filter = Q(status=0)
-        if contact_filter != "":
-            q_legalentity = Q(contact__legalentity__name__icontains=contact_filter)
-            q_individual = Q(completename__icontains=contact_filter)
-            self.filter &= (q_legalentity | q_individual)
-        if thirdtype == 1:
-            self.filter &= Q(accountthird__code__regex=current_system_account().get_customer_mask())
-        elif thirdtype == 2:
-            self.filter &= Q(accountthird__code__regex=current_system_account().get_provider_mask())
-        elif thirdtype == 3:
-            self.filter &= Q(accountthird__code__regex=current_system_account().get_societary_mask())
-        elif thirdtype == 4:
-            self.filter &= Q(accountthird__code__regex=current_system_account().get_employed_mask())
+        self.filter = get_third_filter(contact_filter, thirdtype)
         if show_filter == 3:
             self.filter &= Q(entrylineaccount__link__isnull=True) & Q(num_entryline__gt=0)
 
@@ -135,6 +135,31 @@ class ThirdSearch(XferSavedCriteriaSearchEditor):
     caption = _("Search third")
 
 
+@ActionsManage.affect_list(_("Lettering"), "images/ok.png", condition=lambda xfer: xfer.getparam('show_filter', 0) == 3)
+@MenuManage.describ('accounting.add_entryaccount')
+class ThirdAutoLettering(XferContainerAcknowledge):
+    icon = "thirds.png"
+    model = Third
+    field_id = 'third'
+    caption = _("Automatic lettering")
+
+    def fillresponse(self, lettering=''):
+        year = FiscalYear.get_current()
+        if lettering == '':
+            third_filter = get_third_filter(self.getparam('filter', ''), self.getparam('thirdtype', 0))
+            proposals = AccountLink.auto_lettering(year, third_ids=Third.objects.filter(third_filter).values('id'), dry_run=True)
+        else:
+            proposals = AccountLink.check_lettering(year, lettering)
+        if len(proposals) == 0:
+            raise LucteriosException(IMPORTANT, _("No line to letter automatically!"))
+        if lettering == '':
+            self.redirect_action(ThirdAutoLettering.get_action(), close=CLOSE_YES, params={'lettering': AccountLink.get_lettering_param(proposals)})
+            return
+        report = [six.text_type(report_line) for report_line in AccountLink.get_lettering_report(proposals)]
+        if self.confirme(_("Do you want to create %(nb)d links?{[br/]}%(report)s") % {'nb': len(proposals), 'report': '{[br/]}'.join(report)}):
+            AccountLink.create_lettering(year, proposals)
+
+
 @MenuManage.describ('accounting.add_third')
 class ThirdSave(XferContainerAcknowledge):
     icon = "thirds.png"
@@ -265,32 +290,15 @@ class ThirdListing(XferPrintListing):
     caption = _("Listing third")
 
     def filter_callback(self, items):
-        items = sorted(items, key=lambda t: six.text_type(t))
-        if (self.getparam('CRITERIA') is None) and (self.getparam('show_filter', 0) == 2):
-            items = [item for item in items if abs(item.get_total()) > 0.0001]
-        res = QuerySet(model=Third)
-        res._result_cache = items
-        return res
+        items = Third.annotate_total(items, (self.getparam('CRITERIA') is None) and (self.getparam('show_filter', 0) == 2))
+        return items.order_by('sort_name')
 
     def get_filter(self):
         if self.getparam('CRITERIA') is None:
             contact_filter = self.getparam('filter', '')
             thirdtype = self.getparam('thirdtype', 0)
             show_filter = self.getparam('show_filter', 0)
-            new_filter = Q(status=0)
-            if contact_filter != "":
-                q_legalentity = Q(contact__legalentity__name__icontains=contact_filter)
-                q_individual = (Q(contact__individual__firstname__icontains=contact_filter) | Q(
-                    contact__individual__lastname__icontains=contact_filter))
-                new_filter &= (q_legalentity | q_individual)
-            if thirdtype == 1:
-                new_filter &= Q(accountthird__code__regex=current_system_account().get_customer_mask())
-            elif thirdtype == 2:
-                new_filter &= Q(accountthird__code__regex=current_system_account().get_provider_mask())
-            elif thirdtype == 3:
-                new_filter &= Q(accountthird__code__regex=current_system_account().get_societary_mask())
-            elif thirdtype == 4:
-                new_filter &= Q(accountthird__code__regex=current_system_account().get_employed_mask())
+            new_filter = get_third_filter(contact_filter, thirdtype)
             if show_filter == 3:
                 new_filter &= Q(entrylineaccount__link__isnull=True)
         else:
@@ -444,7 +452,7 @@ def thirdaddon_accounting(item, xfer):
             edt.set_action(xfer.request, xfer.get_action(),
                            modal=FORMTYPE_REFRESH, close=CLOSE_NO)
             xfer.add_component(edt)
-            entrulines = EntryLineAccount.objects.filter(entry_lines_filter).distinct()
+            entrulines = EntryLineAccount.objects.filter(entry_lines_filter).select_related('link').distinct()
             link_grid_lines = XferCompGrid('entryline')
             link_grid_lines.set_model(entrulines, EntryLineAccount.get_default_fields(), xfer)
             link_grid_lines.set_location(0, 2, 2)
@@ -80,6 +80,9 @@ class ChartsAccountList(XferListEditor):
         if select_type != -1:
             self.filter &= Q(type_of_account=select_type)
 
+    def get_items_from_filter(self):
+        return ChartsAccount.get_items_with_totals(XferListEditor.get_items_from_filter(self))
+
     def fillresponse(self):
         XferListEditor.fillresponse(self)
         add_fiscalyear_result(self, 0, 10, 2, self.item.year, "result")
@@ -218,6 +221,9 @@ class ChartsAccountListing(XferPrintListing):
             new_filter = XferPrintListing.get_filter(self)
         return new_filter
 
+    def filter_callback(self, items):
+        return ChartsAccount.get_items_with_totals(items)
+
     def fillresponse(self):
         self.caption = _("Listing charts of account") + " - " + formats.date_format(date.today(), "DATE_FORMAT")
         if self.getparam('CRITERIA') is None:
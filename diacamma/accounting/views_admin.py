@@ -40,7 +40,7 @@ from lucterios.CORE.models import Parameter
 from diacamma.accounting.models import FiscalYear, Journal, AccountThird, ChartsAccount, ModelLineEntry,\
     Third
 from diacamma.accounting.system import accounting_system_list, accounting_system_name
-from diacamma.accounting.tools import clear_system_account, correct_accounting_code,\
+from diacamma.accounting.tools import clear_system_account, clear_accounting_cache, ParamsSnapshot, correct_accounting_code,\
     current_system_account
 from django.utils import six
 from lucterios.contacts.models import CustomField
@@ -266,6 +266,9 @@ class JournalDefault(XferContainerAcknowledge):
 
 @signal_and_lock.Signal.decorate('param_change')
 def paramchange_accounting(params):
+    ParamsSnapshot.clear()
+    if ('accounting-sizecode' in params) or ('accounting-devise-iso' in params) or ('accounting-devise-prec' in params):
+        clear_accounting_cache()
     if 'accounting-sizecode' in params:
         for account in AccountThird.objects.all():
             if account.code != correct_accounting_code(account.code):
@@ -279,6 +282,8 @@ def paramchange_accounting(params):
             if model_line.code != correct_accounting_code(model_line.code):
                 model_line.code = correct_accounting_code(model_line.code)
                 model_line.save()
+    if 'accounting-system' in params:
+        ChartsAccount.update_classification()
 
 
 @signal_and_lock.Signal.decorate('conf_wizard')
@@ -17,8 +17,9 @@ from lucterios.framework.tools import SELECT_SINGLE
 from lucterios.framework.signal_and_lock import Signal
 from lucterios.CORE.xferprint import XferPrintAction
 
-from diacamma.accounting.tools import current_system_account, format_with_devise
-from diacamma.accounting.models import Budget, CostAccounting, FiscalYear, ChartsAccount, EntryLineAccount
+from diacamma.accounting.tools import current_system_account, format_with_devise, get_amount_sum
+from diacamma.accounting.models import Budget, CostAccounting, FiscalYear, ChartsAccount, ClosedYearBalance
+from diacamma.accounting.system import get_mask_filter
 from django.db.models.aggregates import Sum
 
 
@@ -54,41 +55,34 @@ class BudgetList(XferListEditor):
             self.filter &= Q(cost_accounting_id=self.getparam('cost_accounting'))
 
     def fill_grid(self, row, model, field_id, items):
-        XferListEditor.fill_grid(self, row, model, field_id, items)
+        if not hasattr(self, 'chart_accounts'):
+            self.chart_accounts = ChartsAccount.get_chart_accounts_map()
         if self.getparam('cost_accounting') is None:
+            XferListEditor.fill_grid(self, row, model, field_id, items.none())
             grid = self.get_components(field_id)
             grid.record_ids = []
             grid.records = {}
-            last_code = ''
-            value = 0
-            for current_budget in items:
-                if last_code != current_budget.code:
-                    if last_code != '':
-                        chart = ChartsAccount.get_chart_account(last_code)
-                        grid.set_value('C' + last_code, 'budget', six.text_type(chart))
-                        grid.set_value('C' + last_code, 'montant', value)
-                        value = 0
-                    last_code = current_budget.code
-                value += current_budget.credit_debit_way() * current_budget.amount
-            if last_code != '':
-                chart = ChartsAccount.get_chart_account(last_code)
-                grid.set_value('C' + last_code, 'budget', six.text_type(chart))
-                grid.set_value('C' + last_code, 'montant', value)
+            for budget_line in items.order_by('code').values('code').annotate(data_sum=Sum('amount')):
+                chart = ChartsAccount.get_chart_account(budget_line['code'], self.chart_accounts)
+                grid.set_value('C' + budget_line['code'], 'budget', six.text_type(chart))
+                grid.set_value('C' + budget_line['code'], 'montant', Budget(code=budget_line['code']).credit_debit_way() * budget_line['data_sum'])
             grid.nb_lines = len(grid.records)
             grid.order_list = None
             grid.page_max = 1
             grid.page_num = 0
+        else:
+            XferListEditor.fill_grid(self, row, model, field_id, items)
 
     def fillresponse_body(self):
         self.get_components("title").colspan = 2
         row_id = self.get_max_row() + 1
 
-        expense_filter = Q(code__regex=current_system_account().get_expence_mask()) | (Q(code__regex=current_system_account().get_annexe_mask()) & Q(amount__lt=0))
+        expense_filter = get_mask_filter(current_system_account().get_expence_mask()) | (get_mask_filter(current_system_account().get_annexe_mask()) & Q(amount__lt=0))
         self.fill_grid(row_id, self.model, 'budget_expense', self.model.objects.filter(self.filter & expense_filter).distinct())
         self.get_components("budget_expense").colspan = 3
         self.get_components("budget_expense").description = _("Expense")
 
-        revenue_filter = Q(code__regex=current_system_account().get_revenue_mask()) | (Q(code__regex=current_system_account().get_annexe_mask()) & Q(amount__gte=0))
+        revenue_filter = get_mask_filter(current_system_account().get_revenue_mask()) | (get_mask_filter(current_system_account().get_annexe_mask()) & Q(amount__gte=0))
         self.fill_grid(row_id + 1, self.model, 'budget_revenue', self.model.objects.filter(self.filter & revenue_filter).distinct())
         self.get_components("budget_revenue").colspan = 3
         self.get_components("budget_revenue").description = _("Revenue")
@@ -265,27 +259,33 @@ class BudgetImport(XferContainerAcknowledge):
                 budget_filter = Q(year_id=year)
             else:
                 budget_filter = Q(cost_accounting_id=cost_accounting)
-            for budget_line in Budget.objects.filter(budget_filter).distinct():
-                if (cost_accounting != 0) or (budget_line.cost_accounting_id is None):
-                    budget_line.delete()
             if cost_accounting == 0:
-                for chart in ChartsAccount.objects.filter(Q(year_id=currentyear) & Q(type_of_account__in=(3, 4))).distinct():
-                    value = chart.get_current_total(with_correction=False)
-                    for current_budget in Budget.objects.filter(year_id=year, code=chart.code):
-                        value -= current_budget.amount
+                budget_filter &= Q(cost_accounting__isnull=True)
+            Budget.objects.filter(budget_filter).delete()
+            new_budgets = []
+            if cost_accounting == 0:
+                values = {}
+                for budget_line in Budget.objects.filter(year_id=year).order_by('code').values('code').annotate(Sum('amount')):
+                    values[budget_line['code']] = get_amount_sum(budget_line)
+                for chart in ChartsAccount.get_items_with_totals(ChartsAccount.objects.filter(Q(year_id=currentyear) & Q(type_of_account__in=(3, 4))).distinct()):
+                    value = chart.get_current_total(with_correction=False) - values.get(chart.code, 0)
                     if abs(value) > 0.001:
-                        Budget.objects.create(code=chart.code, amount=value, year_id=year)
+                        new_budgets.append(Budget(code=chart.code, amount=value, year_id=year))
             else:
-                if year == 0:
+                current_cost = CostAccounting.objects.get(id=cost_accounting)
+                if current_cost.year_id is not None:
+                    year = current_cost.year_id
+                elif year == 0:
                     year = None
-                values = {}
-                for line in EntryLineAccount.objects.filter(account__type_of_account__in=(3, 4), costaccounting_id=costaccounting).distinct():
-                    if line.account.code not in values.keys():
-                        values[line.account.code] = 0.0
-                    values[line.account.code] += line.amount
-                for code, value in values.items():
+                lines_filter = Q(account__type_of_account__in=(3, 4)) & Q(costaccounting_id=costaccounting)
+                last_cost = CostAccounting.objects.filter(id=costaccounting).select_related('year').first()
+                if (last_cost is not None) and (last_cost.year is not None) and (last_cost.year.status == 2):
+                    lines_filter &= Q(entry__year_id=last_cost.year_id)
+                for line in ClosedYearBalance.get_lines(lines_filter).order_by('account__code').values('account__code').annotate(Sum('amount')):
+                    value = get_amount_sum(line)
                     if abs(value) > 0.001:
-                        Budget.objects.create(code=code, amount=value, year_id=year, cost_accounting_id=cost_accounting)
+                        new_budgets.append(Budget(code=line['account__code'], amount=value, year_id=year, cost_accounting_id=cost_accounting))
+            Budget.bulk_create_budgets(new_budgets)
 
 
 @ActionsManage.affect_list(_("Budget"), "account.png")
@@ -23,9 +23,12 @@ along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
 
 from __future__ import unicode_literals
 from datetime import date
+from hashlib import sha256
 
 from django.utils.translation import ugettext_lazy as _
+from django.apps import apps
 from django.utils import formats, six
+from django.db import transaction
 from django.db.models import Q, F
 from django.db.models.expressions import Case, When, ExpressionWrapper
 from django.db.models.fields import DecimalField
@@ -34,7 +37,7 @@ from django.db.models.aggregates import Count
 from lucterios.framework.xferadvance import XferShowEditor, XferDelete, XferSave, TITLE_LISTING, TITLE_DELETE, TITLE_OK, TITLE_CANCEL, TITLE_CLOSE, TITLE_MODIFY,\
     TITLE_EDIT, TITLE_ADD
 from lucterios.framework.tools import FORMTYPE_NOMODAL, CLOSE_NO, FORMTYPE_REFRESH, SELECT_SINGLE, SELECT_MULTI, SELECT_NONE, CLOSE_YES
-from lucterios.framework.tools import ActionsManage, MenuManage, WrapAction
+from lucterios.framework.tools import ActionsManage, MenuManage, WrapAction, get_format_from_field
 from lucterios.framework.xferadvance import action_list_sorted
 from lucterios.framework.xferadvance import XferListEditor, XferAddEditor
 from lucterios.framework.xfergraphic import XferContainerAcknowledge, XferContainerCustom
@@ -45,7 +48,8 @@ from lucterios.CORE.editors import XferSavedCriteriaSearchEditor
 from lucterios.CORE.parameters import Params
 from lucterios.CORE.views import ObjectImport
 
-from diacamma.accounting.models import EntryLineAccount, EntryAccount, FiscalYear, Journal, AccountLink, current_system_account, CostAccounting, ModelEntry
+from diacamma.accounting.models import EntryLineAccount, EntryAccount, FiscalYear, Journal, AccountLink, current_system_account, CostAccounting, ModelEntry,\
+    ImportJob, ImportedContent
 
 
 def add_fiscalyear_result(xfer, col, row, colspan, year, comp_name):
@@ -77,7 +81,7 @@ class EntryAccountList(XferListEditor):
 
     def get_items_from_filter(self):
         items = XferListEditor.get_items_from_filter(self)
-        items = items.annotate(num_link=Count('entry__entrylineaccount__link'))
+        items = items.annotate(num_link=Count('entry__entrylineaccount__link')).select_related('link')
         items = items.annotate(cdway=Case(When(account__type_of_account__in=(0, 4), then=-1), default=1, output_field=DecimalField()))
         items = items.annotate(credit_num=ExpressionWrapper(F('amount') * F('cdway'), output_field=DecimalField()), debit_num=ExpressionWrapper(-1 * F('amount') * F('cdway'), output_field=DecimalField()))
         if self.select_filter == 3:
@@ -220,7 +224,7 @@ class EntryAccountListing(XferPrintListing):
         return new_filter
 
     def filter_callback(self, items):
-        items = items.annotate(num_link=Count('entry__entrylineaccount__link'))
+        items = items.annotate(num_link=Count('entry__entrylineaccount__link')).select_related('link')
         if self.select_filter == 3:
             items = items.filter(Q(num_link__gt=0)).distinct()
         elif self.select_filter == 4:
@@ -243,12 +247,189 @@ class EntryAccountListing(XferPrintListing):
         XferPrintListing.fillresponse(self)
 
 
+class CheckpointedImport(ObjectImport):
+    import_batch_size = 1000
+    skip_duplicate = False
+
+    def __init__(self, **kwargs):
+        ObjectImport.__init__(self, **kwargs)
+        self.import_job = None
+        self.nb_skipped = 0
+
+    @transaction.non_atomic_requests
+    def dispatch(self, request, *args, **kwargs):
+        return ObjectImport.dispatch(self, request, *args, **kwargs)
+
+    def _get_fields_description(self):
+        fields_association = {}
+        for param_key in self.params.keys():
+            if (param_key[:4] == 'fld_') and (self.params[param_key] != ""):
+                fields_association[param_key[4:]] = self.params[param_key]
+        fields_description = []
+        for fieldname in self.model.get_import_fields():
+            format_str = "%s"
+            if isinstance(fieldname, tuple):
+                fieldname, title = fieldname
+                hfield = None
+            else:
+                dep_field = self.model.get_field_by_name(fieldname)
+                title = dep_field.verbose_name
+                hfield = get_format_from_field(dep_field)
+                if isinstance(hfield, six.text_type) and (';' in hfield):
+                    hfield = hfield.split(';')
+                    format_str = ";".join(hfield[1:])
+                    hfield = hfield[0]
+            if fieldname in fields_association.keys():
+                fields_description.append((fieldname, title, hfield, format_str))
+        return fields_association, fields_description
+
+    def _get_job_hash(self):
+        job_hash = sha256()
+        for param_key in sorted(self.params.keys()):
+            if param_key != 'step':
+                job_hash.update(("%s=%s\n" % (param_key, self.params[param_key])).encode('utf-8'))
+        return job_hash.hexdigest()
+
+    def _get_import_group(self, rowdata):
+        return None
+
+    def _read_groups(self, fields_association, fields_description):
+        occurrences = {}
+
+        def get_group(group_rows, group_contents):
+            content_hash = sha256("\n".join(group_contents).encode('utf-8')).hexdigest()
+            occurrences[content_hash] = occurrences.get(content_hash, 0) + 1
+            return group_rows, sha256(("%s#%s#%d" % (self.import_job.job_hash, content_hash, occurrences[content_hash])).encode('utf-8')).hexdigest()
+        group_key = None
+        group_rows = []
+        group_contents = []
+        for row in self.spamreader:
+            if row[self.spamreader.fieldnames[0]] is not None:
+                rowdata = self._convert_record(fields_association, fields_description, row)
+                row_key = self._get_import_group(rowdata)
+                if (len(group_rows) > 0) and ((row_key is None) or (row_key != group_key)):
+                    yield get_group(group_rows, group_contents)
+                    group_rows = []
+                    group_contents = []
+                group_key = row_key
+                group_rows.append(rowdata)
+                group_contents.append(";".join(["%s=%s" % (key, row[fields_association[key]] if key in fields_association else rowdata[key]) for key in sorted(rowdata.keys())]))
+        if len(group_rows) > 0:
+            yield get_group(group_rows, group_contents)
+
+    def _finalize_group(self):
+        return None
+
+    def _import_batch(self, batch, offset, dateformat, finished=False):
+        def add_item_if_not_null(new_item):
+            if new_item is not None:
+                items_imported[new_item.id] = new_item
+                group_items.append(new_item)
+        modelname = self.model.get_long_name()
+        items_imported = {}
+        content_items = []
+        nb_skipped = 0
+        with transaction.atomic():
+            if self.skip_duplicate:
+                known_hashes = ImportedContent.get_known_hashes(modelname, [content_hash for _group_rows, content_hash in batch])
+            else:
+                known_hashes = set()
+            self.model.initialize_import()
+            for group_rows, content_hash in batch:
+                if content_hash in known_hashes:
+                    nb_skipped += len(group_rows)
+                else:
+                    group_items = []
+                    for rowdata in group_rows:
+                        add_item_if_not_null(self.model.import_data(rowdata, dateformat))
+                    add_item_if_not_null(self._finalize_group())
+                    if len(group_items) > 0:
+                        content_items.append((content_hash, group_items))
+            group_items = []
+            add_item_if_not_null(self.model.finalize_import())
+            if self.skip_duplicate:
+                ImportedContent.add_hashes(modelname, content_items)
+            self.import_job.checkpoint(offset, len(items_imported), nb_skipped, finished)
+        self.items_imported.update(items_imported)
+        self.nb_skipped += nb_skipped
+
+    def _import_by_batch(self, dateformat):
+        fields_association, fields_description = self._get_fields_description()
+        self._read_csv()
+        self.import_job = ImportJob.get_or_start(self.model.get_long_name(), self._get_job_hash())
+        self.items_imported = {}
+        self.nb_skipped = 0
+        batch = []
+        batch_size = 0
+        offset = 0
+        for group_rows, content_hash in self._read_groups(fields_association, fields_description):
+            offset += len(group_rows)
+            if offset > self.import_job.offset:
+                batch.append((group_rows, content_hash))
+                batch_size += len(group_rows)
+                if batch_size >= self.import_batch_size:
+                    self._import_batch(batch, offset, dateformat)
+                    batch = []
+                    batch_size = 0
+        self._import_batch(batch, offset, dateformat, True)
+
+    def fillresponse(self, modelname, quotechar="'", delimiter=";", encoding="utf-8", dateformat="%d/%m/%Y", step=0):
+        if step != 3:
+            ObjectImport.fillresponse(self, modelname, quotechar, delimiter, encoding, dateformat, step)
+            return
+        if modelname is not None:
+            self.model = apps.get_model(modelname)
+        self.quotechar = quotechar
+        self.delimiter = delimiter
+        self.encoding = encoding
+        self.dateformat = dateformat
+        img = XferCompImage('img')
+        img.set_value(self.icon_path())
+        img.set_location(0, 0, 1, 6)
+        self.add_component(img)
+        self._import_by_batch(dateformat)
+        lbl = XferCompLabelForm('result')
+        lbl.set_value_as_header(_("%d items are been imported") % len(self.items_imported))
+        lbl.set_location(1, 2, 2)
+        self.add_component(lbl)
+        if self.nb_skipped > 0:
+            lbl = XferCompLabelForm('skipped')
+            lbl.set_value_center(_("%d rows already imported are skipped") % self.nb_skipped)
+            lbl.set_location(1, 3, 2)
+            self.add_component(lbl)
+        self.add_action(WrapAction(_("Close"), "images/close.png"))
+
+
+@MenuManage.describ('accounting.add_entryaccount')
+class ImportJobList(XferListEditor):
+    icon = "entry.png"
+    model = ImportJob
+    field_id = 'importjob'
+    caption = _("Import jobs")
+
+    def fillresponse_header(self):
+        self.filter = Q()
+        modelname = self.getparam('modelname', '')
+        if modelname != '':
+            self.filter &= Q(modelname=modelname)
+        status = self.getparam('status', -1)
+        if status != -1:
+            self.filter &= Q(status=status)
+
+
 @ActionsManage.affect_list(_('Import'), "images/new.png")
 @MenuManage.describ('accounting.add_entryaccount')
-class EntryAccountImport(ObjectImport):
+class EntryAccountImport(CheckpointedImport):
     icon = "entry.png"
     model = EntryAccount
     caption = _("Accounting entries import")
+    skip_duplicate = True
+
+    def _get_import_group(self, rowdata):
+        return (rowdata['entry.date_value'], rowdata['entry.designation'])
+
+    def _finalize_group(self):
+        return self.model.finalize_import_group()
 
     def _convert_record(self, fields_association, fields_description, row):
         new_row = ObjectImport._convert_record(self, fields_association, fields_description, row)
@@ -275,7 +456,7 @@ class EntryAccountImport(ObjectImport):
     def fillresponse(self, quotechar="'", delimiter=";", encoding="utf-8", dateformat="%d/%m/%Y", step=0):
         self.select_year = self.getparam('year')
         self.select_journal = self.getparam('journal', 4)
-        ObjectImport.fillresponse(self, "accounting.EntryLineAccount", quotechar, delimiter, encoding, dateformat, step)
+        CheckpointedImport.fillresponse(self, "accounting.EntryLineAccount", quotechar, delimiter, encoding, dateformat, step)
         self.change_gui()
         if step == 3:
             grid = XferCompGrid("entryline")
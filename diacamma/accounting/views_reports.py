@@ -24,14 +24,16 @@ along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
 from __future__ import unicode_literals
 import sys
 import re
+from copy import copy
 from datetime import date, datetime
 
 from django.utils.translation import ugettext_lazy as _
-from django.db.models import Q
+from django.db.models import Q, F, Value, Case, When, FloatField
 from django.db.models.aggregates import Sum
 from django.utils import six, formats
 
-from lucterios.framework.tools import MenuManage, FORMTYPE_NOMODAL, CLOSE_NO, FORMTYPE_REFRESH, WrapAction, convert_date, ActionsManage, SELECT_MULTI
+from lucterios.framework.tools import MenuManage, FORMTYPE_NOMODAL, CLOSE_NO, FORMTYPE_REFRESH, WrapAction, convert_date, ActionsManage, SELECT_MULTI,\
+    adapt_value, format_to_string, extract_format, get_format_from_field
 from lucterios.framework.xfergraphic import XferContainerCustom
 from lucterios.framework.xfercomponents import XferCompImage, XferCompSelect, XferCompLabelForm, XferCompGrid, XferCompEdit, XferCompCheck
 from lucterios.framework.xferadvance import TITLE_PRINT, TITLE_CLOSE
@@ -39,9 +41,11 @@ from lucterios.contacts.models import LegalEntity
 from lucterios.CORE.parameters import Params
 from lucterios.CORE.xferprint import XferPrintAction
 
-from diacamma.accounting.models import FiscalYear, EntryLineAccount, ChartsAccount, CostAccounting, Third
+from diacamma.accounting.models import FiscalYear, EntryAccount, EntryLineAccount, CostAccounting, Third, ClosedYearBalance, Budget, ChartsAccount
 from diacamma.accounting.tools import correct_accounting_code, current_system_account, format_with_devise
-from diacamma.accounting.tools_reports import get_spaces, convert_query_to_account, add_cell_in_grid, fill_grid, add_item_in_grid
+from diacamma.accounting.system import get_mask_filter
+from diacamma.accounting.tools_reports import get_spaces, convert_query_to_account, add_cell_in_grid, fill_grid, add_item_in_grid,\
+    convert_values_to_account, get_totalaccount_for_lines, get_totalbudget_for_lines, match_query, StreamedGrid
 from diacamma.accounting.views_entries import add_fiscalyear_result
 
 MenuManage.add_sub("bookkeeping_report", "financial", "diacamma.accounting/images/accounting.png", _("Reports"), _("Report of Bookkeeping"), 30)
@@ -225,11 +229,13 @@ class FiscalYearReport(XferContainerCustom):
             self._add_result_line(totalb_left, line_idx, pos_n, pos_n_1, pos_b)
         return line_idx
 
+    def convert_to_account(self, account_filter, budgetfilter, sign_value=None):
+        return convert_query_to_account(self.filter & account_filter, self.lastfilter & account_filter if self.lastfilter is not None else None,
+                                        budgetfilter, sign_value=sign_value)
+
     def _add_left_right_accounting(self, left_filter, rigth_filter, total_in_left):
-        data_line_left, total1_left, total2_left, totalb_left = convert_query_to_account(
-            self.filter & left_filter, self.lastfilter & left_filter if self.lastfilter is not None else None, self.budgetfilter_left)
-        data_line_right, total1_right, total2_right, totalb_right = convert_query_to_account(
-            self.filter & rigth_filter, self.lastfilter & rigth_filter if self.lastfilter is not None else None, self.budgetfilter_right)
+        data_line_left, total1_left, total2_left, totalb_left = self.convert_to_account(left_filter, self.budgetfilter_left)
+        data_line_right, total1_right, total2_right, totalb_right = self.convert_to_account(rigth_filter, self.budgetfilter_right)
         line_idx = 0
         for line_idx in range(max(len(data_line_left), len(data_line_right))):
             if line_idx < len(data_line_left):
@@ -329,16 +335,10 @@ class FiscalYearIncomeStatement(FiscalYearReport):
 
     def show_annexe(self, line_idx, budgetfilter):
         add_cell_in_grid(self.grid, self.line_offset + line_idx + 1, 'left', '')
-        other_filter = Q(account__code__regex=current_system_account().get_annexe_mask())
-        budget_other = Q(code__regex=current_system_account().get_annexe_mask())
-        data_line_left, anx_total1_left, anx_total2_left, anx_totalb_left = convert_query_to_account(self.filter & other_filter,
-                                                                                                     self.lastfilter & other_filter if self.lastfilter is not None else None,
-                                                                                                     budgetfilter & budget_other,
-                                                                                                     sign_value=-1)
-        data_line_right, anx_total1_right, anx_total2_right, anx_totalb_right = convert_query_to_account(self.filter & other_filter,
-                                                                                                         self.lastfilter & other_filter if self.lastfilter is not None else None,
-                                                                                                         budgetfilter & budget_other,
-                                                                                                         sign_value=1)
+        other_filter = Q(account__is_annexe=True)
+        budget_other = get_mask_filter(current_system_account().get_annexe_mask())
+        data_line_left, anx_total1_left, anx_total2_left, anx_totalb_left = self.convert_to_account(other_filter, budgetfilter & budget_other, sign_value=-1)
+        data_line_right, anx_total1_right, anx_total2_right, anx_totalb_right = self.convert_to_account(other_filter, budgetfilter & budget_other, sign_value=1)
         if (len(data_line_left) > 0) or (len(data_line_right) > 0):
             add_cell_in_grid(self.grid, self.line_offset + line_idx + 1, 'left', get_spaces(20) + "{[i]}%s{[/i]}" % _('annexe'))
             add_cell_in_grid(self.grid, self.line_offset + line_idx + 1, 'right', get_spaces(20) + "{[i]}%s{[/i]}" % _('annexe'))
@@ -370,8 +370,8 @@ class FiscalYearIncomeStatement(FiscalYearReport):
         return max_line_idx + 1 - self.line_offset
 
     def calcul_table(self):
-        self.budgetfilter_right = Q(year=self.item) & Q(code__regex=current_system_account().get_revenue_mask())
-        self.budgetfilter_left = Q(year=self.item) & Q(code__regex=current_system_account().get_expence_mask())
+        self.budgetfilter_right = Q(year=self.item) & get_mask_filter(current_system_account().get_revenue_mask())
+        self.budgetfilter_left = Q(year=self.item) & get_mask_filter(current_system_account().get_expence_mask())
         line_idx = self._add_left_right_accounting(Q(account__type_of_account=4), Q(account__type_of_account=3), True)
         self.show_annexe(line_idx, Q(year=self.item))
 
@@ -381,13 +381,13 @@ class FiscalYearLedger(FiscalYearReport):
     caption = _("Ledger")
     add_filtering = True
     force_date_filter = True
+    chunk_size = 2000
+    accounts_by_page = 25
 
     def __init__(self, **kwargs):
         FiscalYearReport.__init__(self, **kwargs)
-        self.last_account = None
-        self.last_third = None
-        self.last_total = [0.0, 0.0]
         self.line_idx = 1
+        self.only_nonull = False
 
     def fill_filterCode(self):
         row = self.get_max_row() + 1
@@ -412,7 +412,10 @@ class FiscalYearLedger(FiscalYearReport):
         FiscalYearReport.fill_filterCode(self)
 
     def define_gridheader(self):
-        self.grid = XferCompGrid('report_%d' % self.item.id)
+        if self.getparam('PRINTING', False):
+            self.grid = StreamedGrid('report_%d' % self.item.id)
+        else:
+            self.grid = XferCompGrid('report_%d' % self.item.id)
         self.grid.add_header('entry.num', _('numeros'))
         self.grid.add_header('entry.date_entry', _('date entry'))
         self.grid.add_header('entry.date_value', _('date value'))
@@ -421,53 +424,129 @@ class FiscalYearLedger(FiscalYearReport):
         self.grid.add_header('debit', _('debit'), self.hfield, formatstr=';'.join([self.format_str, self.format_str, '']))
         self.grid.add_header('credit', _('credit'), self.hfield, formatstr=';'.join([self.format_str, self.format_str, '']))
 
-    def _add_total_account(self):
-        if self.last_account is not None:
-            add_cell_in_grid(self.grid, self.line_offset + self.line_idx, 'entry.designation', get_spaces(30) + "{[i]}%s{[/i]}" % _('total'))
-            if self.last_account.credit_debit_way() == -1:
-                add_cell_in_grid(self.grid, self.line_offset + self.line_idx, 'debit', self.last_total[0], "{[i]}%s{[/i]}")
-                add_cell_in_grid(self.grid, self.line_offset + self.line_idx, 'credit', self.last_total[1], "{[i]}%s{[/i]}")
+    def _get_total_account_rows(self, account, total, opening):
+        if account.credit_debit_way() == -1:
+            total_debit, total_credit = total
+        else:
+            total_credit, total_debit = total
+        yield [('entry.designation', get_spaces(30) + "{[i]}%s{[/i]}" % _('total'), '%s'),
+               ('debit', total_debit, "{[i]}%s{[/i]}"),
+               ('credit', total_credit, "{[i]}%s{[/i]}")]
+        balance = opening + total[0] - total[1]
+        yield [('entry.designation', get_spaces(30) + "{[u]}{[i]}%s{[/i]}{[/u]}" % _('balance'), '%s'),
+               ('debit', max((0, -1 * account.credit_debit_way() * balance)), "{[u]}{[i]}%s{[/i]}{[/u]}"),
+               ('credit', max((0, account.credit_debit_way() * balance)), "{[u]}{[i]}%s{[/i]}{[/u]}")]
+        yield [('entry.designation', '{[br/]}', '%s')]
+
+    def _get_opening_account_row(self, account, opening):
+        return [('entry.designation', get_spaces(30) + "{[i]}%s{[/i]}" % _('opening balance'), '%s'),
+                ('debit', max((0, -1 * account.credit_debit_way() * opening)), "{[i]}%s{[/i]}"),
+                ('credit', max((0, account.credit_debit_way() * opening)), "{[i]}%s{[/i]}")]
+
+    def get_account_totals(self):
+        return list(EntryLineAccount.objects.filter(self.filter).order_by('account__code').values('account', 'account__code').annotate(
+            total_positif=Sum(Case(When(amount__gt=0, then=F('amount')), default=Value(0.0), output_field=FloatField())),
+            total_negatif=Sum(Case(When(amount__lt=0, then=F('amount')), default=Value(0.0), output_field=FloatField()))))
+
+    def get_opening_filter(self):
+        opening_filter = Q(entry__year=self.item) & Q(entry__date_value__lt=self.item.begin)
+        if self.only_nonull:
+            opening_filter &= Q(link__isnull=True) & Q(third__isnull=False)
+        return opening_filter
+
+    def get_account_openings(self, account_ids):
+        opening_filter = self.get_opening_filter()
+        if opening_filter is None:
+            return {}
+        if account_ids is not None:
+            opening_filter &= Q(account_id__in=account_ids)
+        openings = {}
+        for data_line in EntryLineAccount.objects.filter(opening_filter).order_by('account').values('account').annotate(data_sum=Sum('amount')):
+            openings[data_line['account']] = data_line['data_sum']
+        return openings
+
+    def get_ledger_lines(self, account_ids=None):
+        entrylines = EntryLineAccount.objects.filter(self.filter)
+        if account_ids is not None:
+            entrylines = entrylines.filter(account_id__in=account_ids)
+        entrylines = entrylines.distinct().order_by('account__code', 'third', 'entry__date_value')
+        entrylines = entrylines.select_related('account', 'entry', 'link', 'third', 'third__contact', 'third__contact__legalentity', 'third__contact__individual')
+        return entrylines.iterator(chunk_size=self.chunk_size)
+
+    def get_ledger_columns(self):
+        columns = []
+        for header in self.grid.headers:
+            if header.name.startswith('entry.'):
+                field_name = header.name[len('entry.'):]
+                formatnum, formatstr = extract_format(get_format_from_field(EntryAccount.get_field_by_name(field_name)))
+                columns.append((header.name, field_name, formatnum, formatstr))
             else:
-                add_cell_in_grid(self.grid, self.line_offset + self.line_idx, 'debit', self.last_total[1], "{[i]}%s{[/i]}")
-                add_cell_in_grid(self.grid, self.line_offset + self.line_idx, 'credit', self.last_total[0], "{[i]}%s{[/i]}")
-            self.line_idx += 1
-            last_total = self.last_total[0] - self.last_total[1]
-            add_cell_in_grid(self.grid, self.line_offset + self.line_idx, 'entry.designation', get_spaces(30) + "{[u]}{[i]}%s{[/i]}{[/u]}" % _('balance'))
-            add_cell_in_grid(self.grid, self.line_offset + self.line_idx, 'debit', max((0, -1 * self.last_account.credit_debit_way() * last_total)), "{[u]}{[i]}%s{[/i]}{[/u]}")
-            add_cell_in_grid(self.grid, self.line_offset + self.line_idx, 'credit', max((0, self.last_account.credit_debit_way() * last_total)), "{[u]}{[i]}%s{[/i]}{[/u]}")
-            self.line_idx += 1
-            add_cell_in_grid(self.grid, self.line_offset + self.line_idx, 'entry.designation', '{[br/]}')
-            self.line_idx += 1
-            self.last_total = [0.0, 0.0]
+                columns.append((header.name, None, None, None))
+        return columns
+
+    def get_ledger_rows(self, account_totals=None):
+        if account_totals is None:
+            account_totals = self.get_account_totals()
+            account_ids = None
+        else:
+            account_ids = [account_total['account'] for account_total in account_totals]
+        totals = {account_total['account']: (account_total['total_positif'], 0.0 - account_total['total_negatif']) for account_total in account_totals}
+        openings = self.get_account_openings(account_ids)
+        columns = self.get_ledger_columns()
+        last_account = None
+        last_third_id = None
+        for line in self.get_ledger_lines(account_ids):
+            if (last_account is None) or (last_account.id != line.account_id):
+                if last_account is not None:
+                    for row in self._get_total_account_rows(last_account, totals[last_account.id], openings.get(last_account.id, 0.0)):
+                        yield row
+                last_account = line.account
+                last_third_id = None
+                yield [('entry.designation', get_spaces(15) + "{[u]}{[b]}%s{[/b]}{[/u]}" % six.text_type(last_account), '%s')]
+                if abs(openings.get(last_account.id, 0.0)) > 0.0001:
+                    yield self._get_opening_account_row(last_account, openings[last_account.id])
+            if last_third_id != line.third_id:
+                yield [('entry.designation', get_spaces(8) + "{[b]}%s{[/b]}" % six.text_type(line.entry_account), '%s')]
+            last_third_id = line.third_id
+            row = []
+            for column_name, entry_field, formatnum, formatstr in columns:
+                if entry_field is None:
+                    value = getattr(line, column_name)
+                else:
+                    value = format_to_string(adapt_value(getattr(line.entry, entry_field)), formatnum, formatstr)
+                row.append((column_name, value, '%s'))
+            yield row
+        if last_account is not None:
+            for row in self._get_total_account_rows(last_account, totals[last_account.id], openings.get(last_account.id, 0.0)):
+                yield row
+
+    def fill_account_page(self, account_totals):
+        pages = [account_totals[idx:idx + self.accounts_by_page] for idx in range(0, len(account_totals), self.accounts_by_page)]
+        page_name = 'ledger_page_%d' % self.item.id
+        page_num = min(max(0, self.getparam(page_name, 0)), len(pages) - 1)
+        sel = XferCompSelect(page_name)
+        sel.set_select([(idx, "%s - %s" % (correct_accounting_code(page[0]['account__code']), correct_accounting_code(page[-1]['account__code'])))
+                        for idx, page in enumerate(pages)])
+        sel.set_value(page_num)
+        sel.description = _('accounts')
+        sel.set_location(1, self.get_max_row() + 1, 3)
+        sel.set_action(self.request, self.__class__.get_action(), close=CLOSE_NO, modal=FORMTYPE_REFRESH)
+        self.add_component(sel)
+        return pages[page_num]
 
     def calcul_table(self):
+        if isinstance(self.grid, StreamedGrid):
+            # rows are read once, when the grid is printed: keep the filter of this grid
+            self.grid.rows_source = copy(self).get_ledger_rows
+            return
         self.line_idx = 1
-        self.last_account = None
-        self.last_third = None
-        self.last_total = [0.0, 0.0]
-        for line in EntryLineAccount.objects.filter(self.filter).distinct().order_by('account__code', 'third', 'entry__date_value'):
-            if self.last_account != line.account:
-                self._add_total_account()
-                self.last_account = line.account
-                self.last_third = None
-                add_cell_in_grid(self.grid, self.line_offset + self.line_idx, 'entry.designation', get_spaces(15) + "{[u]}{[b]}%s{[/b]}{[/u]}" % six.text_type(self.last_account))
-                self.line_idx += 1
-            if self.last_third != line.third:
-                add_cell_in_grid(self.grid, self.line_offset + self.line_idx, 'entry.designation', get_spaces(8) + "{[b]}%s{[/b]}" % six.text_type(line.entry_account))
-                self.line_idx += 1
-            self.last_third = line.third
-            for header in self.grid.headers:
-                if hasattr(line, header.name):
-                    value = getattr(line, header.name)
-                else:
-                    value = line.evaluate('#' + header.name)
-                add_cell_in_grid(self.grid, self.line_offset + self.line_idx, header.name, value)
-            if line.amount > 0:
-                self.last_total[0] += line.amount
-            else:
-                self.last_total[1] -= line.amount
+        account_totals = self.get_account_totals()
+        if len(account_totals) > self.accounts_by_page:
+            account_totals = self.fill_account_page(account_totals)
+        for row in self.get_ledger_rows(account_totals):
+            for colname, value, formttext in row:
+                add_cell_in_grid(self.grid, self.line_offset + self.line_idx, colname, value, formttext)
             self.line_idx += 1
-        self._add_total_account()
 
 
 @MenuManage.describ('accounting.change_fiscalyear', FORMTYPE_NOMODAL, 'bookkeeping_report', _('Show trial balance for current fiscal year'))
@@ -510,25 +589,32 @@ class FiscalYearTrialBalance(FiscalYearReport):
             fields = ['account', 'third']
         else:
             fields = ['account']
-        data_line_positifs = list(EntryLineAccount.objects.filter(self.filter & Q(amount__gt=0)).order_by(*fields).values(*fields).annotate(data_sum=Sum('amount')))
-        data_line_negatifs = list(EntryLineAccount.objects.filter(self.filter & Q(amount__lt=0)).order_by(*fields).values(*fields).annotate(data_sum=Sum('amount')))
-        for data_line in data_line_positifs + data_line_negatifs:
-            if abs(data_line['data_sum']) > 0.0001:
-                account = ChartsAccount.objects.get(id=data_line['account'])
-                account_code = correct_accounting_code(account.code)
-                if ('third' in data_line.keys()) and (data_line['third'] is not None):
-                    account_code = "%s#%s" % (account_code, data_line['third'])
-                if account_code not in balance_values.keys():
-                    if ('third' in data_line.keys()) and (data_line['third'] is not None):
-                        third = Third.objects.get(id=data_line['third'])
-                        account_title = "[%s %s]" % (account.code, six.text_type(third))
+        entrylines = ClosedYearBalance.get_lines(self.filter)
+        if self.with_third:
+            third_names = Third.get_names(entrylines.values('third'))
+        else:
+            third_names = {}
+        if entrylines.model == ClosedYearBalance:
+            data_sums = {'data_positif': Sum('amount_positive'), 'data_negatif': Sum('amount_negative')}
+        else:
+            data_sums = {'data_positif': Sum(Case(When(amount__gt=0, then=F('amount')), default=Value(0.0), output_field=FloatField())),
+                         'data_negatif': Sum(Case(When(amount__lt=0, then=F('amount')), default=Value(0.0), output_field=FloatField()))}
+        for data_line in entrylines.order_by(*fields).values(*fields, 'account__code', 'account__name', 'account__type_of_account').annotate(**data_sums):
+            account_code = correct_accounting_code(data_line['account__code'])
+            if ('third' in data_line.keys()) and (data_line['third'] is not None):
+                account_code = "%s#%s" % (account_code, data_line['third'])
+                account_title = "[%s %s]" % (data_line['account__code'], third_names[data_line['third']])
+            else:
+                account_title = "[%s] %s" % (correct_accounting_code(data_line['account__code']), data_line['account__name'])
+            way = -1 if data_line['account__type_of_account'] in (0, 4) else 1
+            for data_sum in (data_line['data_positif'], data_line['data_negatif']):
+                if abs(data_sum) > 0.0001:
+                    if account_code not in balance_values.keys():
+                        balance_values[account_code] = [account_title, 0, 0]
+                    if (way * data_sum) > 0.0001:
+                        balance_values[account_code][2] = way * data_sum
                     else:
-                        account_title = account.get_name()
-                    balance_values[account_code] = [account_title, 0, 0]
-                if (account.credit_debit_way() * data_line['data_sum']) > 0.0001:
-                    balance_values[account_code][2] = account.credit_debit_way() * data_line['data_sum']
-                else:
-                    balance_values[account_code][1] = -1 * account.credit_debit_way() * data_line['data_sum']
+                        balance_values[account_code][1] = -1 * way * data_sum
         return balance_values
 
     def calcul_table(self):
@@ -715,6 +801,7 @@ class CostAccountingIncomeStatement(CostAccountingReport, FiscalYearIncomeStatem
         self.lastfilter = True
         self.item = self.items[len(self.items) - 1]
         self.define_gridheader()
+        self.load_account_lines()
         for self.item in self.items:
             add_cell_in_grid(self.grid, self.line_offset, 'name', '{[b]}{[u]}%s{[/u]}{[/b]}' % self.item)
             self.line_offset += 1
@@ -773,11 +860,46 @@ class CostAccountingIncomeStatement(CostAccountingReport, FiscalYearIncomeStatem
         self.fill_buttons()
 
     def fill_filterheader(self):
-        if self.item.last_costaccounting is not None:
-            self.lastfilter = Q(costaccounting=self.item.last_costaccounting)
+        if self.item.last_costaccounting_id is not None:
+            self.lastfilter = Q(costaccounting=self.item.last_costaccounting_id)
         else:
             self.lastfilter = None
 
+    def load_account_lines(self):
+        self.account_lines = {}
+        self.budget_lines = {}
+        self.chart_accounts = None
+        item_ids = [item.id for item in self.items]
+        lines_filter = Q(costaccounting__in=item_ids)
+        if self.date_begin is not None:
+            lines_filter &= Q(entry__date_value__gte=self.date_begin)
+        if self.date_end is not None:
+            lines_filter &= Q(entry__date_value__lte=self.date_end)
+        if (self.date_begin is None) and (self.date_end is None):
+            lines_filter |= Q(costaccounting__in=[item.last_costaccounting_id for item in self.items if item.last_costaccounting_id is not None])
+            for data_line in Budget.objects.filter(cost_accounting__in=item_ids).order_by('cost_accounting', 'code').values('cost_accounting', 'code').annotate(data_sum=Sum('amount')):
+                self.budget_lines.setdefault(data_line['cost_accounting'], []).append(data_line)
+            if len(self.budget_lines) > 0:
+                self.chart_accounts = ChartsAccount.get_chart_accounts_map()
+        for data_line in ClosedYearBalance.get_lines(lines_filter).order_by('costaccounting', 'account').values('costaccounting', 'account', 'account__code', 'account__name',
+                                                                                                              'account__type_of_account', 'account__is_annexe').annotate(data_sum=Sum('amount')):
+            self.account_lines.setdefault(data_line['costaccounting'], []).append(data_line)
+
+    def convert_to_account(self, account_filter, budgetfilter, sign_value=None):
+        account_lines = [data_line for data_line in self.account_lines.get(self.item.id, []) if match_query(account_filter, data_line)]
+        account_values1 = get_totalaccount_for_lines(account_lines, sign_value)
+        if self.lastfilter is not None:
+            last_lines = [data_line for data_line in self.account_lines.get(self.item.last_costaccounting_id, []) if match_query(account_filter, data_line)]
+            account_values2 = get_totalaccount_for_lines(last_lines, sign_value)
+        else:
+            account_values2 = None
+        if budgetfilter is not None:
+            budget_lines = [data_line for data_line in self.budget_lines.get(self.item.id, []) if match_query(budgetfilter, data_line)]
+            budget_values = get_totalbudget_for_lines(budget_lines, self.chart_accounts)
+        else:
+            budget_values = None
+        return convert_values_to_account(account_values1, account_values2, budget_values)
+
     def calcul_table(self):
         if (self.date_begin is not None) or (self.date_end is not None):
             self.budgetfilter_right = None
@@ -788,8 +910,8 @@ class CostAccountingIncomeStatement(CostAccountingReport, FiscalYearIncomeStatem
             self.grid.delete_header('right_b')
             self.grid.delete_header('right_n_1')
         else:
-            self.budgetfilter_right = Q(cost_accounting=self.item) & Q(code__regex=current_system_account().get_revenue_mask())
-            self.budgetfilter_left = Q(cost_accounting=self.item) & Q(code__regex=current_system_account().get_expence_mask())
+            self.budgetfilter_right = Q(cost_accounting=self.item) & get_mask_filter(current_system_account().get_revenue_mask())
+            self.budgetfilter_left = Q(cost_accounting=self.item) & get_mask_filter(current_system_account().get_expence_mask())
         line_idx = self._add_left_right_accounting(Q(account__type_of_account=4), Q(account__type_of_account=3), True)
         self.show_annexe(line_idx, Q(cost_accounting=self.item))
 
@@ -809,6 +931,9 @@ class CostAccountingLedger(CostAccountingReport, FiscalYearLedger):
     def calcul_table(self):
         FiscalYearLedger.calcul_table(self)
 
+    def get_opening_filter(self):
+        return None
+
     def fill_filterCode(self):
         FiscalYearReport.fill_filterCode(self)
 
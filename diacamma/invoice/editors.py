@@ -40,7 +40,7 @@ from lucterios.framework.models import get_value_if_choices
 from lucterios.framework.filetools import save_from_base64, open_image_resize, get_user_path
 from lucterios.CORE.parameters import Params
 
-from diacamma.accounting.tools import current_system_account, format_with_devise
+from diacamma.accounting.tools import format_with_devise
 from diacamma.accounting.models import CostAccounting, FiscalYear, Third
 from diacamma.payoff.editors import SupportingEditor
 from diacamma.invoice.models import Provider, Category, CustomField, Article
@@ -55,7 +55,7 @@ class VatEditor(LucteriosEditor):
         sel_code = XferCompSelect("account")
         sel_code.description = old_account.description
         sel_code.set_location(old_account.col, old_account.row, old_account.colspan, old_account.rowspan)
-        for item in FiscalYear.get_current().chartsaccount_set.all().filter(code__regex=current_system_account().get_third_mask()).order_by('code'):
+        for item in FiscalYear.get_current().chartsaccount_set.all().filter(is_third=True).order_by('code'):
             sel_code.select_list.append((item.code, six.text_type(item)))
         sel_code.set_value(self.item.account)
         xfer.add_component(sel_code)
@@ -70,7 +70,7 @@ class AccountPostingEditor(LucteriosEditor):
         sel_code = XferCompSelect("sell_account")
         sel_code.description = old_account.description
         sel_code.set_location(old_account.col, old_account.row, old_account.colspan, old_account.rowspan)
-        for item in FiscalYear.get_current().chartsaccount_set.all().filter(code__regex=current_system_account().get_revenue_mask()).order_by('code'):
+        for item in FiscalYear.get_current().chartsaccount_set.all().filter(is_revenue=True).order_by('code'):
             sel_code.select_list.append((item.code, six.text_type(item)))
         sel_code.set_value(self.item.sell_account)
         xfer.add_component(sel_code)
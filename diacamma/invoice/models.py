@@ -52,7 +52,8 @@ from lucterios.contacts.models import CustomField, CustomizeObject
 
 from diacamma.accounting.models import FiscalYear, Third, EntryAccount, CostAccounting, Journal, EntryLineAccount, ChartsAccount, AccountThird
 from diacamma.accounting.tools import current_system_account, currency_round, correct_accounting_code,\
-    format_with_devise, get_amount_from_format_devise
+    format_with_devise, get_amount_from_format_devise, ParamsSnapshot
+from diacamma.accounting.system import get_mask_filter
 from diacamma.payoff.models import Supporting, Payoff, BankAccount
 
 
@@ -416,7 +417,7 @@ class Provider(LucteriosModel):
 
     @property
     def third_query(self):
-        thirdfilter = Q(accountthird__code__regex=current_system_account().get_provider_mask())
+        thirdfilter = get_mask_filter(current_system_account().get_provider_mask(), 'accountthird__code')
         return Third.objects.filter(thirdfilter).distinct()
 
     def __str__(self):
@@ -528,7 +529,7 @@ class Bill(Supporting):
         return get_value_if_choices(self.bill_type, self.get_field_by_name("bill_type")).upper()
 
     def get_total_ex(self):
-        if Params.getvalue("invoice-vat-mode") == 2:
+        if ParamsSnapshot.getvalue("invoice-vat-mode") == 2:
             return self.get_total_incltax()
         else:
             return self.get_total_excltax()
@@ -539,14 +540,14 @@ class Bill(Supporting):
     def get_min_payoff(self, ignore_payoff=-1):
         min_payoff = min(0, self.get_total_rest_topay(ignore_payoff) * 1.5)
         if abs(min_payoff) < 0.00001:
-            currency_decimal = Params.getvalue("accounting-devise-prec")
+            currency_decimal = ParamsSnapshot.getvalue("accounting-devise-prec")
             min_payoff = 1 * 10 ** (-1 * currency_decimal)
         return min_payoff
 
     def get_max_payoff(self, ignore_payoff=-1):
         max_payoff = max(self.get_total_rest_topay(ignore_payoff) * 1.5, 0)
         if abs(max_payoff) < 0.00001:
-            currency_decimal = Params.getvalue("accounting-devise-prec")
+            currency_decimal = ParamsSnapshot.getvalue("accounting-devise-prec")
             max_payoff = -1 * 10 ** (-1 * currency_decimal)
         return max_payoff
 
@@ -584,7 +585,7 @@ class Bill(Supporting):
         if (self.fiscal_year is None) or (self.num is None):
             return None
         else:
-            return "%s-%d" % (self.fiscal_year.letter, self.num)
+            return "%s-%d" % (FiscalYear.get_year_letter(self.fiscal_year_id), self.num)
 
     def get_vta_detail_list(self):
         vtas = {}
@@ -737,9 +738,9 @@ class Bill(Supporting):
             detail_item = detail_list[detail_key]
             if abs(detail_item[1]) > 0.0001:
                 EntryLineAccount.objects.create(account=detail_item[0], amount=is_bill * detail_item[1], entry=self.entry, costaccounting_id=detail_item[2])
-        if Params.getvalue("invoice-vat-mode") != 0:
+        if ParamsSnapshot.getvalue("invoice-vat-mode") != 0:
             self._compute_vat(is_bill)
-        no_change, debit_rest, credit_rest = self.entry.serial_control(self.entry.get_serial())
+        no_change, debit_rest, credit_rest = self.entry.balance_control()
         if not no_change and (len(self.entry.entrylineaccount_set.all()) == 0):
             entry_empty = self.entry
             self.entry = None
@@ -1096,16 +1097,16 @@ class Detail(LucteriosModel):
         return newdetail
 
     def get_price(self):
-        if (Params.getvalue("invoice-vat-mode") == 2) and (self.vta_rate > 0.001):
+        if (ParamsSnapshot.getvalue("invoice-vat-mode") == 2) and (self.vta_rate > 0.001):
             return currency_round(self.price * self.vta_rate)
-        if (Params.getvalue("invoice-vat-mode") == 1) and (self.vta_rate < -0.001):
+        if (ParamsSnapshot.getvalue("invoice-vat-mode") == 1) and (self.vta_rate < -0.001):
             return currency_round(self.price * -1 * self.vta_rate / (1 - self.vta_rate))
         return float(self.price)
 
     def get_reduce(self):
-        if (Params.getvalue("invoice-vat-mode") == 2) and (self.vta_rate > 0.001):
+        if (ParamsSnapshot.getvalue("invoice-vat-mode") == 2) and (self.vta_rate > 0.001):
             return currency_round(self.reduce * self.vta_rate)
-        if (Params.getvalue("invoice-vat-mode") == 1) and (self.vta_rate < -0.001):
+        if (ParamsSnapshot.getvalue("invoice-vat-mode") == 1) and (self.vta_rate < -0.001):
             return currency_round(self.reduce * -1 * self.vta_rate / (1 - self.vta_rate))
         return float(self.reduce)
 
@@ -1124,7 +1125,7 @@ class Detail(LucteriosModel):
         if self.id is None:
             return None
         if self.reduce > 0.0001:
-            if Params.getvalue('invoice-reduce-with-ratio'):
+            if ParamsSnapshot.getvalue('invoice-reduce-with-ratio'):
                 red_ratio = self.reduce_ratio_txt
                 if red_ratio != '':
                     red_ratio = "(%s)" % red_ratio
@@ -1135,9 +1136,9 @@ class Detail(LucteriosModel):
             return None
 
     def get_total_ex(self):
-        if Params.getvalue("invoice-vat-mode") == 2:
+        if ParamsSnapshot.getvalue("invoice-vat-mode") == 2:
             return self.get_total_incltax()
-        elif Params.getvalue("invoice-vat-mode") == 1:
+        elif ParamsSnapshot.getvalue("invoice-vat-mode") == 1:
             return self.get_total_excltax()
         else:
             return self.get_total()
@@ -1245,7 +1246,7 @@ class StorageSheet(LucteriosModel):
 
     @property
     def provider_query(self):
-        thirdfilter = Q(accountthird__code__regex=current_system_account().get_provider_mask())
+        thirdfilter = get_mask_filter(current_system_account().get_provider_mask(), 'accountthird__code')
         return Third.objects.filter(thirdfilter).distinct()
 
     def can_delete(self):
@@ -1559,7 +1560,7 @@ def invoice_checkparam():
                                args="{'Enum':3}", value='0', param_titles=(_("invoice-vat-mode.0"), _("invoice-vat-mode.1"), _("invoice-vat-mode.2")))
     Parameter.check_and_create(name="invoice-account-third", typeparam=0, title=_("invoice-account-third"),
                                args="{'Multi':False}", value='',
-                               meta='("accounting","ChartsAccount","import diacamma.accounting.tools;django.db.models.Q(code__regex=diacamma.accounting.tools.current_system_account().get_customer_mask()) & django.db.models.Q(year__is_actif=True)", "code", True)')
+                               meta='("accounting","ChartsAccount", Q(is_customer=True) & Q(year__is_actif=True), "code", True)')
     Parameter.check_and_create(name='invoice-article-with-picture', typeparam=3, title=_("invoice-article-with-picture"), args="{}", value='False')
     Parameter.check_and_create(name='invoice-reduce-with-ratio', typeparam=3, title=_("invoice-reduce-with-ratio"), args="{}", value='True')
     Parameter.check_and_create(name='invoice-reduce-allow-article-empty', typeparam=3, title=_("invoice-reduce-allow-article-empty"), args="{}", value='True')
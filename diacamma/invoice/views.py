@@ -60,6 +60,7 @@ from diacamma.accounting.models import FiscalYear, Third, EntryLineAccount, Entr
 from diacamma.accounting.views import get_main_third
 from diacamma.accounting.views_entries import EntryAccountOpenFromLine
 from diacamma.accounting.tools import current_system_account, format_with_devise
+from diacamma.accounting.system import get_mask_filter
 from lucterios.framework.xferprinting import XferContainerPrint
 
 MenuManage.add_sub("invoice", None, "diacamma.invoice/images/invoice.png", _("Invoice"), _("Manage of billing"), 45)
@@ -850,7 +851,7 @@ class BillAccountChecking(XferContainerCustom):
         for bill in Bill.objects.filter(fiscal_year=self.item.fiscal_year, status__in=(1, 2, 3), bill_type__in=(1, 2, 3)):
             account_amount = None
             if bill.entry is not None:
-                account_amount = bill.entry.entrylineaccount_set.filter(account__code__regex=current_system_account().get_customer_mask()).aggregate(Sum('amount'))['amount__sum']
+                account_amount = bill.entry.entrylineaccount_set.filter(account__is_customer=True).aggregate(Sum('amount'))['amount__sum']
                 if (bill.bill_type == 2):
                     account_amount = -1 * account_amount
             if ((account_amount is None) and (abs(bill.total) > 1e-4)) or ((account_amount is not None) and (abs(account_amount - bill.total) > 1e-4)):
@@ -880,7 +881,7 @@ class BillAccountChecking(XferContainerCustom):
         grid.add_header("account", _("account amount"), htype=format_with_devise(7))
         for payoff in payoff_nodeposit:
             payoffid = payoff['id']
-            account_amount = EntryAccount.objects.get(id=payoffid).entrylineaccount_set.filter(account__code__regex=current_system_account().get_customer_mask()).aggregate(Sum('amount'))['amount__sum']
+            account_amount = EntryAccount.objects.get(id=payoffid).entrylineaccount_set.filter(account__is_customer=True).aggregate(Sum('amount'))['amount__sum']
             if payoff['is_revenu']:
                 account_amount = -1 * account_amount
             if ((account_amount is None) and (abs(payoff['amount']) > 1e-4)) or ((account_amount is not None) and (abs(account_amount - float(payoff['amount'])) > 1e-4)):
@@ -905,7 +906,7 @@ class BillAccountChecking(XferContainerCustom):
         grid = XferCompGrid("entryline")
         entry_lines = EntryLineAccount.objects.filter(entry__journal__gt=1,
                                                       entry__year=self.item.fiscal_year,
-                                                      account__code__regex=current_system_account().get_customer_mask()).annotate(billcount=Count('entry__bill')).annotate(payoffcount=Count('entry__payoff'))
+                                                      account__is_customer=True).annotate(billcount=Count('entry__bill')).annotate(payoffcount=Count('entry__payoff'))
         grid.set_model(entry_lines.filter(billcount=0, payoffcount=0), None)
         grid.add_action(self.request, EntryAccountOpenFromLine.get_action(_('Entry'), "diacamma.accounting/images/financial.png"), close=CLOSE_NO, unique=SELECT_SINGLE)
         grid.set_location(0, 1, 3)
@@ -1064,7 +1065,7 @@ def show_contact_invoice(contact, xfer):
     if WrapAction.is_permission(xfer.request, 'invoice.change_bill'):
         third = get_main_third(contact)
         if third is not None:
-            accounts = third.accountthird_set.filter(Q(code__regex=current_system_account().get_customer_mask()))
+            accounts = third.accountthird_set.filter(get_mask_filter(current_system_account().get_customer_mask()))
             if len(accounts) > 0:
                 xfer.new_tab(_("Financial"))
                 nb_build = len(Bill.objects.filter(third=third, status=0))
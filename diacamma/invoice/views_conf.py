@@ -33,13 +33,14 @@ from lucterios.framework.tools import FORMTYPE_NOMODAL, ActionsManage, MenuManag
 from lucterios.framework.xfercomponents import XferCompButton
 from lucterios.framework import signal_and_lock
 from lucterios.CORE.parameters import Params
-from lucterios.CORE.views import ParamEdit, ObjectImport
+from lucterios.CORE.views import ParamEdit
 from lucterios.CORE.models import Parameter
 
 from diacamma.accounting.tools import correct_accounting_code
 from diacamma.invoice.models import Vat, Article, Category, StorageArea,\
     AccountPosting, AutomaticReduce
 from diacamma.accounting.system import accounting_system_ident
+from diacamma.accounting.views_entries import CheckpointedImport
 from lucterios.contacts.models import CustomField
 
 
@@ -200,7 +201,7 @@ class CategoryDel(XferDelete):
 
 
 @MenuManage.describ('contacts.add_article', FORMTYPE_MODAL, 'financial.conf', _('Tool to import articles from CSV file.'))
-class ArticleImport(ObjectImport):
+class ArticleImport(CheckpointedImport):
     caption = _("Article import")
     icon = "invoice_conf.png"
 
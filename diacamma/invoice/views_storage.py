@@ -35,12 +35,12 @@ from lucterios.framework.xferadvance import XferListEditor, XferAddEditor, XferD
     TITLE_OK, TITLE_CANCEL, TITLE_CREATE
 
 from lucterios.CORE.xferprint import XferPrintAction
-from lucterios.CORE.views import ObjectImport
 from lucterios.framework.xfercomponents import XferCompLabelForm, XferCompGrid, XferCompSelect, XferCompCheckList, GRID_ORDER, XferCompDate,\
     XferCompEdit, XferCompImage
 from lucterios.framework.xferbasic import NULL_VALUE
 
 from diacamma.accounting.tools import format_with_devise
+from diacamma.accounting.views_entries import CheckpointedImport
 from diacamma.invoice.models import StorageSheet, StorageDetail, Article, Category, StorageArea
 
 
@@ -185,24 +185,22 @@ class StorageDetailDel(XferDelete):
 
 @MenuManage.describ('contacts.add_vat')
 @ActionsManage.affect_grid(_('Import'), "images/up.png", unique=SELECT_NONE, condition=lambda xfer, gridname='': hasattr(xfer.item, 'status') and (int(xfer.item.status) == 0) and (int(xfer.item.sheet_type) == 0))
-class StorageDetailImport(ObjectImport):
+class StorageDetailImport(CheckpointedImport):
     caption = _("Storage detail import")
     icon = "storagesheet.png"
     model = StorageDetail
+    skip_duplicate = True
 
     def get_select_models(self):
         return StorageDetail.get_select_contact_type(True)
 
-    def _read_csv_and_convert(self):
-        fields_description, csv_readed = ObjectImport._read_csv_and_convert(self)
-        new_csv_readed = []
-        for csv_readed_item in csv_readed:
-            csv_readed_item['storagesheet_id'] = self.getparam("storagesheet", 0)
-            new_csv_readed.append(csv_readed_item)
-        return fields_description, new_csv_readed
+    def _convert_record(self, fields_association, fields_description, row):
+        new_row = CheckpointedImport._convert_record(self, fields_association, fields_description, row)
+        new_row['storagesheet_id'] = self.getparam("storagesheet", 0)
+        return new_row
 
     def fillresponse(self, modelname, quotechar="'", delimiter=";", encoding="utf-8", dateformat="%d/%m/%Y", step=0):
-        ObjectImport.fillresponse(self, modelname, quotechar, delimiter, encoding, dateformat, step)
+        CheckpointedImport.fillresponse(self, modelname, quotechar, delimiter, encoding, dateformat, step)
         if step != 3:
             self.move(0, 0, 1)
             self.tab = 0
@@ -37,7 +37,6 @@ from lucterios.contacts.models import LegalEntity
 
 from diacamma.payoff.models import Supporting
 from diacamma.accounting.models import FiscalYear
-from diacamma.accounting.tools import current_system_account
 
 
 class SupportingEditor(LucteriosEditor):
@@ -121,7 +120,7 @@ class BankAccountEditor(LucteriosEditor):
         sel_code = XferCompSelect("account_code")
         sel_code.description = old_account.description
         sel_code.set_location(old_account.col, old_account.row, old_account.colspan + 1, old_account.rowspan)
-        for item in FiscalYear.get_current().chartsaccount_set.all().filter(code__regex=current_system_account().get_cash_mask()).order_by('code'):
+        for item in FiscalYear.get_current().chartsaccount_set.all().filter(is_cash=True).order_by('code'):
             sel_code.select_list.append((item.code, six.text_type(item)))
         sel_code.set_value(self.item.account_code)
         xfer.add_component(sel_code)
@@ -55,6 +55,7 @@ from lucterios.documents.models import DocumentContainer
 from diacamma.accounting.models import EntryAccount, FiscalYear, Third, Journal, \
     ChartsAccount, EntryLineAccount, AccountLink
 from diacamma.accounting.tools import currency_round, correct_accounting_code, format_with_devise
+from diacamma.accounting.system import get_mask_filter
 
 
 class Supporting(LucteriosModel):
@@ -133,7 +134,7 @@ class Supporting(LucteriosModel):
             if self.third is None:
                 info.append(six.text_type(_("no third selected")))
             else:
-                accounts = self.third.accountthird_set.filter(code__regex=third_mask)
+                accounts = self.third.accountthird_set.filter(get_mask_filter(third_mask))
                 try:
                     if (len(accounts) == 0) or (ChartsAccount.get_account(accounts[0].code, FiscalYear.get_current()) is None):
                         info.append(six.text_type(_("third has not correct account")))
@@ -152,7 +153,7 @@ class Supporting(LucteriosModel):
     def get_third_account(self, third_mask, fiscalyear, third=None):
         if third is None:
             third = self.third
-        accounts = third.accountthird_set.filter(code__regex=third_mask)
+        accounts = third.accountthird_set.filter(get_mask_filter(third_mask))
         if len(accounts) == 0:
             raise LucteriosException(
                 IMPORTANT, _("third has not correct account"))
@@ -884,8 +885,10 @@ class BankTransaction(LucteriosModel):
 
 
 def check_payoff_accounting():
-    for entry in EntryAccount.objects.filter(close=False, journal_id=4):
-        _no_change, debit_rest, credit_rest = entry.serial_control(entry.get_serial())
+    entries = EntryAccount.objects.filter(close=False, journal_id=4)
+    balance_controls = EntryAccount.get_balance_controls(entries)
+    for entry in entries:
+        _no_change, debit_rest, credit_rest = balance_controls.get(entry.id, (False, 0.0, 0.0))
         payoff_list = entry.payoff_set.all()
         if abs(debit_rest - credit_rest) > 0.0001:
             if len(payoff_list) > 0:
@@ -935,7 +938,7 @@ def payoff_checkparam():
     Parameter.check_and_create(name='payoff-bankcharges-account', typeparam=0, title=_("payoff-bankcharges-account"),
                                args="{'Multi':False}", value='', meta='("accounting","ChartsAccount", Q(type_of_account=4) & Q(year__is_actif=True), "code", False)')
     Parameter.check_and_create(name='payoff-cash-account', typeparam=0, title=_("payoff-cash-account"),
-                               args="{'Multi':False}", value='', meta='("accounting","ChartsAccount","import diacamma.accounting.tools;django.db.models.Q(code__regex=diacamma.accounting.tools.current_system_account().get_cash_mask()) & django.db.models.Q(year__is_actif=True)", "code", True)')
+                               args="{'Multi':False}", value='', meta='("accounting","ChartsAccount", Q(is_cash=True) & Q(year__is_actif=True), "code", True)')
     Parameter.check_and_create(name='payoff-email-message', typeparam=0, title=_("payoff-email-message"),
                                args="{'Multi':True, 'HyperText': True}", value=_('#name{[br/]}{[br/]}Joint in this email #doc.{[br/]}{[br/]}Regards'))
     Parameter.check_and_create(name='payoff-email-subject', typeparam=0, title=_("payoff-email-subject"),
@@ -28,9 +28,7 @@ import logging
 
 from django.http.response import HttpResponseRedirect
 from django.utils.translation import ugettext_lazy as _
-from django.db.models.functions import Concat
-from django.db.models.query import QuerySet
-from django.db.models import Q, Value
+from django.db.models import Q
 from django.conf import settings
 from django.utils import six, timezone
 from django.apps.registry import apps
@@ -55,6 +53,7 @@ from lucterios.CORE.xferprint import XferPrintReporting
 
 from diacamma.payoff.models import Payoff, Supporting, PaymentMethod, BankTransaction
 from diacamma.accounting.models import Third
+from diacamma.accounting.system import get_mask_filter
 from lucterios.framework.xferprinting import XferContainerPrint
 
 
@@ -128,7 +127,9 @@ class SupportingThird(XferListEditor):
         self.code_mask = ''
 
     def get_items_from_filter(self):
-        items = self.model.objects.annotate(completename=Concat('contact__individual__lastname', Value(' '), 'contact__individual__firstname')).filter(self.filter)
+        items = self.model.objects.filter(self.filter).distinct()
+        if self.getparam('show_filter', 0) != 0:
+            items = Third.annotate_total(items, self.getparam('show_filter', 0) == 2)
         sort_third = self.getparam('GRID_ORDER%third', '')
         sort_thirdbis = self.getparam('GRID_ORDER%third+', '')
         self.params['GRID_ORDER%third'] = ""
@@ -138,12 +139,7 @@ class SupportingThird(XferListEditor):
             else:
                 sort_thirdbis = "-"
             self.params['GRID_ORDER%third+'] = sort_thirdbis
-        items = sorted(items, key=lambda t: six.text_type(t).lower(), reverse=sort_thirdbis.startswith('-'))
-        if self.getparam('show_filter', 0) == 2:
-            items = [item for item in items if abs(item.get_total()) > 0.0001]
-        res = QuerySet(model=Third)
-        res._result_cache = items
-        return res
+        return items.order_by('-sort_name' if sort_thirdbis.startswith('-') else 'sort_name')
 
     def fillresponse_header(self):
         if 'status_filter' in self.params:
@@ -158,11 +154,9 @@ class SupportingThird(XferListEditor):
         self.add_component(comp)
         self.filter = Q(status=0)
         if self.code_mask != '':
-            self.filter &= Q(accountthird__code__regex=self.code_mask)
+            self.filter &= get_mask_filter(self.code_mask, 'accountthird__code')
         if contact_filter != "":
-            q_legalentity = Q(contact__legalentity__name__icontains=contact_filter)
-            q_individual = (Q(contact__individual__firstname__icontains=contact_filter) | Q(contact__individual__lastname__icontains=contact_filter))
-            self.filter &= (q_legalentity | q_individual)
+            self.filter &= Q(sort_name__contains=Third.normalize_name(contact_filter))
 
     def fillresponse(self, code_mask=''):
         self.code_mask = code_mask